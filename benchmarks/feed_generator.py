@@ -0,0 +1,200 @@
+"""
+Generates synthetic YML feeds shaped like the marketplace exports in `data/`.
+
+Offers come in product groups whose variants differ in color, memory and price, so the matching phase has real
+neighbours to find. Names, descriptions and params are Russian. The same arguments and seed always give the same
+file. A `.gz` suffix writes a gzip-compressed feed.
+
+Run from the repository root:
+
+    python -m benchmarks.feed_generator data/bench_100k.xml --offers 100000
+"""
+
+import argparse
+import gzip
+import os
+import random
+from dataclasses import dataclass
+from typing import TextIO
+from xml.sax.saxutils import escape, quoteattr
+
+# fmt: off
+CATEGORY_WORDS = [
+    "Электроника", "Телефоны", "Смартфоны", "Аксессуары", "Компьютеры", "Ноутбуки", "Планшеты", "Мониторы",
+    "Бытовая техника", "Кухня", "Климат", "Пылесосы", "Фото", "Видеокамеры", "Аудио", "Наушники", "Колонки",
+    "Игровые приставки", "Умный дом", "Освещение", "Инструменты", "Сад", "Спорт", "Туризм", "Детям", "Игрушки",
+    "Красота", "Здоровье", "Автотовары", "Зоотовары", "Канцелярия", "Мебель", "Текстиль", "Посуда", "Хранение",
+]
+PRODUCT_TYPES = [
+    "Смартфон", "Ноутбук", "Планшет", "Наушники", "Колонка", "Телевизор", "Монитор", "Пылесос", "Чайник",
+    "Кофемашина", "Фотоаппарат", "Объектив", "Роутер", "Часы", "Фитнес-браслет", "Клавиатура", "Мышь",
+    "Микроволновая печь", "Увлажнитель", "Электробритва", "Фен", "Игровая консоль", "Видеорегистратор",
+]
+VENDORS = [
+    "Samsung", "Apple", "Xiaomi", "Huawei", "Honor", "Realme", "Sony", "LG", "Philips", "Bosch", "Redmond",
+    "Polaris", "Tefal", "Lenovo", "ASUS", "Acer", "HP", "Dell", "JBL", "Marshall", "Canon", "Nikon", "TP-Link",
+    "Dreame", "Dyson", "Garmin", "Logitech", "Defender", "Ritmix", "Яндекс", "Витязь", "Скайлайн",
+]
+# fmt: on
+COLORS = ["черный", "белый", "серый", "синий", "зеленый", "красный", "золотистый", "серебристый", "фиолетовый"]
+MEMORY = ["64 ГБ", "128 ГБ", "256 ГБ", "512 ГБ", "1 ТБ"]
+PARAMS = {
+    "Цвет": COLORS,
+    "Материал корпуса": ["пластик", "металл", "стекло", "алюминий", "ткань"],
+    "Гарантийный срок": ["6 мес.", "1 год", "2 года", "3 года"],
+    "Страна производства": ["Китай", "Вьетнам", "Россия", "Корея", "Малайзия"],
+    "Тип питания": ["от сети", "от аккумулятора", "от батареек", "USB"],
+    "Беспроводная связь": ["Wi-Fi", "Bluetooth", "Wi-Fi, Bluetooth", "нет"],
+    "Вес": [f"{weight} г" for weight in range(50, 3000, 50)],
+    "Комплектация": ["кабель", "чехол", "зарядное устройство", "документация"],
+}
+DESCRIPTION_WORDS = (
+    "устройство отличный выбор для дома и работы высокая производительность надежный корпус удобное управление "
+    "яркий экран долгая работа от аккумулятора быстрая зарядка современный дизайн тихая работа компактные размеры "
+    "экономичное энергопотребление качественная сборка поддержка обновлений интуитивный интерфейс широкие "
+    "возможности настройки защита от влаги и пыли высокая точность стильный внешний вид доступная цена гарантия"
+).split()
+
+
+@dataclass
+class FeedStats:
+    offers: int = 0
+    categories: int = 0
+    groups: int = 0
+    # Size of the file as written, compressed for a .gz feed
+    bytes_written: int = 0
+
+
+def generate_feed(
+    path: str,
+    offers: int = 10000,
+    categories: int = 500,
+    depth: int = 5,
+    params: int = 4,
+    description_words: int = 80,
+    variants: int = 4,
+    seed: int = 0,
+) -> FeedStats:
+    """
+    Writes a feed of `offers` offers in `categories` categories nested up to `depth` levels.
+
+    Offers have `params` params and a description of about `description_words` words, and come in groups of up to
+    `variants` offers of the same product.
+    """
+    rng = random.Random(seed)
+    stats = FeedStats()
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "wt", encoding="utf-8") as out:
+        out.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        out.write('<yml_catalog date="17 Oct 2026 10:00:00">\n<shop><name>Benchmark Market</name>\n')
+        out.write('<currencies><currency id="RUB" rate="1"/></currencies>\n<categories>\n')
+        leaves = _write_categories(out, rng, categories, depth, stats)
+        out.write("</categories>\n<offers>\n")
+        _write_offers(out, rng, leaves, offers, params, description_words, variants, stats)
+        out.write("</offers>\n</shop>\n</yml_catalog>\n")
+    stats.bytes_written = os.path.getsize(path)
+    return stats
+
+
+def _write_categories(out: TextIO, rng: random.Random, count: int, depth: int, stats: FeedStats) -> list[int]:
+    next_id = 90401
+    out.write(f'<category id="{next_id}">Все товары</category>\n')
+    levels: list[list[int]] = [[next_id]]
+    leaves: set[int] = {next_id}
+    for _ in range(count - 1):
+        # New categories go under a random category of a random level, the deeper levels grow bushier
+        level = rng.randrange(min(len(levels), depth - 1))
+        parent_id = rng.choice(levels[level])
+        next_id += rng.randint(1, 500)
+        name = f"{rng.choice(CATEGORY_WORDS)} {rng.randint(1, 99)}"
+        out.write(f'<category id="{next_id}" parentId="{parent_id}">{escape(name)}</category>\n')
+        if level + 1 == len(levels):
+            levels.append([])
+        levels[level + 1].append(next_id)
+        leaves.discard(parent_id)
+        leaves.add(next_id)
+    stats.categories = count
+    return sorted(leaves)
+
+
+def _write_offers(
+    out: TextIO,
+    rng: random.Random,
+    leaves: list[int],
+    count: int,
+    params: int,
+    description_words: int,
+    variants: int,
+    stats: FeedStats,
+) -> None:
+    offer_id = 100000000000
+    while stats.offers < count:
+        stats.groups += 1
+        group_id = 1600000000 + stats.groups
+        product_type = rng.choice(PRODUCT_TYPES)
+        vendor = rng.choice(VENDORS)
+        model = f"{rng.choice('ABCDEFGHKMNPRSTVXZ')}{rng.randint(1, 99)}{rng.choice(['', ' Pro', ' Lite', ' Max'])}"
+        category_id = rng.choice(leaves)
+        base_price = rng.randint(5, 2000) * 100
+        description = " ".join(rng.choice(DESCRIPTION_WORDS) for _ in range(description_words)).capitalize()
+        group_params = rng.sample(sorted(PARAMS), min(params, len(PARAMS)))
+
+        for _ in range(min(rng.randint(1, variants), count - stats.offers)):
+            offer_id += rng.randint(1, 100000)
+            color = rng.choice(COLORS)
+            name = f"{product_type} {vendor} {model} {rng.choice(MEMORY)}, {color}"
+            param_values = {param: rng.choice(PARAMS[param]) for param in group_params}
+            if "Цвет" in param_values:
+                param_values["Цвет"] = color
+            out.write(
+                f'<offer id="{offer_id}" available="true">'
+                f"<barcode>{_ean13(rng)}</barcode>"
+                f"<categoryId>{category_id}</categoryId>"
+                "<currencyId>RUB</currencyId>"
+                f"<description>{escape(description)}</description>"
+                f"<group_id>{group_id}</group_id>"
+                f"<name>{escape(name)}</name>"
+                + "".join(
+                    f"<param name={quoteattr(key)}>{escape(value)}</param>" for key, value in param_values.items()
+                )
+                + f"<picture>https://avatars.mds.yandex.net/get-mpic/{group_id}/img_{offer_id}.png/9</picture>"
+                f"<price>{base_price + rng.randint(-base_price // 10, base_price // 10)}</price>"
+                f"<vendor>{escape(vendor)}</vendor>"
+                "</offer>\n"
+            )
+            stats.offers += 1
+
+
+def _ean13(rng: random.Random) -> str:
+    digits = [rng.randint(0, 9) for _ in range(12)]
+    checksum = (10 - sum(digit * (3 if i % 2 else 1) for i, digit in enumerate(digits)) % 10) % 10
+    return "".join(map(str, digits)) + str(checksum)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="file to write, a .gz suffix compresses it")
+    parser.add_argument("--offers", type=int, default=10000)
+    parser.add_argument("--categories", type=int, default=500)
+    parser.add_argument("--depth", type=int, default=5, help="maximum depth of the category tree")
+    parser.add_argument("--params", type=int, default=4, help="params per offer")
+    parser.add_argument("--description-words", type=int, default=80)
+    parser.add_argument("--variants", type=int, default=4, help="maximum offers per product group")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    stats = generate_feed(
+        args.path,
+        offers=args.offers,
+        categories=args.categories,
+        depth=args.depth,
+        params=args.params,
+        description_words=args.description_words,
+        variants=args.variants,
+        seed=args.seed,
+    )
+    print(f"{stats.offers} offers in {stats.groups} groups, {stats.categories} categories -> {args.path}")
+
+
+if __name__ == "__main__":
+    main()
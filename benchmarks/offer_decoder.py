@@ -0,0 +1,80 @@
+"""
+Compares the single-pass offer decoder with the `findtext` lookups it replaced.
+
+Run from the repository root:
+
+    python -m benchmarks.offer_decoder --scale 50
+"""
+
+import argparse
+import time
+from typing import Any, Callable
+
+from lxml import etree
+
+from src.parsers.xml_parser import decode_offer, parse_offer
+
+
+def parse_offer_findtext(elem: etree._Element) -> dict[str, Any]:
+    return {
+        "offer_id": elem.get("id"),
+        "name": elem.findtext("name"),
+        "description": elem.findtext("description"),
+        "vendor": elem.findtext("vendor"),
+        "barcode": elem.findtext("barcode"),
+        "category_id": elem.findtext("categoryId"),
+        "currency_id": elem.findtext("currencyId"),
+        "price": elem.findtext("price"),
+        "params": {param.get("name"): param.text for param in elem.findall("param")},
+        "picture": elem.findtext("picture"),
+    }
+
+
+def scale_feed(xml_file: str, scale: int) -> bytes:
+    """
+    Repeats the `<offers>` content of a feed `scale` times.
+    """
+    with open(xml_file, "rb") as f:
+        data = f.read()
+    head, rest = data.split(b"<offers>", 1)
+    offers, tail = rest.rsplit(b"</offers>", 1)
+    return head + b"<offers>" + offers * scale + b"</offers>" + tail
+
+
+def measure(decoder: Callable[[etree._Element], Any], offers: list[etree._Element], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        for offer in offers:
+            decoder(offer)
+        best = min(best, time.perf_counter() - started_at)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--feed", default="data/test.xml", help="feed whose offers are decoded")
+    parser.add_argument("--scale", type=int, default=20, help="times the offers of the feed are repeated")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per decoder, the fastest one is reported")
+    args = parser.parse_args()
+
+    root = etree.fromstring(scale_feed(args.feed, args.scale))
+    offers = root.findall(".//offer")
+    mismatches = sum(parse_offer(offer) != parse_offer_findtext(offer) for offer in offers)
+    print(f"{len(offers)} offers, {mismatches} decoded differently")
+
+    baseline = measure(parse_offer_findtext, offers, args.repeat)
+    for name, decoder in (
+        ("findtext", parse_offer_findtext),
+        ("parse_offer", parse_offer),
+        ("decode_offer", decode_offer),
+    ):
+        elapsed = baseline if decoder is parse_offer_findtext else measure(decoder, offers, args.repeat)
+        print(
+            f"{name:>13}: {elapsed / len(offers) * 1e6:6.2f} us/offer, "
+            f"{len(offers) / elapsed:9.0f} offers/s, x{baseline / elapsed:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
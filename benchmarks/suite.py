@@ -0,0 +1,228 @@
+"""
+End-to-end benchmark of the import on a synthetic feed, with a machine-readable report.
+
+Backends:
+
+- `offline` needs no services: parses the feed, builds the rows and content hashes written to Postgres and
+  matches the SKUs with the local similarity backend (when numpy and scipy are installed).
+- `services` runs a real import job (`process_xml_file`: ingestion and similarity) against the Postgres and
+  Elasticsearch configured in the environment, e.g. the `docker compose up postgres elasticsearch` containers,
+  followed by `/sku` reads. It replaces the catalog in that database.
+
+Every phase reports its duration, items per second and the peak RSS of the process so far. Run from the
+repository root:
+
+    python -m benchmarks.suite --offers 100000 --backend offline --report report.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import asdict
+from typing import Any
+
+from benchmarks.feed_generator import generate_feed
+from src.config import get_app_settings
+from src.models.src import SKU
+from src.parsers.xml_parser import XMLFeed
+from src.services.ingestion_service import build_sku_data
+from src.services.local_similarity_service import CatalogVectors
+from src.services.sku_service import SKUService
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux; parse worker processes count as children
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(usage, children) / 1024, 1)
+
+
+def phase_result(seconds: float, items: int, **extra: Any) -> dict[str, Any]:
+    return {
+        "seconds": round(seconds, 3),
+        "items": items,
+        "items_per_second": round(items / seconds, 1) if seconds > 0 else None,
+        "peak_rss_mb": peak_rss_mb(),
+        **extra,
+    }
+
+
+def latency_summary(latencies: list[float]) -> dict[str, float]:
+    ordered = sorted(latencies)
+    return {
+        "p50_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(ordered[int(len(ordered) * 0.95) - 1] * 1000, 3),
+        "p99_ms": round(ordered[int(len(ordered) * 0.99) - 1] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def run_offline(feed_path: str, similarity_chunk_size: int, similarity_top_k: int) -> dict[str, Any]:
+    phases: dict[str, Any] = {}
+
+    started_at = time.perf_counter()
+    feed = XMLFeed(feed_path)
+    offers = sum(1 for _ in feed.offers())
+    phases["parse"] = phase_result(time.perf_counter() - started_at, offers)
+
+    # The parse pass again, now building what the DB writers write
+    started_at = time.perf_counter()
+    feed = XMLFeed(feed_path)
+    skus: list[SKU] = []
+    for offer_data in feed.offers():
+        row = SKUService.build_row(build_sku_data(offer_data, feed.category_tree))
+        skus.append(SKU(uuid=row["uuid"], title=row["title"], description=row["description"], brand=row["brand"]))
+    phases["transform"] = phase_result(time.perf_counter() - started_at, len(skus), includes="parse")
+
+    # The local similarity backend, Elasticsearch matching only runs with the services backend
+    try:
+        catalog = CatalogVectors()
+    except ValueError as e:
+        phases["similarity"] = {"skipped": str(e)}
+        return phases
+    started_at = time.perf_counter()
+    catalog.add(skus)
+    catalog.finish()
+    phases["similarity.vectors"] = phase_result(time.perf_counter() - started_at, len(skus))
+    started_at = time.perf_counter()
+    for start in range(0, len(skus), similarity_chunk_size):
+        chunk = skus[start : start + similarity_chunk_size]
+        catalog.top_neighbours(catalog.vectorize(chunk), [str(sku.uuid) for sku in chunk], similarity_top_k)
+    phases["similarity.match"] = phase_result(time.perf_counter() - started_at, len(skus))
+    return phases
+
+
+async def run_services(feed_path: str, mode: str, reads: int) -> dict[str, Any]:
+    from sqlalchemy import func, select
+
+    import src.main as app
+    from src.database import get_db
+    from src.schemas import JobStatus
+    from src.services.job_service import JobService
+
+    phases: dict[str, Any] = {}
+    job_id = str(uuid.uuid4())
+    async for session in get_db():
+        async with session.begin():
+            await JobService(session).create_job(job_id, feed_path, mode)
+
+    try:
+        started_at = time.perf_counter()
+        await app.process_xml_file(job_id)
+        job_seconds = time.perf_counter() - started_at
+        job = await app.load_job(job_id)
+        metrics = app.job_metrics[job_id]
+        if job is None or metrics.status != JobStatus.COMPLETED.value:
+            raise RuntimeError(f"Job {job_id} did not complete: {job.error if job else 'not found'}")
+
+        phases["job"] = phase_result(job_seconds, job.rows, rows_per_second=job.rows_per_second)
+        for stage in metrics.stages.values():
+            phases[f"job.{stage.name}"] = phase_result(stage.elapsed, stage.items)
+
+        async for session in get_db():
+            result = await session.execute(select(SKU.uuid).order_by(func.random()).limit(reads))
+            uuids = [str(sku_uuid) for sku_uuid in result.scalars()]
+        if uuids:
+            await app.sku_cache.clear()
+            for name in ("sku_read_cold", "sku_read_cached"):
+                latencies: list[float] = []
+                started_at = time.perf_counter()
+                for sku_uuid in uuids:
+                    request_started_at = time.perf_counter()
+                    await app.get_sku(sku_uuid)
+                    latencies.append(time.perf_counter() - request_started_at)
+                phases[name] = phase_result(time.perf_counter() - started_at, len(uuids), **latency_summary(latencies))
+    finally:
+        await app.es_service.close()
+    return phases
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=("offline", "services"), default="offline")
+    parser.add_argument("--feed", help="existing feed to use instead of generating one")
+    parser.add_argument("--offers", type=int, default=100000)
+    parser.add_argument("--categories", type=int, default=2000)
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--params", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mode", choices=("full", "incremental"), default="full", help="import mode (services)")
+    parser.add_argument("--reads", type=int, default=1000, help="/sku reads after the import (services)")
+    parser.add_argument("--report", help="file to write the JSON report to, stdout by default")
+    args = parser.parse_args()
+
+    settings = get_app_settings()
+    report: dict[str, Any] = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "backend": args.backend,
+        "settings": {
+            name: getattr(settings, name)
+            for name in (
+                "SKU_BATCH_SIZE",
+                "INGEST_QUEUE_SIZE",
+                "INGEST_DB_WRITERS",
+                "XML_PARSE_PROCESSES",
+                "ES_BULK_CHUNK_SIZE",
+                "ES_BULK_MAX_CONCURRENCY",
+                "SIMILARITY_BACKEND",
+                "SIMILARITY_CHUNK_SIZE",
+                "SIMILARITY_TOP_K",
+                "LOCAL_SIMILARITY_PROCESSES",
+            )
+        },
+        "feed": None,
+        "phases": {},
+    }
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        feed_path = args.feed
+        if feed_path is None:
+            feed_path = os.path.join(temp_dir, "feed.xml")
+            started_at = time.perf_counter()
+            stats = generate_feed(
+                feed_path,
+                offers=args.offers,
+                categories=args.categories,
+                depth=args.depth,
+                params=args.params,
+                seed=args.seed,
+            )
+            report["feed"] = {"generated": True, "seed": args.seed, "depth": args.depth, **asdict(stats)}
+            report["phases"]["generate"] = phase_result(time.perf_counter() - started_at, stats.offers)
+        else:
+            report["feed"] = {"generated": False, "path": feed_path, "bytes_written": os.path.getsize(feed_path)}
+
+        if args.backend == "offline":
+            report["phases"].update(run_offline(feed_path, settings.SIMILARITY_CHUNK_SIZE, settings.SIMILARITY_TOP_K))
+        else:
+            report["phases"].update(asyncio.run(run_services(feed_path, args.mode, args.reads)))
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
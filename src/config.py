@@ -1,6 +1,6 @@
 import logging
 from functools import lru_cache
-from typing import Any
+from typing import Any, Literal
 
 from pydantic import field_validator
 from pydantic_settings import BaseSettings
@@ -23,8 +23,70 @@ class AppSettings(BaseSettings):
     ELASTIC_HOST: str = "localhost"
     ELASTIC_PORT: int = 9200
 
+    ES_BULK_CHUNK_SIZE: int = 1000
+    ES_BULK_MAX_CHUNK_BYTES: int = 10 * 1024 * 1024
+    ES_BULK_MAX_CONCURRENCY: int = 4
+    ES_BULK_MAX_RETRIES: int = 3
+    # Index generations kept behind the products alias, including the live one
+    ES_INDEX_GENERATIONS: int = 2
+    ES_FORCE_MERGE: bool = True
+
     SQL_SHOW_QUERY: bool = False
 
+    MAX_CONCURRENT_JOBS: int = 1
+    # Finished jobs stay in the progress endpoints' live state and in /metrics this many seconds, at most this many
+    JOB_METRICS_RETENTION: float = 3600.0
+    JOB_METRICS_MAX_FINISHED: int = 100
+    IMPORT_DB_POOL_SIZE: int = 8
+    # Seconds a job waits for a connection of the import pool before failing
+    IMPORT_DB_POOL_TIMEOUT: float = 300.0
+
+    SKU_BATCH_SIZE: int = 5000
+    INGEST_QUEUE_SIZE: int = 4
+    INGEST_DB_WRITERS: int = 2
+    # More than one process switches to sharded parsing of the <offers> section
+    XML_PARSE_PROCESSES: int = 1
+    XML_SHARD_SIZE: int = 16 * 1024 * 1024
+    # Seconds between checkpoints of a running import, each one waits for Elasticsearch to acknowledge
+    IMPORT_CHECKPOINT_INTERVAL: float = 30.0
+    # Seconds a job reading a feed that is still being uploaded waits for more data before failing
+    UPLOAD_IDLE_TIMEOUT: float = 600.0
+
+    # `elasticsearch` runs more_like_this queries, `local` matches TF-IDF vectors in this process (numpy, scipy)
+    SIMILARITY_BACKEND: Literal["elasticsearch", "local"] = "elasticsearch"
+    # Candidate blocks from the narrowest, a SKU is matched within the first of its blocks holding at least
+    # SIMILARITY_MIN_BLOCK_SIZE SKUs; empty to match against the whole catalog
+    SIMILARITY_BLOCKS: list[str] = [
+        "category_id,brand",
+        "category_id",
+        "category_lvl_3",
+        "category_lvl_2",
+        "category_lvl_1",
+    ]
+    SIMILARITY_MIN_BLOCK_SIZE: int = 50
+    # SKUs sharing a barcode or a brand and title are linked without matching, in groups of at most this many SKUs;
+    # 0 matches every SKU
+    SIMILARITY_MAX_DUPLICATE_GROUP: int = 100
+    # Similar SKUs stored per SKU in `sku_similarity`, `similar_sku` keeps the first 5
+    SIMILARITY_TOP_K: int = 10
+    SIMILARITY_CHUNK_SIZE: int = 2000
+    SIMILARITY_MSEARCH_BATCH_SIZE: int = 100
+    SIMILARITY_MAX_CONCURRENCY: int = 4
+    LOCAL_SIMILARITY_PROCESSES: int = 1
+
+    # Seconds between two stack samples of a job started with profile sampling
+    PROFILE_SAMPLE_INTERVAL: float = 0.01
+
+    SKU_CACHE_MAX_SIZE: int = 100000
+    SKU_CACHE_TTL: float = 300.0
+    SKU_LOOKUP_MAX_BATCH: int = 5000
+
+    SEARCH_MAX_SIZE: int = 100
+    # Values per facet of the first page of a search
+    SEARCH_FACET_SIZE: int = 20
+    SEARCH_CACHE_MAX_SIZE: int = 10000
+    SEARCH_CACHE_TTL: float = 30.0
+
     @field_validator("DB_URL", mode="before")
     def get_database_url(cls, v: str | None, info: Any) -> str:
         if isinstance(v, str) and v:
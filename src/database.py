@@ -12,6 +12,15 @@ logger = logging.getLogger(__name__)
 settings = get_app_settings()
 
 async_engine = create_async_engine(settings.DB_URL, future=True, echo=settings.SQL_SHOW_QUERY)
+# Import jobs get a capped pool of their own, so however many of them run the API keeps its connections
+import_engine = create_async_engine(
+    settings.DB_URL,
+    future=True,
+    echo=settings.SQL_SHOW_QUERY,
+    pool_size=settings.IMPORT_DB_POOL_SIZE,
+    max_overflow=0,
+    pool_timeout=settings.IMPORT_DB_POOL_TIMEOUT,
+)
 
 Session = sessionmaker(  # type: ignore
     bind=async_engine,
@@ -20,6 +29,13 @@ Session = sessionmaker(  # type: ignore
     autocommit=False,
     autoflush=False,
 )
+ImportSession = sessionmaker(  # type: ignore
+    bind=import_engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+    autocommit=False,
+    autoflush=False,
+)
 
 
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
@@ -30,3 +46,13 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
             await session.rollback()
             logger.error("Get sqlalchemy error")
             raise exc
+
+
+async def get_import_db() -> AsyncGenerator[AsyncSession, None]:
+    async with ImportSession() as session:
+        try:
+            yield session
+        except SQLAlchemyError as exc:
+            await session.rollback()
+            logger.error("Get sqlalchemy error")
+            raise exc
@@ -1,22 +1,76 @@
 import asyncio
+import base64
+import binascii
+import json
 import logging
 import os
+import time
 import uuid
 from contextlib import asynccontextmanager
-from typing import Any, AsyncIterator
+from typing import Any, AsyncIterator, Callable, Iterator
 
 from elasticsearch import AsyncElasticsearch
-from fastapi import FastAPI, File, HTTPException, Path, Query, UploadFile
+from fastapi import FastAPI, File, HTTPException, Path, Query, Request, UploadFile
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy import select, text
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.requests import ClientDisconnect
 
 from src.config import get_app_settings
-from src.database import get_db
-from src.models.src import SKU
+from src.database import async_engine, get_db, get_import_db, import_engine
+from src.models.src import SKU, ImportJob
+from src.parsers.sources import FEED_SUFFIXES
 from src.parsers.xml_parser import XMLParser
-from src.schemas import FileResponse, JobResponse, ProgressResponse, SimilarSKUResponse, SKUResponse, UploadResponse
+from src.schemas import (
+    BatchFormat,
+    CacheStatsResponse,
+    FacetValueResponse,
+    FileResponse,
+    ImportJobResponse,
+    ImportMode,
+    JobPhase,
+    JobProfileResponse,
+    JobResponse,
+    JobStatus,
+    ProfileFormat,
+    ProfileSpanResponse,
+    ProfilingMode,
+    ProgressResponse,
+    SearchFacetsResponse,
+    SearchHitResponse,
+    SearchResponse,
+    SimilarSKUResponse,
+    SKUBatchRequest,
+    SKUProductBatchRequest,
+    SKUResponse,
+    StageProgressResponse,
+    UploadResponse,
+    UploadStatusResponse,
+)
+from src.services.cache_service import ResponseCache
 from src.services.elasticsearch_service import ElasticsearchService
+from src.services.ingestion_service import IngestionPipeline
+from src.services.job_scheduler import JobScheduler
+from src.services.job_service import JobService
+from src.services.local_similarity_service import LocalSimilarityMatcher
+from src.services.metrics_service import JobMetrics, Metric, prune_finished_jobs, render_metrics
+from src.services.profiling_service import JobProfiler, current_profiler, profile_statements, profiled
+from src.services.similarity_service import (
+    DuplicateGroups,
+    ElasticsearchMatcher,
+    SimilarityBlocks,
+    SimilarityMatcher,
+    SimilarityService,
+)
 from src.services.sku_service import SKUService
+from src.services.upload_service import (
+    WRITE_BUFFER_SIZE,
+    FeedUpload,
+    UploadOffsetMismatch,
+    parse_content_range,
+    split_compressed_name,
+)
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -36,14 +90,60 @@ es_client = AsyncElasticsearch(
 )
 es_service = ElasticsearchService(es_client)
 xml_parser = XMLParser()
+for engine in (async_engine, import_engine):
+    profile_statements(engine)
+
+PRODUCTS_ALIAS = "products"
+PRODUCTS_INDEX_BODY = {
+    "mappings": {
+        "properties": {
+            "name": {"type": "text", "analyzer": "russian"},
+            "description": {"type": "text", "analyzer": "russian"},
+            "uuid": {"type": "keyword"},
+            "price": {"type": "float"},
+            # Fields similarity matching is blocked on, and search filters on
+            "vendor": {"type": "text", "fields": {"keyword": {"type": "keyword", "ignore_above": 256}}},
+            "category_id": {"type": "keyword"},
+            "category_lvl_1": {"type": "keyword"},
+            "category_lvl_2": {"type": "keyword"},
+            "category_lvl_3": {"type": "keyword"},
+        }
+    }
+}
+
+# Columns of the products returned by /search
+SEARCH_HIT_FIELDS = (
+    "uuid",
+    "product_id",
+    "title",
+    "brand",
+    "price_after_discounts",
+    "first_image_url",
+    "category_lvl_1",
+    "category_lvl_2",
+    "category_lvl_3",
+)
+
+# Jobs run by this process, updated in place by the jobs and read by the progress and metrics endpoints
+job_metrics: dict[str, JobMetrics] = {}
 
-job_progress: dict[str, dict[str, float]] = {}
-job_progress_lock = asyncio.Lock()
+sku_cache = ResponseCache(SKUResponse, max_size=settings.SKU_CACHE_MAX_SIZE, ttl=settings.SKU_CACHE_TTL)
+search_cache = ResponseCache(SearchResponse, max_size=settings.SEARCH_CACHE_MAX_SIZE, ttl=settings.SEARCH_CACHE_TTL)
+job_scheduler = JobScheduler(lambda job_id: process_xml_file(job_id), max_concurrent_jobs=settings.MAX_CONCURRENT_JOBS)
+# Feeds being uploaded by path, jobs started on them read them while they are written
+feed_uploads: dict[str, FeedUpload] = {}
+# Seconds between two checks for abandoned uploads
+UPLOAD_EXPIRY_INTERVAL = 60.0
 
 
 @asynccontextmanager
 async def app_lifespan(app_: FastAPI) -> AsyncIterator[None]:
+    await mark_interrupted_jobs()
+    upload_expiry = asyncio.create_task(expire_idle_uploads())
     yield
+    upload_expiry.cancel()
+    # Jobs stopped here stay `running` or `queued` in the table and are marked interrupted on the next start
+    await job_scheduler.shutdown()
     await es_service.close()
 
 
@@ -59,7 +159,8 @@ app.mount("/data", StaticFiles(directory="data"), name="data")
 )
 async def list_files() -> FileResponse:
     """
-    Lists all XML files that are available for processing in the `data` directory.
+    Lists all XML files that are available for processing in the `data` directory, including feeds compressed
+    with gzip (`.xml.gz`), zstd (`.xml.zst`) or bzip2 (`.xml.bz2`).
 
     Returns:
     - A list of filenames (XML files) found in the directory.
@@ -69,7 +170,7 @@ async def list_files() -> FileResponse:
     """
     try:
         files = os.listdir(DATA_DIR)
-        xml_files = [f for f in files if f.endswith(".xml")]
+        xml_files = [f for f in files if f.endswith(FEED_SUFFIXES)]
         return FileResponse(files=xml_files)
     except Exception as e:
         logger.error(f"Error listing files: {e}")
@@ -81,34 +182,187 @@ async def list_files() -> FileResponse:
     summary="Upload a new XML file",
     description="Uploads a new XML file to the `data` directory.",
 )
-async def upload_file(file: UploadFile = File(...)) -> UploadResponse:
+async def upload_file(
+    file: UploadFile = File(...),
+    decompress: bool = Query(False, description="Store `.gz`, `.zst` and `.bz2` files decompressed"),
+) -> UploadResponse:
     """
     Uploads a new XML file to the server and saves it to the `data` directory.
 
+    The file is copied in chunks to a temporary `.part` file which is renamed once complete, so the upload is
+    never held in memory and a failed upload leaves no partial feed behind.
+
     Args:
-    - `file`: The XML file being uploaded (multipart/form-data).
+    - `file`: The XML file being uploaded (multipart/form-data), optionally compressed with gzip (`.gz`), zstd
+      (`.zst`) or bzip2 (`.bz2`).
+    - `decompress`: Store compressed files decompressed, under the name without the compression suffix. By default
+      they are stored as they are and decompressed while they are processed.
 
     Returns:
     - The filename of the uploaded file.
 
     Raises:
+    - 400 Bad Request if the file is not valid compressed data.
+    - 409 Conflict if a file of the same name is being uploaded.
+    - 415 Unsupported Media Type if the compression is not supported.
     - 500 Internal Server Error if the file upload fails.
     """
-    try:
-        if file.filename is None:
-            raise ValueError("No filename provided in the uploaded file.")
-
-        file_location = os.path.join(DATA_DIR, file.filename)
+    if file.filename is None:
+        raise HTTPException(status_code=400, detail="No filename provided in the uploaded file.")
+    filename, encoding = os.path.basename(file.filename), None
+    if decompress:
+        filename, encoding = split_compressed_name(filename)
 
-        content = await file.read()
-        with open(file_location, "wb") as f:
-            f.write(content)
-        return UploadResponse(filename=file.filename)
+    upload = await start_upload(os.path.join(DATA_DIR, filename), encoding)
+    try:
+        while chunk := await file.read(WRITE_BUFFER_SIZE):
+            await upload.write(chunk)
+        await finish_upload(upload)
+        return UploadResponse(filename=filename)
+    except ValueError as e:
+        await discard_upload(upload, str(e))
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error uploading file: {e}")
+        await discard_upload(upload, str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.put(
+    "/uploads/{filename}",
+    summary="Stream an XML file to the server",
+    description=(
+        "Writes the request body to the `data` directory as it arrives. Supports compressed bodies, "
+        "resuming with `Content-Range` and processing the file while it is uploaded."
+    ),
+)
+async def stream_upload(
+    request: Request,
+    filename: str = Path(..., description="The name to store the file under"),
+    process: bool = Query(False, description="Start processing the file while it is still being uploaded"),
+    mode: ImportMode = Query(ImportMode.FULL, description="Import mode of the job started with `process`"),
+    decompress: bool = Query(False, description="Store `.gz`, `.zst` and `.bz2` files decompressed"),
+) -> UploadStatusResponse:
+    """
+    Streams a file to the `data` directory without buffering it: the raw request body is written to a temporary
+    `.part` file which is renamed once complete.
+
+    Args:
+    - `filename`: The name to store the file under, compressed feeds are stored as they are (`.gz`, `.zst`, `.bz2`).
+    - `process`: Start an import job right away. It reads the file as it is written and waits for the rest.
+    - `mode`: `full` (default) or `incremental`, the mode of the job started with `process`.
+    - `decompress`: Decompress a compressed feed on the fly and store it under the name without the suffix.
+
+    Headers:
+    - `Content-Encoding: gzip` or `zstd`: The body is compressed for the transfer and is decompressed on the fly.
+    - `Content-Range: bytes <start>-<end>/<total or *>`: The body is one chunk of the file. Chunks have to be sent
+      in order; the upload completes with the chunk that ends at `total`. A client whose connection broke asks
+      `GET /uploads/{filename}` where to continue. Uploads decompressed on the fly do not survive a restart of the
+      app.
+
+    Returns:
+    - The stored filename, the bytes received so far, whether the file is complete and the ID of the job started
+      with `process`.
+
+    Raises:
+    - 400 Bad Request if `Content-Range` is invalid or the body is not valid compressed data.
+    - 409 Conflict if the chunk does not continue the upload (the `Upload-Offset` header tells where it does).
+    - 415 Unsupported Media Type if the compression is not supported.
+    """
+    filename, encoding = os.path.basename(filename), None
+    if decompress:
+        filename, encoding = split_compressed_name(filename)
+    content_encoding = request.headers.get("content-encoding", "identity").lower()
+    if content_encoding != "identity":
+        encoding = content_encoding
+
+    content_range: tuple[int, int, int | None] | None = None
+    if "content-range" in request.headers:
+        try:
+            content_range = parse_content_range(request.headers["content-range"])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    offset, total = (content_range[0], content_range[2]) if content_range else (0, None)
+    if content_range is None and "content-length" in request.headers:
+        total = int(request.headers["content-length"])
+
+    file_path = os.path.join(DATA_DIR, filename)
+    upload = feed_uploads.get(file_path)
+    job_id: str | None = None
+    if upload is None:
+        upload = await start_upload(file_path, encoding, total, resume=offset > 0)
+        if offset != upload.received:
+            # Nothing to continue here, a part file left by an earlier process is kept for a request at its end
+            received = upload.received
+            await release_upload(upload, str(UploadOffsetMismatch(received)))
+            raise HTTPException(
+                status_code=409, detail=str(UploadOffsetMismatch(received)), headers={"Upload-Offset": str(received)}
+            )
+        if process:
+            job_id = await start_job(file_path, mode)
+
+    try:
+        await upload.write_from(offset, request.stream())
+    except UploadOffsetMismatch as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Upload-Offset": str(e.received)})
+    except ValueError as e:
+        await discard_upload(upload, str(e))
+        raise HTTPException(status_code=400, detail=str(e))
+    except ClientDisconnect:
+        if content_range is None:
+            await discard_upload(upload, "The upload broke off")
+        else:
+            logger.info(f"Upload of {filename} broke off at byte {upload.received}")
+        return UploadStatusResponse(filename=filename, received_bytes=upload.received, complete=False, job_id=job_id)
+
+    if content_range is None or (total is not None and upload.received >= total):
+        try:
+            await finish_upload(upload)
+        except ValueError as e:
+            await discard_upload(upload, str(e))
+            raise HTTPException(status_code=400, detail=str(e))
+    return UploadStatusResponse(
+        filename=filename, received_bytes=upload.received, complete=upload.complete, job_id=job_id
+    )
+
+
+@app.get(
+    "/uploads/{filename}",
+    summary="Get the state of an upload",
+    description="Returns how many bytes of a streamed upload arrived, so an interrupted upload can be continued.",
+)
+async def get_upload(
+    filename: str = Path(..., description="The name the file is stored under")
+) -> UploadStatusResponse:
+    """
+    Fetches the state of an upload started with `PUT /uploads/{filename}`.
+
+    Args:
+    - `filename`: The name the file is stored under.
+
+    Returns:
+    - The bytes received so far (the offset the next chunk starts at) and whether the file is complete.
+
+    Raises:
+    - 404 Not Found if there is neither an upload nor a file of that name.
+    """
+    filename = os.path.basename(filename)
+    # A feed uploaded with `decompress` is stored without its compression suffix
+    for name in dict.fromkeys((filename, split_compressed_name(filename)[0])):
+        file_path = os.path.join(DATA_DIR, name)
+        upload = feed_uploads.get(file_path)
+        if upload is not None:
+            return UploadStatusResponse(filename=name, received_bytes=upload.received, complete=False)
+        if os.path.isfile(f"{file_path}.part"):
+            # Left by an earlier process, continued by the next chunk unless it was decompressed on the fly
+            return UploadStatusResponse(
+                filename=name, received_bytes=os.path.getsize(f"{file_path}.part"), complete=False
+            )
+        if os.path.isfile(file_path):
+            return UploadStatusResponse(filename=name, received_bytes=os.path.getsize(file_path), complete=True)
+    raise HTTPException(status_code=404, detail="Upload not found")
+
+
 @app.post(
     "/process",
     summary="Start processing an XML file",
@@ -117,34 +371,54 @@ async def upload_file(file: UploadFile = File(...)) -> UploadResponse:
         "Returns a unique job ID that can be used to track progress."
     ),
 )
-async def process_file(filename: str = Query(..., description="The name of the XML file to process")) -> JobResponse:
+async def process_file(
+    filename: str = Query(..., description="The name of the XML file to process"),
+    mode: ImportMode = Query(
+        ImportMode.FULL,
+        description=(
+            "`full` rebuilds the index from scratch and replaces the catalog with the file, "
+            "`incremental` applies only the offers that changed since the previous import"
+        ),
+    ),
+    profile: bool = Query(False, description="Time each stage of the job, see `/jobs/{job_id}/profile`"),
+    profile_sampling: bool = Query(False, description="Also sample the stacks of the process while the job runs"),
+) -> JobResponse:
     """
     Starts processing the specified XML file.
 
     Args:
-    - `filename`: The name of the XML file to process (must be available in the `data` directory).
+    - `filename`: The name of the XML file to process (must be available in the `data` directory), plain or
+      compressed with gzip, zstd or bzip2.
+    - `mode`: `full` (default) or `incremental`. Both keep the uuids of existing SKUs and delete SKUs missing from
+      the file once it is loaded. A full import writes every offer into a new index and re-matches every SKU, an
+      incremental one skips unchanged offers and re-matches only the affected SKUs.
+    - `profile`: Record the time spent in each stage of the job (parsing, SQL, Elasticsearch requests, queue
+      waits). With `profile_sampling` the stacks of the process are also sampled every `PROFILE_SAMPLE_INTERVAL`
+      seconds, for a flamegraph.
 
     Returns:
     - A message indicating the job has started.
     - The UUID of the job that can be used to track its progress.
 
+    The job is queued until it can run: imports run one at a time, as each one removes the SKUs missing from its
+    feed.
+
     Raises:
     - 404 Not Found if the specified file does not exist.
+    - 409 Conflict if the file is being uploaded (start the job with the upload's `process` option instead).
     - 500 Internal Server Error if the processing could not be started.
     """
-    try:
-        file_path = os.path.join(DATA_DIR, filename)
-        if not os.path.isfile(file_path):
-            raise HTTPException(status_code=404, detail="File not found")
-
-        job_id = str(uuid.uuid4())
-        async with job_progress_lock:
-            job_progress[job_id] = {
-                "processing_progress": 0.0,
-                "update_similar_progress": 0.0,
-            }
-        asyncio.create_task(process_xml_file(file_path, job_id))
+    file_path = os.path.join(DATA_DIR, filename)
+    if file_path in feed_uploads:
+        raise HTTPException(status_code=409, detail="File is being uploaded")
+    if not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail="File not found")
 
+    try:
+        profiling = None
+        if profile or profile_sampling:
+            profiling = ProfilingMode.SAMPLING if profile_sampling else ProfilingMode.SPANS
+        job_id = await start_job(file_path, mode, profiling)
         return JobResponse(message="Processing started", job_id=job_id)
     except Exception as e:
         logger.error(f"Error starting processing: {e}")
@@ -171,48 +445,501 @@ async def get_progress(
     Raises:
     - 404 Not Found if the job ID does not exist.
     """
-    async with job_progress_lock:
-        progress_data = job_progress.get(job_id)
-    if progress_data is None:
+    progress = await read_progress(job_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return progress
+
+
+@app.get(
+    "/progress/{job_id}/stream",
+    summary="Stream the progress of a processing job",
+    description="Sends the progress of a job as server-sent events until the job stops.",
+)
+async def stream_progress(
+    job_id: str = Path(..., description="The UUID of the job to stream progress for"),
+    interval: float = Query(1.0, ge=0.1, le=60.0, description="Seconds between two events"),
+) -> StreamingResponse:
+    """
+    Streams the progress of a job as server-sent events, so clients do not have to poll `/progress/{job_id}`.
+
+    Args:
+    - `job_id`: The UUID of the processing job.
+    - `interval`: Seconds between two events.
+
+    Returns:
+    - A `text/event-stream` of `progress` events carrying the same JSON as `/progress/{job_id}`. The stream ends
+      after the event that reports the job completed, failed, was cancelled or interrupted.
+
+    Raises:
+    - 404 Not Found if the job ID does not exist.
+    """
+    first_progress = await read_progress(job_id)
+    if first_progress is None:
         raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events() -> AsyncIterator[str]:
+        progress: ProgressResponse | None = first_progress
+        while progress is not None:
+            yield f"event: progress\ndata: {progress.model_dump_json()}\n\n"
+            if progress.status not in (JobStatus.QUEUED, JobStatus.RUNNING):
+                break
+            await asyncio.sleep(interval)
+            progress = await read_progress(job_id)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.get(
+    "/metrics",
+    summary="Prometheus metrics",
+    description="Returns job, pipeline and cache metrics in the Prometheus text exposition format.",
+    response_class=PlainTextResponse,
+)
+async def get_metrics() -> PlainTextResponse:
+    """
+    Exposes metrics for scraping by Prometheus.
+
+    Per job: phase progress and ETA, items and items per second of each stage (offers parsed, rows written,
+    documents indexed, similarity queries), pipeline queue depths and Elasticsearch bulk rejections. Also the
+    scheduler queue and the SKU and search response cache counters.
+    """
+    extra_metrics: list[Metric] = [
+        (
+            "goodsale_jobs",
+            "gauge",
+            "Import jobs in the scheduler by state.",
+            [('state="queued"', job_scheduler.queued), ('state="running"', job_scheduler.running)],
+        ),
+        ("goodsale_sku_cache_hits_total", "counter", "SKU response cache hits.", [("", sku_cache.hits)]),
+        ("goodsale_sku_cache_misses_total", "counter", "SKU response cache misses.", [("", sku_cache.misses)]),
+        ("goodsale_sku_cache_entries", "gauge", "Entries in the local SKU response cache.", [("", sku_cache.size)]),
+        ("goodsale_search_cache_hits_total", "counter", "Search response cache hits.", [("", search_cache.hits)]),
+        (
+            "goodsale_search_cache_misses_total",
+            "counter",
+            "Search response cache misses.",
+            [("", search_cache.misses)],
+        ),
+    ]
+    prune_finished_jobs(job_metrics, settings.JOB_METRICS_RETENTION, settings.JOB_METRICS_MAX_FINISHED)
+    return PlainTextResponse(
+        render_metrics(job_metrics.values(), extra_metrics), media_type="text/plain; version=0.0.4"
+    )
+
+
+async def read_progress(job_id: str) -> ProgressResponse | None:
+    metrics = job_metrics.get(job_id)
+    if metrics is None:
+        # Not run by this process, the last checkpoint is all there is
+        job = await load_job(job_id)
+        if job is None:
+            return None
+        return ProgressResponse(
+            job_id=job_id,
+            processing_progress=job.processing_progress,
+            update_similar_progress=job.update_similar_progress,
+            status=JobStatus(job.status),
+        )
     return ProgressResponse(
         job_id=job_id,
-        processing_progress=progress_data.get("processing_progress", 0.0),
-        update_similar_progress=progress_data.get("update_similar_progress", 0.0),
+        processing_progress=metrics.processing.value,
+        update_similar_progress=metrics.similarity.value,
+        status=JobStatus(metrics.status),
+        eta_seconds=metrics.eta_seconds,
+        stages=[
+            StageProgressResponse(name=stage.name, items=stage.items, items_per_second=stage.items_per_second)
+            for stage in metrics.stages.values()
+        ],
+    )
+
+
+@app.get(
+    "/jobs/{job_id}",
+    summary="Get an import job",
+    description="Returns the persisted state of an import job: status, phase, last checkpoint and throughput.",
+)
+async def get_job(job_id: uuid.UUID = Path(..., description="The UUID of the job")) -> ImportJobResponse:
+    """
+    Fetches the persisted state of a job by its UUID.
+
+    Args:
+    - `job_id`: The UUID of the processing job.
+
+    Returns:
+    - The job status and phase, the byte offset and batch of the last checkpoint, the rows written, and once the
+      job completed its wall time and rows per second.
+
+    Raises:
+    - 404 Not Found if the job ID does not exist.
+    """
+    job = await load_job(str(job_id))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return build_job_response(job)
+
+
+@app.get(
+    "/jobs",
+    summary="List import jobs",
+    description="Returns the import jobs, newest first, optionally only those with the given status.",
+)
+async def list_jobs(
+    status: JobStatus | None = Query(None, description="Only return jobs with this status"),
+    limit: int = Query(100, ge=1, le=1000, description="The maximum number of jobs to return"),
+) -> list[ImportJobResponse]:
+    """
+    Lists import jobs, newest first.
+
+    Args:
+    - `status`: Only return jobs with this status.
+    - `limit`: The maximum number of jobs to return.
+
+    Returns:
+    - The persisted state of each job.
+    """
+    async for session in get_db():
+        jobs = await JobService(session).list_jobs(status.value if status else None, limit)
+        return [build_job_response(job) for job in jobs]
+    raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@app.delete(
+    "/jobs/{job_id}",
+    summary="Cancel an import job",
+    description="Cancels a queued or running job, or abandons an interrupted or failed one.",
+)
+async def cancel_job(job_id: uuid.UUID = Path(..., description="The UUID of the job")) -> JobResponse:
+    """
+    Cancels a job. A running pipeline is stopped and the request returns once it has stopped.
+
+    Whatever the job left behind that is only useful for resuming it (its import keys and the unfinished index of
+    a full import) is removed, so a cancelled job cannot be resumed. The SKUs it already wrote are kept.
+
+    Args:
+    - `job_id`: The UUID of the processing job.
+
+    Returns:
+    - A message indicating the job has been cancelled.
+    - The UUID of the job.
+
+    Raises:
+    - 404 Not Found if the job ID does not exist.
+    - 409 Conflict if the job already completed or was cancelled.
+    """
+    job = await load_job(str(job_id))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status in (JobStatus.COMPLETED, JobStatus.CANCELLED):
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}, it cannot be cancelled")
+
+    await job_scheduler.cancel(str(job_id))
+    job = await load_job(str(job_id))
+    if job is None or job.status == JobStatus.COMPLETED:
+        raise HTTPException(status_code=409, detail="Job completed before it could be cancelled")
+
+    if (metrics := job_metrics.get(str(job_id))) is not None:
+        metrics.status = JobStatus.CANCELLED.value
+    await discard_job(job)
+    await save_job(str(job_id), status=JobStatus.CANCELLED.value, finished_at=func.now())
+    return JobResponse(message="Processing cancelled", job_id=str(job_id))
+
+
+def build_job_response(job: ImportJob) -> ImportJobResponse:
+    return ImportJobResponse(
+        job_id=str(job.job_id),
+        filename=os.path.basename(job.filename),
+        mode=ImportMode(job.mode),
+        status=JobStatus(job.status),
+        phase=JobPhase(job.phase),
+        byte_offset=job.byte_offset,
+        last_batch=job.last_batch,
+        processing_progress=job.processing_progress,
+        update_similar_progress=job.update_similar_progress,
+        rows=job.rows,
+        elapsed_seconds=job.elapsed_seconds,
+        rows_per_second=job.rows_per_second,
+        error=job.error,
+        profiling=ProfilingMode(job.profiling) if job.profiling is not None else None,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
     )
 
 
+@app.get(
+    "/jobs/{job_id}/profile",
+    summary="Get the profile of an import job",
+    description="Returns where a job started with `profile` spent its time, or its sampled stacks for a flamegraph.",
+)
+async def get_job_profile(
+    job_id: uuid.UUID = Path(..., description="The UUID of the job"),
+    profile_format: ProfileFormat = Query(ProfileFormat.JSON, alias="format", description="`json` or `folded`"),
+) -> Any:
+    """
+    Fetches the profile of the last run of a job, saved when the run ends.
+
+    Args:
+    - `job_id`: The UUID of the processing job.
+    - `format`: `json` (default) for the time per span, `folded` for the sampled stacks as text in the folded
+      format read by flamegraph.pl, speedscope and inferno.
+
+    Returns:
+    - The wall time of the run and for each span the number of times it was entered and the seconds spent in it,
+      summed over the tasks that ran it side by side. `db.execute` is the time spent in asyncpg and Postgres,
+      `es.*` the Elasticsearch requests, `*.queue_wait` a stage blocked on the next one.
+
+    Raises:
+    - 404 Not Found if the job ID does not exist, was not profiled or has no profile yet, or with `folded` if it
+      was not sampled.
+    """
+    job = await load_job(str(job_id))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.profiling is None or job.profile is None:
+        raise HTTPException(status_code=404, detail="Job has no profile")
+
+    if profile_format == ProfileFormat.FOLDED:
+        if not job.profile_stacks:
+            raise HTTPException(status_code=404, detail="Job has no sampled stacks")
+        return PlainTextResponse(job.profile_stacks)
+    return JobProfileResponse(
+        job_id=str(job.job_id),
+        profiling=ProfilingMode(job.profiling),
+        wall_seconds=job.profile["wall_seconds"],
+        sample_interval=job.profile["sample_interval"],
+        samples=job.profile["samples"],
+        spans=[ProfileSpanResponse(**span) for span in job.profile["spans"]],
+    )
+
+
+@app.post(
+    "/jobs/{job_id}/resume",
+    summary="Resume an interrupted import job",
+    description="Continues an interrupted or failed job from its last checkpoint.",
+)
+async def resume_job(job_id: uuid.UUID = Path(..., description="The UUID of the job")) -> JobResponse:
+    """
+    Resumes a job that was interrupted by a restart or failed, from its last checkpoint.
+
+    Args:
+    - `job_id`: The UUID of the processing job.
+
+    Returns:
+    - A message indicating the job has been resumed.
+    - The UUID of the job.
+
+    Raises:
+    - 404 Not Found if the job ID does not exist.
+    - 409 Conflict if the job is not interrupted or failed.
+    """
+    async for session in get_db():
+        async with session.begin():
+            job_service = JobService(session)
+            job = await job_service.get_job(str(job_id))
+            if job is None:
+                raise HTTPException(status_code=404, detail="Job not found")
+            if job.status not in (JobStatus.INTERRUPTED, JobStatus.FAILED) or job_scheduler.is_scheduled(str(job_id)):
+                raise HTTPException(status_code=409, detail=f"Job is {job.status}, it cannot be resumed")
+            await job_service.update_job(str(job_id), status=JobStatus.QUEUED.value)
+
+    # Submitted once the new status is committed, the job reads it when it starts
+    assert job is not None
+    job_metrics[str(job_id)] = JobMetrics(
+        str(job_id), JobStatus.QUEUED.value, job.processing_progress, job.update_similar_progress
+    )
+    job_scheduler.submit(str(job_id), job.filename, exclusive=True)
+    return JobResponse(message="Processing resumed", job_id=str(job_id))
+
+
 @app.get(
     "/sku/{uuid}",
     summary="Get SKU by UUID",
     description="Returns the SKU information including similar SKUs.",
 )
-async def get_sku(uuid: str = Path(..., description="The UUID of the SKU")) -> SKUResponse:
+async def get_sku(
+    uuid: str = Path(..., description="The UUID of the SKU"),
+    k: int | None = Query(None, ge=1, le=settings.SIMILARITY_TOP_K, description="Number of similar SKUs"),
+    min_score: float | None = Query(None, description="Lowest score of the similar SKUs returned"),
+) -> SKUResponse:
     """
     Retrieves SKU details by UUID, including similar SKUs.
 
     Args:
     - `uuid`: The UUID of the SKU.
+    - `k`: How many similar SKUs to return, at most `SIMILARITY_TOP_K`. All the stored ones when only `min_score`
+      is given.
+    - `min_score`: Leave out similar SKUs scoring less. Exact duplicates have no score and are always returned.
 
     Returns:
-    - The SKU details, including similar SKUs.
+    - The SKU details, including similar SKUs. With `k` or `min_score` the similar SKUs come from the stored
+      matches with their current title, price and picture.
 
     Raises:
     - 404 Not Found if the SKU does not exist.
     """
+    cache_key = uuid.lower()
+    sku_response = await sku_cache.get(cache_key)
+    if sku_response is not None and k is None and min_score is None:
+        return sku_response
+
     async for session in get_db():
         async with session.begin():
             sku_service = SKUService(session)
-            sku = await sku_service.get_sku_by_uuid(uuid)
-            if not sku:
-                raise HTTPException(status_code=404, detail="SKU not found")
+            if sku_response is None:
+                sku = await sku_service.get_sku_by_uuid(uuid)
+                if not sku:
+                    raise HTTPException(status_code=404, detail="SKU not found")
+                sku_response = (await build_sku_responses(session, [sku]))[0]
+                await sku_cache.set(cache_key, sku_response)
+            if k is None and min_score is None:
+                return sku_response
+
+            similar_skus = await sku_service.get_similar_skus(
+                sku_response.uuid, k or settings.SIMILARITY_TOP_K, min_score
+            )
+            return sku_response.model_copy(
+                update={"similar_sku": [SimilarSKUResponse(**similar) for similar in similar_skus]}
+            )
+    raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@app.post(
+    "/sku/batch",
+    summary="Get many SKUs by UUID",
+    description="Returns the SKUs for up to `SKU_LOOKUP_MAX_BATCH` UUIDs, streamed as a JSON array or as NDJSON.",
+)
+async def get_sku_batch(
+    request: SKUBatchRequest,
+    response_format: BatchFormat = Query(BatchFormat.JSON, alias="format", description="`json` or `ndjson`"),
+) -> StreamingResponse:
+    """
+    Retrieves many SKUs by UUID, including similar SKUs.
+
+    Args:
+    - `uuids`: The UUIDs of the SKUs.
+    - `format`: `json` streams a JSON array, `ndjson` one SKU per line.
+
+    Returns:
+    - The SKU details in request order. UUIDs that do not exist are left out.
+
+    Raises:
+    - 422 Unprocessable Entity if more UUIDs than allowed are requested.
+    """
+    check_batch_size(len(request.uuids))
+    sku_uuids = [str(sku_uuid) for sku_uuid in dict.fromkeys(request.uuids)]
+
+    responses: dict[str, SKUResponse] = {}
+    for sku_uuid in sku_uuids:
+        cached_response = await sku_cache.get(sku_uuid)
+        if cached_response is not None:
+            responses[sku_uuid] = cached_response
+
+    missing_uuids = [uuid.UUID(sku_uuid) for sku_uuid in sku_uuids if sku_uuid not in responses]
+    if missing_uuids:
+        async for session in get_db():
+            async with session.begin():
+                skus = await SKUService(session).get_skus_by_uuids(missing_uuids)
+                for sku_response in await build_sku_responses(session, skus):
+                    responses[sku_response.uuid] = sku_response
+                    await sku_cache.set(sku_response.uuid, sku_response)
+
+    return stream_sku_responses(
+        [responses[sku_uuid] for sku_uuid in sku_uuids if sku_uuid in responses], response_format
+    )
+
+
+@app.post(
+    "/sku/batch/by-product-id",
+    summary="Get many SKUs by marketplace product ID",
+    description=(
+        "Returns the SKUs for up to `SKU_LOOKUP_MAX_BATCH` product IDs of one marketplace, "
+        "streamed as a JSON array or as NDJSON."
+    ),
+)
+async def get_sku_batch_by_product_id(
+    request: SKUProductBatchRequest,
+    response_format: BatchFormat = Query(BatchFormat.JSON, alias="format", description="`json` or `ndjson`"),
+) -> StreamingResponse:
+    """
+    Retrieves many SKUs by their product IDs in a marketplace, including similar SKUs.
+
+    Args:
+    - `marketplace_id`: The marketplace the product IDs belong to (1 by default).
+    - `product_ids`: The product IDs of the SKUs.
+    - `format`: `json` streams a JSON array, `ndjson` one SKU per line.
+
+    Returns:
+    - The SKU details in request order. Product IDs that do not exist are left out.
+
+    Raises:
+    - 422 Unprocessable Entity if more product IDs than allowed are requested.
+    """
+    check_batch_size(len(request.product_ids))
+    product_ids = list(dict.fromkeys(request.product_ids))
+
+    responses: dict[int, SKUResponse] = {}
+    async for session in get_db():
+        async with session.begin():
+            skus = await SKUService(session).get_skus_by_product_ids(request.marketplace_id, product_ids)
+            for sku_response in await build_sku_responses(session, skus):
+                responses[sku_response.product_id] = sku_response
+
+    return stream_sku_responses(
+        [responses[product_id] for product_id in product_ids if product_id in responses], response_format
+    )
+
+
+def check_batch_size(size: int) -> None:
+    if size > settings.SKU_LOOKUP_MAX_BATCH:
+        raise HTTPException(
+            status_code=422, detail=f"At most {settings.SKU_LOOKUP_MAX_BATCH} SKUs can be requested at once"
+        )
+
 
-            similar_skus: list[SKU] = []
-            if sku.similar_sku:
-                result = await session.execute(select(SKU).where(SKU.uuid.in_(sku.similar_sku)))
-                similar_skus = list(result.scalars().all())
+def stream_sku_responses(responses: list[SKUResponse], response_format: BatchFormat) -> StreamingResponse:
+    def ndjson() -> Iterator[str]:
+        for sku_response in responses:
+            yield sku_response.model_dump_json() + "\n"
 
-            sku_response = SKUResponse(
+    def json_array() -> Iterator[str]:
+        yield "["
+        for i, sku_response in enumerate(responses):
+            yield ("," if i else "") + sku_response.model_dump_json()
+        yield "]"
+
+    if response_format == BatchFormat.NDJSON:
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+    return StreamingResponse(json_array(), media_type="application/json")
+
+
+async def build_sku_responses(session: AsyncSession, skus: list[SKU]) -> list[SKUResponse]:
+    """
+    Builds the API responses for SKUs read from the database.
+
+    Neighbours come from `similar_sku_snapshot`. SKUs matched before snapshots were stored have their neighbours
+    resolved with one extra query for the whole list.
+    """
+    unresolved_uuids = {
+        similar_uuid for sku in skus if sku.similar_sku_snapshot is None for similar_uuid in sku.similar_sku or []
+    }
+    neighbours: dict[str, SKU] = {}
+    if unresolved_uuids:
+        for neighbour in await SKUService(session).get_skus_by_uuids(list(unresolved_uuids)):
+            neighbours[str(neighbour.uuid)] = neighbour
+
+    sku_responses: list[SKUResponse] = []
+    for sku in skus:
+        if sku.similar_sku_snapshot is not None:
+            similar_sku = [SimilarSKUResponse(**similar) for similar in sku.similar_sku_snapshot]
+        else:
+            similar_sku = [
+                SimilarSKUResponse(uuid=str(s.uuid), title=s.title)
+                for s in (neighbours.get(str(similar_uuid)) for similar_uuid in sku.similar_sku or [])
+                if s is not None
+            ]
+        sku_responses.append(
+            SKUResponse(
                 uuid=str(sku.uuid),
                 product_id=sku.product_id,
                 title=sku.title,
@@ -220,152 +947,513 @@ async def get_sku(uuid: str = Path(..., description="The UUID of the SKU")) -> S
                 category_lvl_2=sku.category_lvl_2,
                 category_lvl_3=sku.category_lvl_3,
                 category_remaining=sku.category_remaining,
-                similar_sku=[
-                    SimilarSKUResponse(
-                        uuid=str(s.uuid),
-                        title=s.title,
-                    )
-                    for s in similar_skus
-                ],
+                similar_sku=similar_sku,
             )
-            return sku_response
-    raise HTTPException(status_code=500, detail="Internal Server Error")
+        )
+    return sku_responses
+
+
+@app.get(
+    "/search",
+    summary="Search products",
+    description="Full-text search of products with filters, cursor pagination and facets.",
+)
+async def search_products(
+    q: str | None = Query(None, description="Words to find in the title, brand and description"),
+    category_id: list[int] = Query([], description="Category IDs, any of them"),
+    category: str | None = Query(None, description="Category name at any of the first three levels"),
+    brand: list[str] = Query([], description="Brands, any of them"),
+    price_min: float | None = Query(None, ge=0, description="Lowest price"),
+    price_max: float | None = Query(None, ge=0, description="Highest price"),
+    size: int = Query(20, ge=1, le=settings.SEARCH_MAX_SIZE, description="Products per page"),
+    cursor: str | None = Query(None, description="`next_cursor` of the previous page"),
+    facets: bool = Query(True, description="Include facets in the first page"),
+) -> SearchResponse:
+    """
+    Searches the products index and reads the found products from the database.
+
+    Args:
+    - `q`: Words to find, all of them must match. Without it every product matching the filters is found.
+    - `category_id`, `category`, `brand`, `price_min`, `price_max`: Filters.
+    - `size`: Products per page, up to `SEARCH_MAX_SIZE`.
+    - `cursor`: Continues after the last product of a previous page.
+    - `facets`: Brands and the categories of each of the first three levels with their product counts and the price
+      range of all found products, computed for the first page only.
+
+    Returns:
+    - The total number of products found (at most 10000 is counted), the page of products best first and the
+      cursor of the next page, None after the last one.
+
+    Raises:
+    - 422 Unprocessable Entity if `cursor` is not a cursor returned by this endpoint.
+    """
+    search_after = decode_search_cursor(cursor) if cursor is not None else None
+    facet_size = settings.SEARCH_FACET_SIZE if facets and cursor is None else None
+    cache_key = json.dumps(
+        [q, sorted(category_id), category, sorted(brand), price_min, price_max, size, cursor, facet_size],
+        ensure_ascii=False,
+    )
+    cached_response = await search_cache.get(cache_key)
+    if cached_response is not None:
+        return cached_response
+
+    result = await es_service.search_products(
+        PRODUCTS_ALIAS,
+        q,
+        category_id,
+        category,
+        brand,
+        price_min,
+        price_max,
+        size,
+        search_after,
+        facet_size,
+    )
+    hits = result.get("hits", {}).get("hits", [])
+    async for session in get_db():
+        async with session.begin():
+            skus = await SKUService(session).get_skus_by_uuids(
+                [uuid.UUID(hit["_id"]) for hit in hits], SEARCH_HIT_FIELDS
+            )
+    skus_by_uuid = {str(sku.uuid): sku for sku in skus}
 
+    search_response = SearchResponse(
+        total=result.get("hits", {}).get("total", {}).get("value", 0),
+        # Products deleted since they were indexed are left out
+        hits=[
+            SearchHitResponse(
+                uuid=str(sku.uuid),
+                product_id=sku.product_id,
+                title=sku.title,
+                brand=sku.brand,
+                price=sku.price_after_discounts,
+                picture=sku.first_image_url,
+                category_lvl_1=sku.category_lvl_1,
+                category_lvl_2=sku.category_lvl_2,
+                category_lvl_3=sku.category_lvl_3,
+                score=hit.get("_score"),
+            )
+            for hit, sku in ((hit, skus_by_uuid.get(hit["_id"])) for hit in hits)
+            if sku is not None
+        ],
+        next_cursor=encode_search_cursor(hits[-1]["sort"]) if len(hits) == size else None,
+        facets=build_search_facets(result["aggregations"]) if facet_size is not None else None,
+    )
+    await search_cache.set(cache_key, search_response)
+    return search_response
 
-async def process_xml_file(xml_file: str, job_id: str) -> None:
+
+def encode_search_cursor(sort_values: list[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(sort_values).encode()).decode()
+
+
+def decode_search_cursor(cursor: str) -> list[Any]:
     try:
-        total_offers = xml_parser.count_offers(xml_file)
-        processed_offers = 0
-
-        categories = xml_parser.parse_categories(xml_file)
-
-        await clear_elasticsearch_index()
-        await clear_sku_table()
-
-        await es_service.create_index(
-            "products",
-            index_body={
-                "mappings": {
-                    "properties": {
-                        "name": {"type": "text", "analyzer": "russian"},
-                        "description": {"type": "text", "analyzer": "russian"},
-                    }
-                }
-            },
-        )
+        sort_values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+    if not isinstance(sort_values, list):
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+    return sort_values
+
+
+def build_search_facets(aggregations: dict[str, Any]) -> SearchFacetsResponse:
+    def terms(name: str) -> list[FacetValueResponse]:
+        return [FacetValueResponse(value=b["key"], count=b["doc_count"]) for b in aggregations[name]["buckets"]]
+
+    return SearchFacetsResponse(
+        brand=terms("brand"),
+        category_lvl_1=terms("category_lvl_1"),
+        category_lvl_2=terms("category_lvl_2"),
+        category_lvl_3=terms("category_lvl_3"),
+        price_min=aggregations["price"]["min"],
+        price_max=aggregations["price"]["max"],
+    )
 
-        async for session in get_db():
-            async with session.begin():
-                sku_service = SKUService(session)
-                for offer_data in xml_parser.parse_offers(xml_file):
-                    offer_id = offer_data["offer_id"]
-                    sku_uuid = str(uuid.uuid4())
-
-                    hierarchy = xml_parser.get_category_hierarchy(categories, offer_data["category_id"])
-                    category_lvl_1 = hierarchy[0] if len(hierarchy) > 0 else None
-                    category_lvl_2 = hierarchy[1] if len(hierarchy) > 1 else None
-                    category_lvl_3 = hierarchy[2] if len(hierarchy) > 2 else None
-                    category_remaining = "/".join(hierarchy[3:]) if len(hierarchy) > 3 else None
-
-                    sku_data: dict[str, Any] = {
-                        "uuid": sku_uuid,
-                        "marketplace_id": 1,
-                        "offer_id": offer_id,
-                        "name": offer_data["name"],
-                        "description": offer_data["description"],
-                        "vendor": offer_data["vendor"],
-                        "barcode": offer_data["barcode"],
-                        "category_id": offer_data["category_id"],
-                        "category_lvl_1": category_lvl_1,
-                        "category_lvl_2": category_lvl_2,
-                        "category_lvl_3": category_lvl_3,
-                        "category_remaining": category_remaining,
-                        "params": offer_data["params"],
-                        "price": offer_data["price"],
-                        "picture": offer_data["picture"],
-                        "currency_id": offer_data["currency_id"],
-                    }
-
-                    await sku_service.save_sku(sku_data)
-
-                    doc = {
-                        "uuid": sku_uuid,
-                        "name": offer_data["name"],
-                        "description": offer_data["description"],
-                        "vendor": offer_data["vendor"],
-                        "barcode": offer_data["barcode"],
-                        "category_id": offer_data["category_id"],
-                        "price": offer_data["price"],
-                        "params": offer_data["params"],
-                    }
-
-                    await es_service.index_document(index_name="products", doc_id=sku_uuid, document=doc)
-
-                    processed_offers += 1
-                    progress = (processed_offers / total_offers) * 100.0
-                    async with job_progress_lock:
-                        job_progress[job_id]["processing_progress"] = progress
-
-                await session.commit()
-
-        await es_service.refresh_index("products")
-
-        async with job_progress_lock:
-            job_progress[job_id]["processing_progress"] = 100.0
-
-        await update_similar_skus(job_id)
 
+@app.get(
+    "/cache/stats",
+    summary="Get SKU cache statistics",
+    description="Returns the size and hit/miss counters of the `/sku/{uuid}` response cache.",
+)
+async def get_cache_stats() -> CacheStatsResponse:
+    lookups = sku_cache.hits + sku_cache.misses
+    return CacheStatsResponse(
+        size=sku_cache.size,
+        hits=sku_cache.hits,
+        misses=sku_cache.misses,
+        hit_ratio=sku_cache.hits / lookups if lookups else 0.0,
+        invalidations=sku_cache.invalidations,
+    )
+
+
+async def process_xml_file(job_id: str) -> None:
+    job = await load_job(job_id)
+    if job is None:
+        logger.error(f"Job {job_id} not found")
+        return
+    metrics = job_metrics.setdefault(
+        job_id, JobMetrics(job_id, job.status, job.processing_progress, job.update_similar_progress)
+    )
+    run_started = time.monotonic()
+
+    def elapsed() -> float:
+        return job.elapsed_seconds + time.monotonic() - run_started
+
+    profiler = start_profiler(job)
+    profiler_token = current_profiler.set(profiler)
+    try:
+        metrics.status = JobStatus.RUNNING.value
+        await save_job(job_id, status=JobStatus.RUNNING.value, started_at=job.started_at or func.now(), error=None)
+
+        if job.phase == JobPhase.INGEST:
+            with profiled("ingest"):
+                await ingest_feed(job, metrics, elapsed)
+
+        with profiled("similarity"):
+            await update_similar_skus(
+                metrics, only_unmatched=job.mode == ImportMode.INCREMENTAL, after_uuid=job.similarity_after_uuid
+            )
+
+        wall_time = elapsed()
+        metrics.status = JobStatus.COMPLETED.value
+        await save_job(
+            job_id,
+            status=JobStatus.COMPLETED.value,
+            update_similar_progress=100.0,
+            finished_at=func.now(),
+            elapsed_seconds=wall_time,
+            rows_per_second=job.rows / wall_time if wall_time > 0 else None,
+        )
         logger.info(f"Job {job_id} completed successfully")
 
     except Exception as e:
         logger.error(f"Error processing XML file: {e}")
-        async with job_progress_lock:
-            job_progress[job_id]["processing_progress"] = -1.0
+        metrics.status = JobStatus.FAILED.value
+        metrics.processing.value = -1.0
+        try:
+            await save_job(job_id, status=JobStatus.FAILED.value, error=str(e), elapsed_seconds=elapsed())
+        except Exception as save_error:
+            logger.error(f"Error saving the state of job {job_id}: {save_error}")
 
     finally:
-        pass
-
-
-async def clear_elasticsearch_index() -> None:
-    index_name = "products"
-    if await es_client.indices.exists(index=index_name):
-        logger.info(f"Deleting Elasticsearch index '{index_name}'")
-        await es_client.indices.delete(index=index_name)
-    logger.info(f"Creating Elasticsearch index '{index_name}'")
-    index_body = {
-        "mappings": {
-            "properties": {
-                "name": {"type": "text", "analyzer": "russian"},
-                "description": {"type": "text", "analyzer": "russian"},
-            }
-        }
-    }
-    await es_service.create_index(index_name, index_body)
+        current_profiler.reset(profiler_token)
+        if profiler is not None:
+            await save_profile(job_id, profiler)
+
 
+def start_profiler(job: ImportJob) -> JobProfiler | None:
+    if job.profiling is None:
+        return None
+    sample_interval = settings.PROFILE_SAMPLE_INTERVAL if job.profiling == ProfilingMode.SAMPLING else None
+    profiler = JobProfiler(sample_interval)
+    profiler.start()
+    return profiler
 
-async def clear_sku_table() -> None:
+
+async def save_profile(job_id: str, profiler: JobProfiler) -> None:
+    """
+    Stores the profile of the run that just ended, replacing the one of an earlier run of the job.
+    """
+    profiler.stop()
+    try:
+        await save_job(job_id, profile=profiler.breakdown(), profile_stacks=profiler.folded_stacks() or None)
+    except Exception as e:
+        logger.error(f"Error saving the profile of job {job_id}: {e}")
+
+
+async def ingest_feed(job: ImportJob, metrics: JobMetrics, elapsed: Callable[[], float]) -> None:
+    """
+    Loads the feed into Postgres and Elasticsearch, from the job's last checkpoint if it has one.
+
+    `job` is updated in place with every checkpoint saved.
+    """
+    job_id = str(job.job_id)
+
+    async def report_progress(progress: float) -> None:
+        metrics.processing.set(progress * 100.0)
+
+    upload = feed_uploads.get(job.filename)
+    feed = xml_parser.open_feed(job.filename, upload.source if upload is not None else None)
+    incremental = job.mode == ImportMode.INCREMENTAL
+    start_offset = job.byte_offset
+    new_index: str | None = None
+
+    if start_offset and not await has_import_keys(job_id):
+        # sku_import_key is UNLOGGED and emptied by a database crash, removing missing SKUs needs every key
+        logger.warning(f"Import keys of job {job_id} are lost, restarting it from the beginning")
+        start_offset = 0
+
+    if incremental:
+        index_name = await get_products_index()
+    elif start_offset and job.index_name and await es_client.indices.exists(index=job.index_name):
+        index_name = new_index = job.index_name
+    else:
+        if job.index_name and await es_client.indices.exists(index=job.index_name):
+            # Left by a run that stopped before its first checkpoint
+            await es_service.delete_index(job.index_name)
+        # A full import builds a new index generation, readers keep using the current one until the cutover. The
+        # rows are upserted in place and the SKUs missing from the feed deleted at the end, so the catalog keeps
+        # serving, with the uuids the current generation refers to, and a failed run leaves it whole
+        index_name = new_index = await es_service.create_versioned_index(PRODUCTS_ALIAS, PRODUCTS_INDEX_BODY)
+        start_offset = 0
+
+    if start_offset != job.byte_offset:
+        job.byte_offset, job.last_batch, job.rows = start_offset, 0, 0
+    job.index_name = index_name
+    await save_job(
+        job_id, index_name=index_name, byte_offset=job.byte_offset, last_batch=job.last_batch, rows=job.rows
+    )
+
+    if start_offset < feed.total_bytes or not feed.complete:
+        if start_offset:
+            logger.info(f"Resuming job {job_id} from byte {start_offset} of {feed.total_bytes}")
+        rows_before, batches_before = job.rows, job.last_batch
+
+        async def save_checkpoint(byte_offset: int, batches: int) -> None:
+            job.byte_offset = byte_offset
+            job.last_batch = batches_before + batches
+            job.rows = rows_before + pipeline.stats["write"].items
+            await save_job(
+                job_id,
+                byte_offset=job.byte_offset,
+                last_batch=job.last_batch,
+                rows=job.rows,
+                processing_progress=metrics.processing.value,
+                elapsed_seconds=elapsed(),
+            )
+
+        async with es_service.bulk_load_settings(index_name):
+            async with es_service.bulk_indexer(
+                index_name,
+                chunk_size=settings.ES_BULK_CHUNK_SIZE,
+                max_chunk_bytes=settings.ES_BULK_MAX_CHUNK_BYTES,
+                max_concurrency=settings.ES_BULK_MAX_CONCURRENCY,
+                max_retries=settings.ES_BULK_MAX_RETRIES,
+            ) as indexer:
+                pipeline = IngestionPipeline(
+                    xml_parser,
+                    feed,
+                    indexer,
+                    report_progress,
+                    job_id,
+                    incremental=incremental,
+                    remove_missing=True,
+                    batch_size=settings.SKU_BATCH_SIZE,
+                    queue_size=settings.INGEST_QUEUE_SIZE,
+                    db_writers=settings.INGEST_DB_WRITERS,
+                    parse_processes=settings.XML_PARSE_PROCESSES,
+                    shard_size=settings.XML_SHARD_SIZE,
+                    on_skus_changed=invalidate_cached_skus,
+                    start_offset=start_offset,
+                    on_checkpoint=save_checkpoint,
+                    checkpoint_interval=settings.IMPORT_CHECKPOINT_INTERVAL,
+                )
+                metrics.stages.update(pipeline.stats)
+                metrics.queue_depths = pipeline.queue_depths
+                metrics.bulk_rejections = lambda: indexer.rejections
+                try:
+                    with profiled("ingest.pipeline"):
+                        await pipeline.run()
+                finally:
+                    metrics.queue_depths = None
+
+        job.byte_offset = feed.total_bytes
+        job.rows = rows_before + pipeline.stats["write"].items
+        await save_job(job_id, byte_offset=job.byte_offset, rows=job.rows, elapsed_seconds=elapsed())
+
+    with profiled("ingest.publish"):
+        await es_service.refresh_index(index_name)
+        if new_index is not None:
+            if settings.ES_FORCE_MERGE:
+                await es_service.force_merge(new_index)
+            await es_service.swap_alias(PRODUCTS_ALIAS, new_index)
+            await es_service.prune_generations(PRODUCTS_ALIAS, settings.ES_INDEX_GENERATIONS)
+        # Cached searches miss what the job added, changed or removed
+        await search_cache.clear()
+
+    job.phase = JobPhase.SIMILARITY.value
+    await save_job(job_id, phase=job.phase, processing_progress=100.0)
+    metrics.processing.set(100.0)
+
+
+async def load_job(job_id: str) -> ImportJob | None:
+    try:
+        job_uuid = str(uuid.UUID(job_id))
+    except ValueError:
+        return None
     async for session in get_db():
+        return await JobService(session).get_job(job_uuid)
+    return None
+
+
+async def save_job(job_id: str, **values: Any) -> None:
+    async for session in get_import_db():
         async with session.begin():
-            logger.info("Clearing 'sku' table in the database")
-            await session.execute(text("TRUNCATE TABLE public.sku RESTART IDENTITY CASCADE"))
-            await session.commit()
+            await JobService(session).update_job(job_id, **values)
 
 
-async def update_similar_skus(job_id: str) -> None:
+async def mark_interrupted_jobs() -> None:
+    """
+    Jobs still `running` or `queued` in the table belonged to a process that stopped without finishing them.
+    """
+    try:
+        async for session in get_db():
+            async with session.begin():
+                job_ids = await JobService(session).mark_interrupted_jobs()
+    except Exception as e:
+        logger.error(f"Error marking interrupted jobs: {e}")
+        return
+    for job_id in job_ids:
+        logger.warning(f"Job {job_id} was interrupted, resume it with POST /jobs/{job_id}/resume")
+
+
+async def discard_job(job: ImportJob) -> None:
+    """
+    Removes what an unfinished job kept for resuming it.
+    """
+    job_id = str(job.job_id)
+    async for session in get_import_db():
+        async with session.begin():
+            await SKUService(session).clear_import_keys(job_id)
+    if (
+        job.mode == ImportMode.FULL
+        and job.phase == JobPhase.INGEST
+        and job.index_name
+        and await es_client.indices.exists(index=job.index_name)
+    ):
+        if job.index_name not in await es_service.get_alias_indices(PRODUCTS_ALIAS):
+            await es_service.delete_index(job.index_name)
+
+
+async def start_job(file_path: str, mode: ImportMode, profiling: ProfilingMode | None = None) -> str:
+    """
+    Records a new import job of `file_path` and queues it.
+    """
+    job_id = str(uuid.uuid4())
     async for session in get_db():
         async with session.begin():
-            result = await session.execute(select(SKU))
-            skus = result.scalars().all()
-            total_skus = len(skus)
-            processed_skus = 0
-
-            for sku in skus:
-                similar_uuids: list[str] = await es_service.search_similar(index_name="products", sku=sku)
-                similar_uuids_as_uuid: list[uuid.UUID] = [uuid.UUID(uuid_str) for uuid_str in similar_uuids]
-                sku.similar_sku = similar_uuids_as_uuid
-                session.add(sku)
-                processed_skus += 1
-                progress = (processed_skus / total_skus) * 100.0
-                async with job_progress_lock:
-                    job_progress[job_id]["update_similar_progress"] = progress
-            await session.commit()
+            await JobService(session).create_job(
+                job_id, file_path, mode.value, profiling.value if profiling is not None else None
+            )
+    prune_finished_jobs(job_metrics, settings.JOB_METRICS_RETENTION, settings.JOB_METRICS_MAX_FINISHED)
+    job_metrics[job_id] = JobMetrics(job_id, JobStatus.QUEUED.value)
+    # Every import deletes the SKUs its feed does not have, so it cannot run next to another one
+    job_scheduler.submit(job_id, file_path, exclusive=True)
+    return job_id
+
+
+async def start_upload(
+    file_path: str, encoding: str | None, expected_size: int | None = None, resume: bool = False
+) -> FeedUpload:
+    if file_path in feed_uploads:
+        raise HTTPException(status_code=409, detail="File is being uploaded")
+    try:
+        upload = FeedUpload(file_path, encoding, expected_size, settings.UPLOAD_IDLE_TIMEOUT)
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    await upload.start(resume)
+    feed_uploads[file_path] = upload
+    return upload
+
+
+async def finish_upload(upload: FeedUpload) -> None:
+    await upload.finish()
+    feed_uploads.pop(upload.path, None)
+
+
+async def discard_upload(upload: FeedUpload, error: str) -> None:
+    await upload.abort(error)
+    feed_uploads.pop(upload.path, None)
+
+
+async def release_upload(upload: FeedUpload, error: str) -> None:
+    """
+    Stops tracking an unfinished upload, keeping its part file when a later request can continue it.
+    """
+    if upload.resumable:
+        await upload.suspend(error)
+        feed_uploads.pop(upload.path, None)
+    else:
+        await discard_upload(upload, error)
+
+
+async def expire_idle_uploads() -> None:
+    """
+    Releases the uploads no request wrote to for `UPLOAD_IDLE_TIMEOUT` seconds, such as a `Content-Range` upload
+    whose client went away, so their files are closed and the feeds can be processed or uploaded again.
+    """
+    while True:
+        await asyncio.sleep(min(UPLOAD_EXPIRY_INTERVAL, settings.UPLOAD_IDLE_TIMEOUT))
+        for upload in list(feed_uploads.values()):
+            if upload.idle_seconds > settings.UPLOAD_IDLE_TIMEOUT:
+                logger.info(f"Upload of {upload.path} idle for {upload.idle_seconds:.0f}s, releasing it")
+                await release_upload(upload, "The upload was abandoned")
+
+
+async def has_import_keys(job_id: str) -> bool:
+    async for session in get_import_db():
+        return await SKUService(session).has_import_keys(job_id)
+    return False
+
+
+async def get_products_index() -> str:
+    """
+    Returns the index generation the `products` alias points to, creating the first one if there is none yet.
+    """
+    indices = await es_service.get_alias_indices(PRODUCTS_ALIAS)
+    if indices:
+        return indices[-1]
+    if await es_client.indices.exists(index=PRODUCTS_ALIAS):
+        # Index created before aliases were used, it keeps serving until the next full import replaces it
+        return PRODUCTS_ALIAS
+    index_name = await es_service.create_versioned_index(PRODUCTS_ALIAS, PRODUCTS_INDEX_BODY)
+    await es_service.swap_alias(PRODUCTS_ALIAS, index_name)
+    return index_name
+
+
+async def invalidate_cached_skus(uuids: list[uuid.UUID]) -> None:
+    await sku_cache.invalidate(str(sku_uuid) for sku_uuid in uuids)
+
+
+async def update_similar_skus(
+    metrics: JobMetrics, only_unmatched: bool = False, after_uuid: uuid.UUID | None = None
+) -> None:
+    async def report_progress(progress: float) -> None:
+        metrics.similarity.set(progress * 100.0)
+
+    async def save_checkpoint(last_uuid: uuid.UUID) -> None:
+        await save_job(
+            metrics.job_id, similarity_after_uuid=last_uuid, update_similar_progress=metrics.similarity.value
+        )
+
+    duplicates = None
+    if settings.SIMILARITY_MAX_DUPLICATE_GROUP > 1:
+        duplicates = DuplicateGroups(settings.SIMILARITY_TOP_K, settings.SIMILARITY_MAX_DUPLICATE_GROUP)
+    similarity_service = SimilarityService(
+        build_similarity_matcher(),
+        duplicates,
+        chunk_size=settings.SIMILARITY_CHUNK_SIZE,
+        on_skus_changed=invalidate_cached_skus,
+        on_checkpoint=save_checkpoint,
+    )
+    metrics.stages[similarity_service.stats.name] = similarity_service.stats
+    await similarity_service.update_all(report_progress, only_unmatched, after_uuid)
+
+
+def build_similarity_matcher() -> SimilarityMatcher:
+    blocks = None
+    if settings.SIMILARITY_BLOCKS:
+        blocks = SimilarityBlocks(settings.SIMILARITY_BLOCKS, settings.SIMILARITY_MIN_BLOCK_SIZE)
+    if settings.SIMILARITY_BACKEND == "local":
+        return LocalSimilarityMatcher(
+            processes=settings.LOCAL_SIMILARITY_PROCESSES, top_k=settings.SIMILARITY_TOP_K, blocks=blocks
+        )
+    return ElasticsearchMatcher(
+        es_service,
+        PRODUCTS_ALIAS,
+        msearch_batch_size=settings.SIMILARITY_MSEARCH_BATCH_SIZE,
+        max_concurrency=settings.SIMILARITY_MAX_CONCURRENCY,
+        blocks=blocks,
+        top_k=settings.SIMILARITY_TOP_K,
+    )
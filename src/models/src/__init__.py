@@ -1,7 +1,15 @@
 from src.models.src.models import Base
+from src.models.src.modules.category import Category
+from src.models.src.modules.import_job import ImportJob
 from src.models.src.modules.sku import SKU
+from src.models.src.modules.sku_import_key import SKUImportKey
+from src.models.src.modules.sku_similarity import SKUSimilarity
 
 __all__ = [
     "Base",
+    "Category",
+    "ImportJob",
     "SKU",
+    "SKUImportKey",
+    "SKUSimilarity",
 ]
@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from sqlalchemy import TIMESTAMP, Index, Integer, Text, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.models.src import Base
+
+
+class Category(Base):
+    """
+    Category tree of the last imported feed with the resolved path of each category, joined to `sku` on
+    `(marketplace_id, category_id)`.
+    """
+
+    __tablename__ = "category"
+    __table_args__ = (
+        Index("category_parent_id_index", "marketplace_id", "parent_id"),
+        {"schema": "public"},
+    )
+
+    marketplace_id: Mapped[int] = mapped_column(Integer, primary_key=True, comment="id маркетплейса")
+    category_id: Mapped[int] = mapped_column(Integer, primary_key=True, comment="id категории в маркетплейсе")
+    parent_id: Mapped[int | None] = mapped_column(Integer, nullable=True, comment="id родительской категории")
+    name: Mapped[str | None] = mapped_column(Text, nullable=True, comment="Название категории")
+    level: Mapped[int] = mapped_column(Integer, nullable=False, comment="Глубина категории, у корневой 1")
+    path: Mapped[str] = mapped_column(Text, nullable=False, comment="Полный путь категории через /")
+    category_lvl_1: Mapped[str | None] = mapped_column(Text, nullable=True)
+    category_lvl_2: Mapped[str | None] = mapped_column(Text, nullable=True)
+    category_lvl_3: Mapped[str | None] = mapped_column(Text, nullable=True)
+    category_remaining: Mapped[str | None] = mapped_column(Text, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,61 @@
+from datetime import datetime
+from typing import Any
+from uuid import UUID
+
+from sqlalchemy import TIMESTAMP, BigInteger, Double, Index, Integer, Text, func
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import UUID as PGUUID
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.models.src import Base
+
+
+class ImportJob(Base):
+    """
+    State of a feed import, checkpointed while it runs so an interrupted job can resume where it stopped.
+    """
+
+    __tablename__ = "import_job"
+    __table_args__ = (
+        Index("import_job_status_index", "status"),
+        {"schema": "public"},
+    )
+
+    job_id: Mapped[UUID] = mapped_column(PGUUID(as_uuid=True), primary_key=True)
+    filename: Mapped[str] = mapped_column(Text, nullable=False, comment="Путь к файлу выгрузки")
+    mode: Mapped[str] = mapped_column(Text, nullable=False, comment="Режим загрузки: full или incremental")
+    status: Mapped[str] = mapped_column(
+        Text, nullable=False, comment="queued, running, interrupted, failed, cancelled, completed"
+    )
+    phase: Mapped[str] = mapped_column(Text, nullable=False, comment="Текущая фаза: ingest или similarity")
+    index_name: Mapped[str | None] = mapped_column(Text, nullable=True, comment="Индекс elasticsearch загрузки")
+    byte_offset: Mapped[int] = mapped_column(
+        BigInteger, nullable=False, default=0, comment="Смещение в файле, до которого все офферы сохранены"
+    )
+    last_batch: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, comment="Номер последнего сохранённого пакета офферов"
+    )
+    similarity_after_uuid: Mapped[UUID | None] = mapped_column(
+        PGUUID(as_uuid=True), nullable=True, comment="uuid последнего SKU, для которого сохранены похожие"
+    )
+    processing_progress: Mapped[float] = mapped_column(Double, nullable=False, default=0.0)
+    update_similar_progress: Mapped[float] = mapped_column(Double, nullable=False, default=0.0)
+    rows: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, comment="Записано строк в sku")
+    elapsed_seconds: Mapped[float] = mapped_column(
+        Double, nullable=False, default=0.0, comment="Время работы загрузки без учёта простоя"
+    )
+    rows_per_second: Mapped[float | None] = mapped_column(Double, nullable=True)
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    profiling: Mapped[str | None] = mapped_column(
+        Text, nullable=True, comment="Режим профилирования: spans или sampling, пусто если выключено"
+    )
+    profile: Mapped[dict[str, Any] | None] = mapped_column(
+        JSONB, nullable=True, comment="Время по участкам загрузки за последний запуск"
+    )
+    profile_stacks: Mapped[str | None] = mapped_column(
+        Text, nullable=True, comment="Стеки последнего запуска в формате folded для flamegraph"
+    )
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP, server_default=func.now())
+    started_at: Mapped[datetime | None] = mapped_column(TIMESTAMP, nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(TIMESTAMP, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
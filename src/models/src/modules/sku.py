@@ -2,6 +2,7 @@ from typing import Any
 from uuid import UUID
 
 from sqlalchemy import ARRAY, JSON, TIMESTAMP, BigInteger, Double, Float, Index, Integer, Numeric, Text, func
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.dialects.postgresql import UUID as PGUUID
 from sqlalchemy.orm import Mapped, mapped_column
 
@@ -19,10 +20,12 @@ class SKU(Base):
             unique=True,
         ),
         Index("sku_uuid_uindex", "uuid", unique=True),
+        Index("sku_similar_sku_gin_index", "similar_sku", postgresql_using="gin"),
+        Index("sku_marketplace_id_category_id_index", "marketplace_id", "category_id"),
         {"schema": "public"},
     )
 
-    uuid: Mapped[str] = mapped_column(PGUUID(as_uuid=True), primary_key=True, comment="id товара в нашей бд")
+    uuid: Mapped[UUID] = mapped_column(PGUUID(as_uuid=True), primary_key=True, comment="id товара в нашей бд")
     marketplace_id: Mapped[int] = mapped_column(Integer, nullable=False, comment="id маркетплейса")
     product_id: Mapped[int] = mapped_column(BigInteger, nullable=False, comment="id товара в маркетплейсе")
     title: Mapped[str | None] = mapped_column(Text, nullable=True, comment="название товара")
@@ -49,3 +52,7 @@ class SKU(Base):
     currency: Mapped[str | None] = mapped_column(Text, nullable=True)
     barcode: Mapped[int | None] = mapped_column(Numeric(precision=60, scale=0), nullable=True, comment="Штрихкод")
     similar_sku: Mapped[list[UUID] | None] = mapped_column(ARRAY(PGUUID(as_uuid=True)), nullable=True)
+    similar_sku_snapshot: Mapped[list[dict[str, Any]] | None] = mapped_column(
+        JSONB, nullable=True, comment="Похожие товары с названием, ценой и картинкой на момент сопоставления"
+    )
+    content_hash: Mapped[str | None] = mapped_column(Text, nullable=True, comment="Хэш содержимого оффера")
@@ -0,0 +1,20 @@
+from uuid import UUID
+
+from sqlalchemy import BigInteger, Integer
+from sqlalchemy.dialects.postgresql import UUID as PGUUID
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.models.src import Base
+
+
+class SKUImportKey(Base):
+    """
+    Keys of the offers seen by an incremental import, used to find SKUs that disappeared from the feed.
+    """
+
+    __tablename__ = "sku_import_key"
+    __table_args__ = ({"schema": "public", "prefixes": ["UNLOGGED"]},)
+
+    job_id: Mapped[UUID] = mapped_column(PGUUID(as_uuid=True), primary_key=True)
+    marketplace_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    product_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
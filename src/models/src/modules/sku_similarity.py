@@ -0,0 +1,33 @@
+from uuid import UUID
+
+from sqlalchemy import Double, ForeignKey, Index, SmallInteger
+from sqlalchemy.dialects.postgresql import UUID as PGUUID
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.models.src import Base
+
+
+class SKUSimilarity(Base):
+    """
+    Similar SKUs of a SKU with their scores, best first, one row per pair.
+    """
+
+    __tablename__ = "sku_similarity"
+    __table_args__ = (
+        Index("sku_similarity_similar_uuid_index", "similar_uuid"),
+        {"schema": "public"},
+    )
+
+    sku_uuid: Mapped[UUID] = mapped_column(
+        PGUUID(as_uuid=True), ForeignKey("public.sku.uuid", ondelete="CASCADE"), primary_key=True, comment="id товара"
+    )
+    rank: Mapped[int] = mapped_column(SmallInteger, primary_key=True, comment="Место похожего товара, с 1")
+    similar_uuid: Mapped[UUID] = mapped_column(
+        PGUUID(as_uuid=True),
+        ForeignKey("public.sku.uuid", ondelete="CASCADE"),
+        nullable=False,
+        comment="id похожего товара",
+    )
+    score: Mapped[float | None] = mapped_column(
+        Double, nullable=True, comment="Оценка похожести, пустая у точных дублей"
+    )
@@ -0,0 +1,77 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# category_lvl_1, category_lvl_2, category_lvl_3 and category_remaining of an SKU
+CategoryLevels = tuple[str | None, str | None, str | None, str | None]
+NO_CATEGORY_LEVELS: CategoryLevels = (None, None, None, None)
+
+
+class CategoryTree:
+    """
+    Paths of all categories of a feed, resolved once per import instead of walking parent links for every offer.
+
+    Each category is resolved once: its path is the memoized path of its parent plus its own name. A category
+    whose parent is not in the feed (dangling) is treated as a root, and so is the category that would close a
+    cycle of parent links, so every path is finite. Both are collected in `dangling` and `cycles`.
+    """
+
+    def __init__(self, categories: dict[str, dict[str, str | None]]):
+        self.categories = categories
+        self.paths: dict[str, tuple[str, ...]] = {}
+        self.levels: dict[str, CategoryLevels] = {}
+        self.dangling: list[str] = []
+        self.cycles: list[str] = []
+
+        for category_id in categories:
+            self._resolve(category_id)
+        if self.dangling:
+            logger.warning(f"{len(self.dangling)} categories have a missing parent, e.g. {self.dangling[:5]}")
+        if self.cycles:
+            logger.warning(f"{len(self.cycles)} categories are in a cycle of parents, e.g. {self.cycles[:5]}")
+
+    def path(self, category_id: str | None) -> tuple[str, ...]:
+        """
+        Names from the root category down to `category_id`, empty for an unknown category.
+        """
+        return self.paths.get(category_id, ()) if category_id is not None else ()
+
+    def levels_of(self, category_id: str | None) -> CategoryLevels:
+        return self.levels.get(category_id, NO_CATEGORY_LEVELS) if category_id is not None else NO_CATEGORY_LEVELS
+
+    def _resolve(self, category_id: str) -> None:
+        # Climbs to the first category with a known path, then fills in the paths on the way back down
+        chain: list[str] = []
+        in_chain: set[str] = set()
+        parent_path: tuple[str, ...] = ()
+        current_id: str | None = category_id
+        while current_id:
+            if current_id in self.paths:
+                parent_path = self.paths[current_id]
+                break
+            category = self.categories.get(current_id)
+            if category is None:
+                self.dangling.append(chain[-1])
+                break
+            if current_id in in_chain:
+                self.cycles.append(chain[-1])
+                break
+            chain.append(current_id)
+            in_chain.add(current_id)
+            current_id = category["parent_id"]
+
+        for chain_id in reversed(chain):
+            name = self.categories[chain_id]["name"]
+            path = parent_path + (name,) if name is not None else parent_path
+            self.paths[chain_id] = path
+            self.levels[chain_id] = to_levels(path)
+            parent_path = path
+
+
+def to_levels(path: tuple[str, ...]) -> CategoryLevels:
+    return (
+        path[0] if len(path) > 0 else None,
+        path[1] if len(path) > 1 else None,
+        path[2] if len(path) > 2 else None,
+        "/".join(path[3:]) if len(path) > 3 else None,
+    )
@@ -0,0 +1,266 @@
+import bz2
+import gzip
+import io
+import os
+import queue
+import threading
+import time
+import zlib
+from typing import IO, Any, Callable, Protocol, cast
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    HAS_ZSTANDARD = False
+else:
+    HAS_ZSTANDARD = True
+
+POLL_INTERVAL = 0.1
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".zst": "zstd", ".bz2": "bzip2"}
+FEED_SUFFIXES = (".xml", *(f".xml{suffix}" for suffix in COMPRESSION_SUFFIXES))
+
+PREFETCH_CHUNK_SIZE = 1024 * 1024
+PREFETCH_DEPTH = 4
+
+
+def compression_of(filename: str) -> str | None:
+    """
+    Returns the compression of a file by its suffix (`gzip`, `zstd` or `bzip2`), or None for a plain file.
+    """
+    return COMPRESSION_SUFFIXES.get(os.path.splitext(filename)[1].lower())
+
+
+class Decompressor(Protocol):
+    def decompress(self, data: bytes) -> bytes:
+        """Returns the output available so far for `data`."""
+
+    def flush(self) -> bytes:
+        """Returns the remaining output at the end of the stream."""
+
+
+class MultiStreamDecompressor:
+    """
+    Incremental decompressor that also handles concatenated streams (as written by `pigz`, `pbzip2` or
+    `cat a.gz b.gz`).
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any], errors: tuple[type[Exception], ...]):
+        self._name = name
+        self._factory = factory
+        self._errors = errors
+        self._decompressor = factory()
+        self._in_stream = False
+
+    def decompress(self, data: bytes) -> bytes:
+        chunks: list[bytes] = []
+        try:
+            while data:
+                self._in_stream = True
+                chunks.append(self._decompressor.decompress(data))
+                if not self._decompressor.eof:
+                    break
+                data = self._decompressor.unused_data
+                self._decompressor = self._factory()
+                self._in_stream = False
+        except self._errors as e:
+            raise ValueError(f"Invalid {self._name} data: {e}") from e
+        return b"".join(chunks)
+
+    def flush(self) -> bytes:
+        if self._in_stream:
+            raise ValueError(f"Truncated {self._name} data")
+        return b""
+
+
+class ZstdDecompressor:
+    def __init__(self) -> None:
+        if not HAS_ZSTANDARD:
+            raise ValueError("zstd support requires the 'zstandard' package")
+        self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    def decompress(self, data: bytes) -> bytes:
+        try:
+            decompressed: bytes = self._decompressor.decompress(data)
+        except zstandard.ZstdError as e:
+            raise ValueError(f"Invalid zstd data: {e}") from e
+        return decompressed
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def make_decompressor(encoding: str) -> Decompressor:
+    """
+    Returns an incremental decompressor for `gzip`, `zstd` or `bzip2` data.
+
+    Decompressors raise ValueError for corrupt or truncated data.
+    """
+    if encoding == "gzip":
+        return MultiStreamDecompressor("gzip", lambda: zlib.decompressobj(GZIP_WBITS), (zlib.error,))
+    if encoding == "bzip2":
+        return MultiStreamDecompressor("bzip2", bz2.BZ2Decompressor, (OSError, ValueError))
+    if encoding == "zstd":
+        return ZstdDecompressor()
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def open_decompressed(stream: IO[bytes], compression: str) -> IO[bytes]:
+    """
+    Wraps a compressed binary stream into a stream of the decompressed data.
+    """
+    if compression == "gzip":
+        return cast(IO[bytes], gzip.GzipFile(fileobj=stream, mode="rb"))
+    if compression == "bzip2":
+        return cast(IO[bytes], bz2.BZ2File(stream))
+    if compression == "zstd":
+        if not HAS_ZSTANDARD:
+            raise ValueError("zstd support requires the 'zstandard' package")
+        return cast(IO[bytes], zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True))
+    raise ValueError(f"Unsupported compression: {compression}")
+
+
+class PrefetchReader(io.RawIOBase):
+    """
+    Decompresses `compressed` in a background thread, `depth` chunks ahead of the reader, so decompression overlaps
+    with parsing (zlib, bz2 and zstd release the GIL while they work).
+
+    `tell()` returns the position in the compressed stream `raw` after the chunk being read, so progress and
+    checkpoints of a compressed feed are in compressed bytes. It is never behind the data handed out.
+    """
+
+    def __init__(
+        self,
+        raw: IO[bytes],
+        compression: str,
+        chunk_size: int = PREFETCH_CHUNK_SIZE,
+        depth: int = PREFETCH_DEPTH,
+    ):
+        self._raw = raw
+        self._decompressed = open_decompressed(raw, compression)
+        self._chunk_size = chunk_size
+        self._chunks: queue.Queue[tuple[bytes, int] | BaseException] = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._buffer = memoryview(b"")
+        self._position = 0
+        self._eof = False
+        self._thread = threading.Thread(target=self._prefetch, daemon=True)
+        self._thread.start()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: bytearray | memoryview) -> int:  # type: ignore[override]
+        if not self._buffer and not self._eof:
+            item = self._chunks.get()
+            if isinstance(item, BaseException):
+                self._eof = True
+                raise item
+            data, self._position = item
+            self._buffer = memoryview(data)
+            self._eof = not data
+        count = min(len(buffer), len(self._buffer))
+        buffer[:count] = self._buffer[:count]
+        self._buffer = self._buffer[count:]
+        return count
+
+    def tell(self) -> int:
+        return self._position
+
+    def close(self) -> None:
+        if not self.closed:
+            self._stop.set()
+            # Unblocks a prefetch thread waiting on a full queue
+            while self._thread.is_alive():
+                try:
+                    self._chunks.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    pass
+            self._decompressed.close()
+            self._raw.close()
+        super().close()
+
+    def _prefetch(self) -> None:
+        try:
+            while not self._stop.is_set():
+                data = self._decompressed.read(self._chunk_size)
+                self._put((data, self._raw.tell()))
+                if not data:
+                    return
+        except BaseException as e:
+            self._put(e)
+
+    def _put(self, item: tuple[bytes, int] | BaseException) -> None:
+        while not self._stop.is_set():
+            try:
+                self._chunks.put(item, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+
+class GrowingFile:
+    """
+    A file that is still being appended to, e.g. by an upload in progress.
+
+    Readers get the data written so far and block at its end until more arrives or the writer finishes. A reader
+    that waits longer than `idle_timeout` seconds for new data gives up.
+    """
+
+    def __init__(self, path: str, expected_size: int | None = None, idle_timeout: float = 600.0):
+        self.path = path
+        self.expected_size = expected_size
+        self.idle_timeout = idle_timeout
+        self.written = 0
+        self.error: str | None = None
+        self._finished = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+
+    @property
+    def total_bytes(self) -> int:
+        return max(self.expected_size or 0, self.written)
+
+    def finish(self, error: str | None = None) -> None:
+        self.error = error
+        self._finished.set()
+
+    def open(self) -> "GrowingFileReader":
+        return GrowingFileReader(self)
+
+
+class GrowingFileReader(io.RawIOBase):
+    def __init__(self, growing_file: GrowingFile):
+        self._growing_file = growing_file
+        self._file = open(growing_file.path, "rb")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: bytearray | memoryview) -> int:  # type: ignore[override]
+        waiting_since = time.monotonic()
+        while True:
+            # Checked before reading, so data written right before the writer finished is not missed
+            finished = self._growing_file.finished
+            count = self._file.readinto(buffer)
+            if count:
+                return count
+            if finished:
+                if self._growing_file.error is not None:
+                    raise OSError(f"Writing {self._growing_file.path} failed: {self._growing_file.error}")
+                return 0
+            if time.monotonic() - waiting_since > self._growing_file.idle_timeout:
+                raise TimeoutError(
+                    f"No data written to {self._growing_file.path} for {self._growing_file.idle_timeout} s"
+                )
+            self._growing_file._finished.wait(POLL_INTERVAL)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
@@ -1,74 +1,337 @@
-from typing import Any, Generator
+import os
+import re
+from sys import intern
+from typing import IO, Any, Generator, cast
 
 from lxml import etree
 
+from src.parsers.category_tree import CategoryTree
+from src.parsers.sources import GrowingFile, PrefetchReader, compression_of
 
-class XMLParser:
-    def count_offers(self, xml_file: str) -> int:
-        count = 0
-        context = etree.iterparse(xml_file, events=("end",), tag="offer")
-        for event, elem in context:
-            count += 1
-            elem.clear()
-            while elem.getprevious() is not None:
-                del elem.getparent()[0]
-        del context
-        return count
+# Order of the values in the compact tuples that shard workers send back
+OFFER_FIELDS = (
+    "offer_id",
+    "name",
+    "description",
+    "vendor",
+    "barcode",
+    "category_id",
+    "currency_id",
+    "price",
+    "params",
+    "picture",
+)
+# Position in `OFFER_FIELDS` of the value held by each child tag of <offer>
+OFFER_CHILD_FIELDS = {
+    "name": 1,
+    "description": 2,
+    "vendor": 3,
+    "barcode": 4,
+    "categoryId": 5,
+    "currencyId": 6,
+    "price": 7,
+    "picture": 9,
+}
+# Values repeated across many offers, interned so the parser keeps one copy of each
+INTERNED_FIELDS = frozenset({3, 5, 6})
+PARAMS_FIELD = 8
+EMPTY_OFFER: list[Any] = [None] * len(OFFER_FIELDS)
 
-    def parse_categories(self, xml_file: str) -> dict[str, dict[str, str | None]]:
-        categories: dict[str, dict[str, str | None]] = {}
-        context = etree.iterparse(xml_file, events=("start", "end"))
+SEARCH_CHUNK_SIZE = 1024 * 1024
 
-        for event, elem in context:
-            if event == "start" and elem.tag == "categories":
-                # Start parsing categories section
-                for event_cat, elem_cat in context:
-                    if event_cat == "end" and elem_cat.tag == "category":
-                        category_id = elem_cat.get("id")
-                        parent_id = elem_cat.get("parentId")
-                        name = elem_cat.text.strip() if elem_cat.text else ""
-                        categories[category_id] = {"name": name, "parent_id": parent_id}
-                        elem_cat.clear()
-                    elif event_cat == "end" and elem_cat.tag == "categories":
-                        break  # Finished parsing categories
-            elif event == "end" and elem.tag == "categories":
-                break  # Finished parsing categories
+OFFERS_START_RE = re.compile(rb"<offers[\s>]")
+OFFER_START_RE = re.compile(rb"<offer[\s>]")
+ENCODING_RE = re.compile(rb"""<\?xml[^>]*encoding=["']([A-Za-z0-9._-]+)["']""")
 
-        del context
-        return categories
 
-    def parse_offers(self, xml_file: str) -> Generator[dict[str, Any], None, None]:
-        context = etree.iterparse(xml_file, events=("end",), tag="offer")
+class XMLFeed:
+    """
+    Single streaming pass over a YML feed.
+
+    The `<categories>` section precedes `<offers>` in the feed, so by the time the first offer is yielded
+    `categories` is complete. Progress is measured in bytes consumed from the file rather than offers counted.
+
+    For parallel parsing the `<offers>` section can instead be split into byte ranges starting at `<offer`
+    boundaries (`plan_shards`), each of which `parse_shard` parses on its own. Both ways of reading can start
+    from a byte offset to resume an interrupted import.
+
+    A feed that is still being uploaded is read through its `GrowingFile` `source`. Until the upload finishes only
+    the sequential pass is possible, and progress is relative to the bytes written so far.
+
+    Feeds compressed with gzip, zstd or bzip2 (by their suffix) are decompressed while they are read, in a thread
+    ahead of the parser. Their offsets and progress are in compressed bytes. They cannot be split into shards or
+    seeked into, so resuming one decompresses and parses it from the start and skips the offers before the offset.
+    """
+
+    def __init__(self, xml_file: str, source: GrowingFile | None = None):
+        self.xml_file = xml_file
+        self.compression = compression_of(xml_file)
+        self.source = source if source is not None and not source.finished else None
+        self.total_bytes = os.path.getsize(xml_file) if self.source is None else self.source.total_bytes
+        self.bytes_read = 0
+        self.categories: dict[str, dict[str, str | None]] = {}
+        self.encoding = "utf-8"
+        self._category_tree: CategoryTree | None = None
+
+    @property
+    def complete(self) -> bool:
+        """
+        Whether the whole file is on disk, which the sharded and resumed ways of reading need.
+        """
+        return self.source is None or self.source.finished
+
+    @property
+    def splittable(self) -> bool:
+        """
+        Whether the offers can be read from any byte offset, as `plan_shards` and resuming without a rescan need.
+        """
+        return self.complete and self.compression is None
+
+    @property
+    def category_tree(self) -> CategoryTree:
+        """
+        Paths of the categories read so far, resolved on first use after the categories changed.
+        """
+        if self._category_tree is None:
+            self._category_tree = CategoryTree(self.categories)
+        return self._category_tree
+
+    @property
+    def progress(self) -> float:
+        if self.total_bytes == 0:
+            return 1.0
+        return min(self.bytes_read / self.total_bytes, 1.0)
+
+    def offers(self, start: int = 0) -> Generator[dict[str, Any], None, None]:
+        """
+        Yields the offers of the feed, or with `start` only those from the first `<offer` at or after that byte
+        offset on (the categories are read from the header first).
+        """
+        if start > 0 and self.splittable:
+            yield from self._offers_from(start)
+            return
+
+        with self._open() as stream:
+            context = etree.iterparse(stream, events=("end",), tag=("category", "offer"))
+            for event, elem in context:
+                if elem.tag == "offer":
+                    self.bytes_read = stream.tell()
+                    if self.source is not None:
+                        self.total_bytes = self.source.total_bytes
+                    if self.bytes_read >= start:
+                        yield parse_offer(elem)
+                else:
+                    self._add_category(elem)
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+            del context
+        self.total_bytes = self.bytes_read = max(self.total_bytes, self.bytes_read)
+
+    def _open(self) -> IO[bytes]:
+        stream = self._open_raw()
+        if self.compression is None:
+            return stream
+        return cast(IO[bytes], PrefetchReader(stream, self.compression))
+
+    def _open_raw(self) -> IO[bytes]:
+        if self.source is not None:
+            try:
+                return cast(IO[bytes], self.source.open())
+            except FileNotFoundError:
+                # The upload finished and its part file was renamed into place in the meantime
+                self.source = None
+        return open(self.xml_file, "rb")
+
+    def _offers_from(self, start: int) -> Generator[dict[str, Any], None, None]:
+        self.read_categories()
+        with open(self.xml_file, "rb") as stream:
+            offers_start, offers_end = self._offers_bounds(stream)
+            boundary = _find(stream, OFFER_START_RE, max(start, offers_start))
+            if offers_start != -1 and boundary != -1 and boundary < offers_end:
+                reader = _RangeReader(stream, boundary, offers_end, self.encoding)
+                context = etree.iterparse(reader, events=("end",), tag="offer")
+                for event, elem in context:
+                    self.bytes_read = stream.tell()
+                    yield parse_offer(elem)
+                    elem.clear()
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
+                del context
+        self.bytes_read = self.total_bytes
+
+    def read_categories(self) -> None:
+        """
+        Parses the feed header up to the start of `<offers>`, without reading the offers themselves.
+        """
+        with open(self.xml_file, "rb") as stream:
+            match = ENCODING_RE.search(stream.read(256))
+            if match:
+                self.encoding = match.group(1).decode()
+            stream.seek(0)
+
+            context = etree.iterparse(stream, events=("start", "end"))
+            for event, elem in context:
+                if event == "start" and elem.tag == "offers":
+                    break
+                if event == "end" and elem.tag == "category":
+                    self._add_category(elem)
+                    elem.clear()
+            del context
+
+    def plan_shards(self, shard_size: int, start: int = 0) -> list[tuple[int, int]]:
+        """
+        Splits the `<offers>` section, or its part from the first `<offer` at or after `start`, into
+        `(start, end)` byte ranges of about `shard_size` bytes.
+
+        Ranges are cut right before an `<offer` tag, the last one ends before `</offers>`.
+        """
+        with open(self.xml_file, "rb") as stream:
+            offers_start, offers_end = self._offers_bounds(stream)
+            if offers_start == -1:
+                return []
+            if start > offers_start:
+                offers_start = _find(stream, OFFER_START_RE, start)
+                if offers_start == -1:
+                    return []
+
+            shards: list[tuple[int, int]] = []
+            shard_start = offers_start
+            while shard_start < offers_end:
+                boundary = _find(stream, OFFER_START_RE, shard_start + shard_size)
+                shard_end = offers_end if boundary == -1 or boundary >= offers_end else boundary
+                shards.append((shard_start, shard_end))
+                shard_start = shard_end
+        return shards
+
+    def _offers_bounds(self, stream: IO[bytes]) -> tuple[int, int]:
+        """
+        Returns the byte range of the content of `<offers>`, or `(-1, -1)` when the feed has no offers section.
+        """
+        offers_tag = _find(stream, OFFERS_START_RE, 0)
+        if offers_tag == -1:
+            return -1, -1
+        offers_start = _find_bytes(stream, b">", offers_tag) + 1
+        offers_end = _rfind_bytes(stream, b"</offers>", self.total_bytes)
+        if offers_end == -1:
+            offers_end = self.total_bytes
+        return offers_start, offers_end
+
+    def _add_category(self, elem: etree._Element) -> None:
+        category_id = elem.get("id")
+        if category_id is None:
+            return
+        name = elem.text.strip() if elem.text else ""
+        self.categories[category_id] = {"name": name, "parent_id": elem.get("parentId")}
+        self._category_tree = None
+
+
+class _RangeReader:
+    """
+    File-like view of `[start, end)` wrapped in a synthetic `<offers>` root so lxml can parse it standalone.
+    """
+
+    def __init__(self, stream: IO[bytes], start: int, end: int, encoding: str):
+        self._stream = stream
+        self._remaining = end - start
+        self._prefix = f'<?xml version="1.0" encoding="{encoding}"?><offers>'.encode()
+        self._suffix = b"</offers>"
+        stream.seek(start)
+
+    def read(self, size: int = -1) -> bytes:
+        if self._prefix:
+            data, self._prefix = self._prefix, b""
+            return data
+        if self._remaining > 0:
+            data = self._stream.read(self._remaining if size < 0 else min(size, self._remaining))
+            self._remaining -= len(data)
+            if data:
+                return data
+            self._remaining = 0
+        data, self._suffix = self._suffix, b""
+        return data
+
+
+def parse_shard(xml_file: str, start: int, end: int, encoding: str = "utf-8") -> list[tuple[Any, ...]]:
+    """
+    Parses the offers in one byte range of the feed into compact tuples ordered as `OFFER_FIELDS`.
+
+    Runs in worker processes, so it only takes and returns picklable values.
+    """
+    offers: list[tuple[Any, ...]] = []
+    with open(xml_file, "rb") as stream:
+        context = etree.iterparse(_RangeReader(stream, start, end, encoding), events=("end",), tag="offer")
         for event, elem in context:
-            offer_data = {
-                "offer_id": elem.get("id"),
-                "name": elem.findtext("name"),
-                "description": elem.findtext("description"),
-                "vendor": elem.findtext("vendor"),
-                "barcode": elem.findtext("barcode"),
-                "category_id": elem.findtext("categoryId"),
-                "currency_id": elem.findtext("currencyId"),
-                "price": elem.findtext("price"),
-                "params": {param.get("name"): param.text for param in elem.findall("param")},
-                "picture": elem.findtext("picture"),
-            }
-            yield offer_data
+            offers.append(tuple(decode_offer(elem)))
             elem.clear()
             while elem.getprevious() is not None:
                 del elem.getparent()[0]
         del context
+    return offers
+
 
-    def get_category_hierarchy(self, categories: dict[str, dict[str, str | None]], category_id: str) -> list[str]:
-        hierarchy: list[str] = []
-        current_id: str | None = category_id
-
-        while current_id:
-            category = categories.get(current_id)
-            if category:
-                name = category["name"]
-                if name is not None:
-                    hierarchy.insert(0, name)
-                current_id = category["parent_id"]
-            else:
-                break
-        return hierarchy
+def parse_offer(elem: etree._Element) -> dict[str, Any]:
+    return dict(zip(OFFER_FIELDS, decode_offer(elem)))
+
+
+def decode_offer(elem: etree._Element) -> list[Any]:
+    """
+    Decodes an `<offer>` into a list of values ordered as `OFFER_FIELDS`, in a single pass over its children.
+
+    Gives the same values as looking each field up with `findtext`: the first child of a tag wins, an empty one
+    gives "" and a missing one None. Of repeated `<param>` names the last one wins.
+    """
+    offer = EMPTY_OFFER[:]
+    offer[0] = elem.get("id")
+    params: dict[str | None, str | None] = {}
+    for child in elem:
+        tag = child.tag
+        if tag == "param":
+            name = child.get("name")
+            params[intern(name) if name is not None else None] = child.text
+            continue
+        index = OFFER_CHILD_FIELDS.get(tag)
+        if index is not None and offer[index] is None:
+            text = child.text or ""
+            offer[index] = intern(text) if index in INTERNED_FIELDS else text
+    offer[PARAMS_FIELD] = params
+    return offer
+
+
+def _find(stream: IO[bytes], pattern: re.Pattern[bytes], start: int) -> int:
+    overlap = 64
+    stream.seek(start)
+    position = start
+    tail = b""
+    while chunk := stream.read(SEARCH_CHUNK_SIZE):
+        data = tail + chunk
+        match = pattern.search(data)
+        if match:
+            return position - len(tail) + match.start()
+        tail = data[-overlap:]
+        position += len(chunk)
+    return -1
+
+
+def _find_bytes(stream: IO[bytes], needle: bytes, start: int) -> int:
+    return _find(stream, re.compile(re.escape(needle)), start)
+
+
+def _rfind_bytes(stream: IO[bytes], needle: bytes, end: int) -> int:
+    position = end
+    head = b""
+    while position > 0:
+        start = max(0, position - SEARCH_CHUNK_SIZE)
+        stream.seek(start)
+        data = stream.read(position - start) + head
+        index = data.rfind(needle)
+        if index != -1:
+            return start + index
+        head = data[: len(needle)]
+        position = start
+    return -1
+
+
+class XMLParser:
+    def open_feed(self, xml_file: str, source: GrowingFile | None = None) -> XMLFeed:
+        return XMLFeed(xml_file, source)
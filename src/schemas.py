@@ -1,6 +1,44 @@
+from datetime import datetime
+from enum import Enum
+from uuid import UUID
+
 from pydantic import BaseModel
 
 
+class ImportMode(str, Enum):
+    FULL = "full"
+    INCREMENTAL = "incremental"
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    INTERRUPTED = "interrupted"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+    COMPLETED = "completed"
+
+
+class JobPhase(str, Enum):
+    INGEST = "ingest"
+    SIMILARITY = "similarity"
+
+
+class BatchFormat(str, Enum):
+    JSON = "json"
+    NDJSON = "ndjson"
+
+
+class ProfilingMode(str, Enum):
+    SPANS = "spans"
+    SAMPLING = "sampling"
+
+
+class ProfileFormat(str, Enum):
+    JSON = "json"
+    FOLDED = "folded"
+
+
 class FileResponse(BaseModel):
     files: list[str]
 
@@ -9,20 +47,76 @@ class UploadResponse(BaseModel):
     filename: str
 
 
+class UploadStatusResponse(BaseModel):
+    filename: str
+    received_bytes: int
+    complete: bool
+    job_id: str | None = None
+
+
 class JobResponse(BaseModel):
     message: str
     job_id: str
 
 
+class StageProgressResponse(BaseModel):
+    name: str
+    items: int
+    items_per_second: float
+
+
 class ProgressResponse(BaseModel):
     job_id: str
     processing_progress: float
     update_similar_progress: float
+    status: JobStatus | None = None
+    eta_seconds: float | None = None
+    stages: list[StageProgressResponse] = []
+
+
+class ImportJobResponse(BaseModel):
+    job_id: str
+    filename: str
+    mode: ImportMode
+    status: JobStatus
+    phase: JobPhase
+    byte_offset: int
+    last_batch: int
+    processing_progress: float
+    update_similar_progress: float
+    rows: int
+    elapsed_seconds: float
+    rows_per_second: float | None
+    error: str | None
+    profiling: ProfilingMode | None = None
+    created_at: datetime
+    started_at: datetime | None
+    finished_at: datetime | None
+
+
+class ProfileSpanResponse(BaseModel):
+    name: str
+    count: int
+    seconds: float
+    max_seconds: float
+    share: float
+
+
+class JobProfileResponse(BaseModel):
+    job_id: str
+    profiling: ProfilingMode
+    wall_seconds: float
+    sample_interval: float | None
+    samples: int
+    spans: list[ProfileSpanResponse]
 
 
 class SimilarSKUResponse(BaseModel):
     uuid: str
     title: str | None
+    score: float | None = None
+    price: float | None = None
+    picture: str | None = None
 
 
 class SKUResponse(BaseModel):
@@ -34,3 +128,54 @@ class SKUResponse(BaseModel):
     category_lvl_3: str | None
     category_remaining: str | None
     similar_sku: list[SimilarSKUResponse] | None
+
+
+class SKUBatchRequest(BaseModel):
+    uuids: list[UUID]
+
+
+class SKUProductBatchRequest(BaseModel):
+    marketplace_id: int = 1
+    product_ids: list[int]
+
+
+class SearchHitResponse(BaseModel):
+    uuid: str
+    product_id: int
+    title: str | None
+    brand: str | None
+    price: float | None
+    picture: str | None
+    category_lvl_1: str | None
+    category_lvl_2: str | None
+    category_lvl_3: str | None
+    score: float | None
+
+
+class FacetValueResponse(BaseModel):
+    value: str
+    count: int
+
+
+class SearchFacetsResponse(BaseModel):
+    brand: list[FacetValueResponse]
+    category_lvl_1: list[FacetValueResponse]
+    category_lvl_2: list[FacetValueResponse]
+    category_lvl_3: list[FacetValueResponse]
+    price_min: float | None
+    price_max: float | None
+
+
+class SearchResponse(BaseModel):
+    total: int
+    hits: list[SearchHitResponse]
+    next_cursor: str | None
+    facets: SearchFacetsResponse | None = None
+
+
+class CacheStatsResponse(BaseModel):
+    size: int
+    hits: int
+    misses: int
+    hit_ratio: float
+    invalidations: int
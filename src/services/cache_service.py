@@ -0,0 +1,127 @@
+import time
+from collections import OrderedDict
+from typing import Generic, Iterable, Protocol, TypeVar
+
+from pydantic import BaseModel
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+class CacheBackend(Protocol):
+    """
+    Shared cache (e.g. Redis) used as a second tier behind the in-process cache, so several app instances
+    share entries and invalidations.
+    """
+
+    async def get(self, key: str) -> bytes | None:
+        """Returns the stored value, or None when the key is missing or expired."""
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        """Stores `value` for `ttl` seconds."""
+
+    async def delete(self, keys: list[str]) -> None:
+        """Removes `keys`, missing keys are ignored."""
+
+    async def clear(self) -> None:
+        """Removes every entry."""
+
+
+class InMemoryCacheBackend:
+    """
+    Local stand-in for a shared `CacheBackend`, for development and single-instance deployments.
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[str, tuple[float, bytes]] = {}
+
+    async def get(self, key: str) -> bytes | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, value)
+
+    async def delete(self, keys: list[str]) -> None:
+        for key in keys:
+            self._entries.pop(key, None)
+
+    async def clear(self) -> None:
+        self._entries.clear()
+
+
+class ResponseCache(Generic[ModelT]):
+    """
+    In-process LRU cache with a TTL for API response models, optionally backed by a shared `CacheBackend`.
+
+    Entries live in the local tier as model instances, so a local hit costs one dict lookup. The shared tier
+    stores them serialized as JSON.
+    """
+
+    def __init__(
+        self, model: type[ModelT], max_size: int = 10000, ttl: float = 60.0, backend: CacheBackend | None = None
+    ):
+        self.model = model
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backend = backend
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries: OrderedDict[str, tuple[float, ModelT]] = OrderedDict()
+
+    @property
+    def size(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: str) -> ModelT | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at >= time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        if self.backend is not None:
+            payload = await self.backend.get(key)
+            if payload is not None:
+                shared_value = self.model.model_validate_json(payload)
+                self._store(key, shared_value)
+                self.hits += 1
+                return shared_value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: ModelT) -> None:
+        self._store(key, value)
+        if self.backend is not None:
+            await self.backend.set(key, value.model_dump_json().encode(), self.ttl)
+
+    async def invalidate(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        for key in keys:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+        if self.backend is not None and keys:
+            await self.backend.delete(keys)
+
+    async def clear(self) -> None:
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        if self.backend is not None:
+            await self.backend.clear()
+
+    def _store(self, key: str, value: ModelT) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
@@ -0,0 +1,77 @@
+from typing import Any
+
+from sqlalchemy import ARRAY, Integer, any_, bindparam, delete, func, not_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.models.src.modules.category import Category
+from src.parsers.category_tree import CategoryTree
+from src.services.sku_service import MAX_BIND_PARAMS
+
+
+def to_category_id(value: str | None) -> int | None:
+    return int(value) if value and value.isdigit() else None
+
+
+class CategoryService:
+    """
+    Keeps the `category` table in line with the category tree of the last imported feed.
+    """
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def replace_categories(self, marketplace_id: int, tree: CategoryTree) -> int:
+        """
+        Upserts every category of `tree` and deletes the categories of the marketplace that are not in it.
+
+        Categories are stored under numeric ids only, like `sku.category_id`; others are skipped.
+        """
+        rows = self.build_rows(marketplace_id, tree)
+        if rows:
+            batch_size = MAX_BIND_PARAMS // len(rows[0])
+            for i in range(0, len(rows), batch_size):
+                stmt = insert(Category).values(rows[i : i + batch_size])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[Category.marketplace_id, Category.category_id],
+                    set_={
+                        column: stmt.excluded[column]
+                        for column in rows[0]
+                        if column not in ("marketplace_id", "category_id")
+                    }
+                    | {"updated_at": func.now()},
+                )
+                await self.session.execute(stmt)
+
+        category_ids = bindparam("category_ids", [row["category_id"] for row in rows], type_=ARRAY(Integer))
+        await self.session.execute(
+            delete(Category).where(
+                Category.marketplace_id == marketplace_id, not_(Category.category_id == any_(category_ids))
+            )
+        )
+        return len(rows)
+
+    @staticmethod
+    def build_rows(marketplace_id: int, tree: CategoryTree) -> list[dict[str, Any]]:
+        rows: list[dict[str, Any]] = []
+        for category_id, category in tree.categories.items():
+            numeric_id = to_category_id(category_id)
+            if numeric_id is None:
+                continue
+            path = tree.path(category_id)
+            category_lvl_1, category_lvl_2, category_lvl_3, category_remaining = tree.levels_of(category_id)
+            rows.append(
+                {
+                    "marketplace_id": marketplace_id,
+                    "category_id": numeric_id,
+                    "parent_id": to_category_id(category["parent_id"]),
+                    "name": category["name"],
+                    "level": len(path),
+                    "path": "/".join(path),
+                    "category_lvl_1": category_lvl_1,
+                    "category_lvl_2": category_lvl_2,
+                    "category_lvl_3": category_lvl_3,
+                    "category_remaining": category_remaining,
+                }
+            )
+        return rows
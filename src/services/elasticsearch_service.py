@@ -1,8 +1,157 @@
-from typing import Any
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from types import TracebackType
+from typing import Any, AsyncIterator, Sequence, cast
 
-from elasticsearch import AsyncElasticsearch, RequestError
+from elasticsearch import AsyncElasticsearch, NotFoundError, RequestError
 
 from src.models.src.modules.sku import SKU
+from src.services.profiling_service import profiled
+
+logger = logging.getLogger(__name__)
+
+# Item statuses worth sending again: the node rejected the write because its queues were full
+RETRYABLE_STATUSES = frozenset({429})
+MAX_REPORTED_ERRORS = 100
+# Merging a freshly loaded index down to one segment takes minutes on large catalogs
+FORCE_MERGE_TIMEOUT = 3600
+
+
+class BulkIndexer:
+    """
+    Streams documents into an index through the `_bulk` API.
+
+    Documents are serialized once and grouped into requests bounded by `chunk_size` documents and
+    `max_chunk_bytes` of payload. At most `max_concurrency` requests are in flight; `index` waits for a free slot
+    when that limit is reached, which pushes back on the producer. Items rejected with 429 are retried with
+    exponential backoff, any other per-item failure is counted and reported in `errors`.
+    """
+
+    def __init__(
+        self,
+        es_client: AsyncElasticsearch,
+        index_name: str,
+        chunk_size: int = 1000,
+        max_chunk_bytes: int = 10 * 1024 * 1024,
+        max_concurrency: int = 4,
+        max_retries: int = 3,
+        initial_backoff: float = 0.5,
+    ):
+        self.es = es_client
+        self.index_name = index_name
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+
+        self.indexed = 0
+        self.failed = 0
+        self.rejections = 0
+        self.errors: list[dict[str, Any]] = []
+
+        self._chunk: list[tuple[bytes, ...]] = []
+        self._chunk_bytes = 0
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._failure: BaseException | None = None
+
+    async def __aenter__(self) -> "BulkIndexer":
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        if exc_type is None:
+            await self.close()
+        else:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def index(self, doc_id: str, document: dict[str, Any]) -> None:
+        self._raise_failure()
+        action = json.dumps({"index": {"_index": self.index_name, "_id": doc_id}}).encode()
+        source = json.dumps(document, ensure_ascii=False).encode()
+        await self._add((action, source))
+
+    async def delete(self, doc_id: str) -> None:
+        self._raise_failure()
+        await self._add((json.dumps({"delete": {"_index": self.index_name, "_id": doc_id}}).encode(),))
+
+    async def _add(self, lines: tuple[bytes, ...]) -> None:
+        self._chunk.append(lines)
+        self._chunk_bytes += sum(len(line) + 1 for line in lines)
+        if len(self._chunk) >= self.chunk_size or self._chunk_bytes >= self.max_chunk_bytes:
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self._chunk:
+            return
+        chunk, self._chunk, self._chunk_bytes = self._chunk, [], 0
+        await self._slots.acquire()
+        task = asyncio.create_task(self._send(chunk))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def drain(self) -> None:
+        """
+        Sends the pending chunk and waits until every request in flight is acknowledged.
+        """
+        await self.flush()
+        await asyncio.gather(*self._tasks)
+        self._raise_failure()
+
+    async def close(self) -> None:
+        await self.drain()
+        logger.info(f"Bulk wrote {self.indexed} documents to '{self.index_name}', {self.failed} failed")
+
+    async def _send(self, chunk: list[tuple[bytes, ...]]) -> None:
+        try:
+            for attempt in range(self.max_retries + 1):
+                operations = [line for lines in chunk for line in lines]
+                with profiled("es.bulk"):
+                    response = await self.es.bulk(operations=operations)  # type: ignore[arg-type]
+                if not response["errors"]:
+                    self.indexed += len(chunk)
+                    return
+
+                retry: list[tuple[bytes, ...]] = []
+                for lines, item in zip(chunk, response["items"]):
+                    operation, result = next(iter(item.items()))
+                    status = result.get("status", 500)
+                    # Deleting a document that is already gone is not a failure
+                    if status < 300 or (operation == "delete" and status == 404):
+                        self.indexed += 1
+                    elif status in RETRYABLE_STATUSES and attempt < self.max_retries:
+                        retry.append(lines)
+                    else:
+                        self._record_error(result)
+                if not retry:
+                    return
+                self.rejections += len(retry)
+                chunk = retry
+                await asyncio.sleep(self.initial_backoff * 2**attempt)
+        except Exception as e:
+            self._failure = e
+        finally:
+            self._slots.release()
+
+    def _record_error(self, result: dict[str, Any]) -> None:
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            error = {"id": result.get("_id"), "status": result.get("status"), "error": result.get("error")}
+            self.errors.append(error)
+            logger.warning(f"Bulk operation failed in '{self.index_name}': {error}")
+
+    def _raise_failure(self) -> None:
+        if self._failure is not None:
+            raise self._failure
 
 
 class ElasticsearchService:
@@ -24,35 +173,228 @@ class ElasticsearchService:
     async def index_document(self, index_name: str, doc_id: str, document: dict[str, Any]) -> None:
         await self.es.index(index=index_name, id=doc_id, document=document)
 
-    async def search_similar(self, index_name: str, sku: SKU) -> list[str]:
+    def bulk_indexer(
+        self,
+        index_name: str,
+        chunk_size: int = 1000,
+        max_chunk_bytes: int = 10 * 1024 * 1024,
+        max_concurrency: int = 4,
+        max_retries: int = 3,
+    ) -> BulkIndexer:
+        return BulkIndexer(self.es, index_name, chunk_size, max_chunk_bytes, max_concurrency, max_retries)
+
+    @asynccontextmanager
+    async def bulk_load_settings(self, index_name: str) -> AsyncIterator[None]:
+        """
+        Disables refreshes and replicas on the index for the duration of a bulk load, then restores them.
+
+        The settings read on entry are the ones restored, so only one bulk load may tune an index at a time; the job
+        scheduler runs imports one after the other.
+        """
+        response = await self.es.indices.get_settings(index=index_name)
+        index_settings = response[index_name]["settings"]["index"]
+        original = {
+            # A missing refresh_interval means the cluster default, restored by resetting it to null
+            "refresh_interval": index_settings.get("refresh_interval"),
+            "number_of_replicas": index_settings.get("number_of_replicas"),
+        }
+        await self.es.indices.put_settings(
+            index=index_name, settings={"index": {"refresh_interval": "-1", "number_of_replicas": 0}}
+        )
+        try:
+            yield
+        finally:
+            await self.es.indices.put_settings(index=index_name, settings={"index": original})
+
+    @staticmethod
+    def _similar_query(sku: SKU, filters: list[dict[str, Any]] | None = None) -> dict[str, Any]:
         query = {
-            "query": {
-                "more_like_this": {
-                    "fields": ["name", "description", "vendor"],
-                    "like": [
-                        {
-                            "doc": {
-                                "name": sku.title,
-                                "description": sku.description,
-                                "vendor": sku.brand,
-                            }
+            "more_like_this": {
+                "fields": ["name", "description", "vendor"],
+                "like": [
+                    {
+                        "doc": {
+                            "name": sku.title,
+                            "description": sku.description,
+                            "vendor": sku.brand,
                         }
-                    ],
-                    "min_term_freq": 1,
-                    "max_query_terms": 12,
-                }
+                    }
+                ],
+                "min_term_freq": 1,
+                "max_query_terms": 12,
             }
         }
-        response = await self.es.search(index=index_name, body=query, size=5)
-        similar_uuids = []
-        for hit in response["hits"]["hits"]:
-            similar_uuid = hit["_id"]
-            if similar_uuid != sku.uuid:
-                similar_uuids.append(similar_uuid)
-        return similar_uuids
+        if filters:
+            return {"bool": {"must": query, "filter": filters}}
+        return query
+
+    async def search_similar(self, index_name: str, sku: SKU, size: int = 5) -> list[str]:
+        query = {"query": self._similar_query(sku)}
+        # One more than needed, in case the SKU itself is among the hits
+        response = await self.es.search(index=index_name, body=query, size=size + 1)
+        similar_uuids = [hit["_id"] for hit in response["hits"]["hits"] if hit["_id"] != str(sku.uuid)]
+        return similar_uuids[:size]
+
+    async def msearch_similar(
+        self,
+        index_name: str,
+        skus: Sequence[SKU],
+        filters: Sequence[list[dict[str, Any]]] | None = None,
+        size: int = 5,
+    ) -> list[list[tuple[str, float]] | None]:
+        """
+        Runs the `more_like_this` query for many SKUs in one `_msearch` request, each restricted by its `filters`.
+
+        Returns the `(uuid, score)` pairs of up to `size` similar SKUs per SKU in input order, best first, or None
+        for a SKU whose search failed.
+        """
+        searches: list[dict[str, Any]] = []
+        for i, sku in enumerate(skus):
+            searches.append({"index": index_name})
+            query = self._similar_query(sku, filters[i] if filters is not None else None)
+            # One more than needed, in case the SKU itself is among the hits
+            searches.append({"query": query, "size": size + 1, "_source": False})
+        with profiled("es.msearch"):
+            response = await self.es.msearch(searches=searches)
+
+        results: list[list[tuple[str, float]] | None] = []
+        for sku, item in zip(skus, response["responses"]):
+            if "error" in item:
+                logger.warning(f"Similarity search failed for SKU {sku.uuid}: {item['error']}")
+                results.append(None)
+                continue
+            hits = [(hit["_id"], hit["_score"]) for hit in item["hits"]["hits"] if hit["_id"] != str(sku.uuid)]
+            results.append(hits[:size])
+        return results
+
+    async def search_products(
+        self,
+        index_name: str,
+        text: str | None = None,
+        category_ids: Sequence[int] = (),
+        category: str | None = None,
+        brands: Sequence[str] = (),
+        price_min: float | None = None,
+        price_max: float | None = None,
+        size: int = 20,
+        search_after: list[Any] | None = None,
+        facet_size: int | None = None,
+    ) -> dict[str, Any]:
+        """
+        Full-text search of products matching `text` (or all of them), restricted to the given category ids, the
+        category named `category` at any of the first three levels, `brands` and the price range.
+
+        Hits are sorted by score with the uuid breaking ties, so the `sort` of the last hit is the `search_after` of
+        the next page. Only ids, scores and sort values cross the wire, the caller reads the products from Postgres.
+        With `facet_size` the response also has the `brand` and `category_lvl_1`…`category_lvl_3` terms and the
+        `price` stats of all matching products.
+        """
+        must: list[dict[str, Any]] = [{"match_all": {}}]
+        if text:
+            must = [
+                {"multi_match": {"query": text, "fields": ["name^3", "vendor^2", "description"], "operator": "and"}}
+            ]
+        filters: list[dict[str, Any]] = []
+        if category_ids:
+            filters.append({"terms": {"category_id": [str(category_id) for category_id in category_ids]}})
+        if category:
+            levels = ("category_lvl_1", "category_lvl_2", "category_lvl_3")
+            filters.append({"bool": {"should": [{"term": {level: category}} for level in levels]}})
+        if brands:
+            filters.append({"terms": {"vendor.keyword": list(brands)}})
+        if price_min is not None or price_max is not None:
+            price_range = {"gte": price_min, "lte": price_max}
+            filters.append(
+                {"range": {"price": {bound: value for bound, value in price_range.items() if value is not None}}}
+            )
+
+        aggregations: dict[str, Any] | None = None
+        if facet_size is not None:
+            aggregations = {
+                "brand": {"terms": {"field": "vendor.keyword", "size": facet_size}},
+                "price": {"stats": {"field": "price"}},
+            }
+            for level in ("category_lvl_1", "category_lvl_2", "category_lvl_3"):
+                aggregations[level] = {"terms": {"field": level, "size": facet_size}}
+        with profiled("es.search"):
+            response = await self.es.search(
+                index=index_name,
+                query={"bool": {"must": must, "filter": filters}},
+                sort=[{"_score": "desc"}, {"uuid": "asc"}],
+                search_after=search_after,
+                size=size,
+                aggs=aggregations,
+                source=False,
+                filter_path=["hits.total", "hits.hits._id", "hits.hits._score", "hits.hits.sort", "aggregations"],
+            )
+        return cast(dict[str, Any], response.body)
+
+    async def has_keyword_fields(self, index_name: str, fields: Sequence[str]) -> bool:
+        """
+        Whether every index behind `index_name` maps each of `fields` (dotted for multi-fields) as a keyword.
+        """
+        response = await self.es.indices.get_field_mapping(index=index_name, fields=list(fields))
+        for index in response.body.values():
+            for field in fields:
+                field_mapping = index["mappings"].get(field)
+                if field_mapping is None or field_mapping["mapping"][field.rsplit(".", 1)[-1]]["type"] != "keyword":
+                    return False
+        return True
 
     async def refresh_index(self, index_name: str) -> None:
         await self.es.indices.refresh(index=index_name)
 
+    async def create_versioned_index(self, alias: str, index_body: dict[str, Any]) -> str:
+        """
+        Creates a new generation `<alias>_<timestamp>` of the index behind `alias` and returns its name.
+        """
+        index_name = f"{alias}_{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')}"
+        await self.create_index(index_name, index_body)
+        return index_name
+
+    async def get_alias_indices(self, alias: str) -> list[str]:
+        try:
+            response = await self.es.indices.get_alias(name=alias)
+        except NotFoundError:
+            return []
+        return sorted(response.keys())
+
+    async def swap_alias(self, alias: str, index_name: str) -> None:
+        """
+        Atomically points `alias` at `index_name` only, so readers switch from the old generation to the new one.
+        """
+        current_indices = await self.get_alias_indices(alias)
+        if not current_indices and await self.es.indices.exists(index=alias):
+            # A concrete index left over from before aliases were used occupies the alias name
+            logger.info(f"Deleting legacy Elasticsearch index '{alias}'")
+            await self.es.indices.delete(index=alias)
+
+        actions: list[dict[str, Any]] = [
+            {"remove": {"index": current_index, "alias": alias}}
+            for current_index in current_indices
+            if current_index != index_name
+        ]
+        actions.append({"add": {"index": index_name, "alias": alias}})
+        await self.es.indices.update_aliases(actions=actions)
+        logger.info(f"Alias '{alias}' now points to '{index_name}'")
+
+    async def force_merge(self, index_name: str, max_num_segments: int = 1) -> None:
+        await self.es.options(request_timeout=FORCE_MERGE_TIMEOUT).indices.forcemerge(
+            index=index_name, max_num_segments=max_num_segments
+        )
+
+    async def prune_generations(self, alias: str, keep: int) -> list[str]:
+        """
+        Deletes all but the newest `keep` generations of `alias`, never the ones the alias points to.
+        """
+        response = await self.es.indices.get(index=f"{alias}_*")
+        generations = sorted(response.keys(), reverse=True)
+        current_indices = set(await self.get_alias_indices(alias))
+        stale = [index_name for index_name in generations[keep:] if index_name not in current_indices]
+        for index_name in stale:
+            logger.info(f"Deleting old Elasticsearch index generation '{index_name}'")
+            await self.es.indices.delete(index=index_name)
+        return stale
+
     async def close(self) -> None:
         await self.es.close()
@@ -0,0 +1,384 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Awaitable, Callable
+from uuid import UUID
+
+from src.database import get_import_db
+from src.parsers.category_tree import CategoryTree
+from src.parsers.xml_parser import OFFER_FIELDS, XMLFeed, XMLParser, parse_shard
+from src.services.category_service import CategoryService
+from src.services.elasticsearch_service import BulkIndexer
+from src.services.metrics_service import StageStats
+from src.services.profiling_service import profiled
+from src.services.sku_service import SKUService
+
+logger = logging.getLogger(__name__)
+
+SKUBatch = list[dict[str, Any]]
+DocumentBatch = list[tuple[str, dict[str, Any]]]
+# A batch with its feed progress, sequence number and checkpoint offset
+ParsedBatch = tuple[SKUBatch, float, int, int]
+IndexedBatch = tuple[DocumentBatch, int, int]
+
+# lxml reads the feed ahead of the offers it yields by at most one buffer (32 KiB), stepping back further than that
+# from the read position always lands before the first offer that has not been yielded yet
+CHECKPOINT_MARGIN = 1024 * 1024
+# The feeds are exports of a single marketplace
+MARKETPLACE_ID = 1
+
+
+class PipelineStopped(Exception):
+    pass
+
+
+def build_sku_data(offer_data: dict[str, Any], category_tree: CategoryTree) -> dict[str, Any]:
+    """
+    Turns a parsed offer into the SKU data stored in Postgres and indexed in Elasticsearch, with a new uuid.
+    """
+    category_lvl_1, category_lvl_2, category_lvl_3, category_remaining = category_tree.levels_of(
+        offer_data["category_id"]
+    )
+    return {
+        "uuid": str(uuid.uuid4()),
+        "marketplace_id": MARKETPLACE_ID,
+        "offer_id": offer_data["offer_id"],
+        "name": offer_data["name"],
+        "description": offer_data["description"],
+        "vendor": offer_data["vendor"],
+        "barcode": offer_data["barcode"],
+        "category_id": offer_data["category_id"],
+        "category_lvl_1": category_lvl_1,
+        "category_lvl_2": category_lvl_2,
+        "category_lvl_3": category_lvl_3,
+        "category_remaining": category_remaining,
+        "params": offer_data["params"],
+        "price": offer_data["price"],
+        "picture": offer_data["picture"],
+        "currency_id": offer_data["currency_id"],
+    }
+
+
+class IngestionPipeline:
+    """
+    Loads a feed into Postgres and Elasticsearch as three stages connected by bounded queues:
+
+    parse (worker thread or processes) -> SKU batches -> DB writers -> document batches -> ES indexer
+
+    The parser runs lxml in a worker thread so the event loop keeps serving requests. Full queues block the
+    stage before them, so memory is bounded by the queue sizes whichever stage is the slowest.
+
+    With `parse_processes > 1` the `<offers>` section is split into shards of about `shard_size` bytes which are
+    parsed by a process pool; shard results are consumed in file order. Feeds that are compressed or still being
+    uploaded are parsed sequentially, as shards can only be cut from a complete plain file.
+
+    An `incremental` run only writes and indexes offers whose content changed, and once the writers are done resets
+    `similar_sku` of the SKUs listing a changed one (doing that while the writers hold the row locks of their upserts
+    could deadlock them). With `remove_missing` the run records every key it saw and, once the whole feed went
+    through, deletes the SKUs that are no longer in it.
+
+    Every `checkpoint_interval` seconds the indexer is drained and `on_checkpoint` receives the byte offset before
+    which every offer is committed to Postgres and acknowledged by Elasticsearch, with the number of batches that
+    covers. A run started at such an offset (`start_offset`) picks up where the previous one stopped; offers just
+    before the offset may be written again, which the upserts make harmless.
+
+    `on_skus_changed` receives the uuids of every SKU whose stored data or `similar_sku` the run modified.
+    """
+
+    def __init__(
+        self,
+        parser: XMLParser,
+        feed: XMLFeed,
+        indexer: BulkIndexer,
+        on_progress: Callable[[float], Awaitable[None]],
+        job_id: str,
+        incremental: bool = False,
+        remove_missing: bool = False,
+        batch_size: int = 5000,
+        queue_size: int = 4,
+        db_writers: int = 2,
+        parse_processes: int = 1,
+        shard_size: int = 16 * 1024 * 1024,
+        on_skus_changed: Callable[[list[UUID]], Awaitable[None]] | None = None,
+        start_offset: int = 0,
+        on_checkpoint: Callable[[int, int], Awaitable[None]] | None = None,
+        checkpoint_interval: float = 30.0,
+    ):
+        self.parser = parser
+        self.feed = feed
+        self.indexer = indexer
+        self.on_progress = on_progress
+        self.job_id = job_id
+        self.incremental = incremental
+        self.remove_missing = remove_missing
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.db_writers = db_writers
+        self.parse_processes = parse_processes
+        self.shard_size = shard_size
+        self.on_skus_changed = on_skus_changed
+        self.start_offset = start_offset
+        self.on_checkpoint = on_checkpoint
+        self.checkpoint_interval = checkpoint_interval
+
+        self.stats = {name: StageStats(name) for name in ("parse", "write", "index")}
+        self._stop = threading.Event()
+        self._progress = 0.0
+        self._queues: dict[str, asyncio.Queue[Any]] = {}
+        self._batches_parsed = 0
+        self._batches_checkpointed = 0
+        # Checkpoint offsets of indexed batches that are not covered by a checkpoint yet, by sequence number
+        self._indexed_offsets: dict[int, int] = {}
+
+    def queue_depths(self) -> dict[str, int]:
+        return {name: queue.qsize() for name, queue in self._queues.items()}
+
+    async def run(self) -> None:
+        batches: asyncio.Queue[ParsedBatch | None] = asyncio.Queue(maxsize=self.queue_size)
+        documents: asyncio.Queue[IndexedBatch | None] = asyncio.Queue(maxsize=self.queue_size)
+        self._queues = {"batches": batches, "documents": documents}
+
+        tasks = [
+            asyncio.create_task(self._parse(batches)),
+            asyncio.create_task(self._run_writers(batches, documents)),
+            asyncio.create_task(self._index(documents)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            self._stop.set()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Import keys are kept, a resumed job still needs the ones recorded before the checkpoint
+            raise
+
+        await self._store_categories()
+        if self.incremental:
+            await self._reset_neighbours()
+        if self.remove_missing:
+            await self._remove_missing()
+
+        for stage in self.stats.values():
+            logger.info(
+                f"Stage '{stage.name}': {stage.items} items in {stage.elapsed:.1f}s, {stage.items_per_second:.0f}/s"
+            )
+
+    async def _parse(self, batches: asyncio.Queue[ParsedBatch | None]) -> None:
+        if self.parse_processes > 1 and self.feed.splittable:
+            await self._parse_sharded(batches)
+        else:
+            loop = asyncio.get_running_loop()
+            await asyncio.to_thread(self._parse_in_thread, loop, batches)
+        for _ in range(self.db_writers):
+            await batches.put(None)
+        self.stats["parse"].finish()
+
+    def _parse_in_thread(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        batches: asyncio.Queue[ParsedBatch | None],
+    ) -> None:
+        batch: SKUBatch = []
+        with profiled("parse.feed"):
+            for offer_data in self.feed.offers(self.start_offset):
+                if self._stop.is_set():
+                    raise PipelineStopped()
+                batch.append(build_sku_data(offer_data, self.feed.category_tree))
+                if len(batch) >= self.batch_size:
+                    self.stats["parse"].add(len(batch))
+                    self._put_from_thread(loop, batches, self._parsed_batch(batch, self._read_checkpoint()))
+                    batch = []
+            if batch:
+                self.stats["parse"].add(len(batch))
+                self._put_from_thread(loop, batches, self._parsed_batch(batch, self._read_checkpoint()))
+
+    def _read_checkpoint(self) -> int:
+        return max(self.start_offset, self.feed.bytes_read - CHECKPOINT_MARGIN)
+
+    def _parsed_batch(self, batch: SKUBatch, checkpoint_offset: int) -> ParsedBatch:
+        self._batches_parsed += 1
+        return batch, self.feed.progress, self._batches_parsed, checkpoint_offset
+
+    async def _parse_sharded(self, batches: asyncio.Queue[ParsedBatch | None]) -> None:
+        loop = asyncio.get_running_loop()
+        await asyncio.to_thread(self.feed.read_categories)
+        shards = await asyncio.to_thread(self.feed.plan_shards, self.shard_size, self.start_offset)
+
+        pool = ProcessPoolExecutor(max_workers=self.parse_processes)
+        try:
+            # Keeps one queued shard per worker so no process idles while a result is being consumed
+            pending: deque[tuple[int, int, asyncio.Future[list[tuple[Any, ...]]]]] = deque()
+            for start, end in shards:
+                future = loop.run_in_executor(pool, parse_shard, self.feed.xml_file, start, end, self.feed.encoding)
+                pending.append((start, end, future))
+                if len(pending) >= self.parse_processes * 2:
+                    await self._emit_shard(batches, *pending.popleft())
+            while pending:
+                await self._emit_shard(batches, *pending.popleft())
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _emit_shard(
+        self,
+        batches: asyncio.Queue[ParsedBatch | None],
+        start: int,
+        end: int,
+        future: asyncio.Future[list[tuple[Any, ...]]],
+    ) -> None:
+        with profiled("parse.shard_wait"):
+            offers = await future
+        with profiled("parse.build"):
+            sku_batch = await asyncio.to_thread(
+                lambda: [build_sku_data(dict(zip(OFFER_FIELDS, offer)), self.feed.category_tree) for offer in offers]
+            )
+        self.feed.bytes_read = end
+        self.stats["parse"].add(len(sku_batch))
+        for batch_start in range(0, len(sku_batch), self.batch_size):
+            # Only the last batch of a shard completes it, the ones before leave the checkpoint at its start
+            batch_end = batch_start + self.batch_size
+            checkpoint_offset = end if batch_end >= len(sku_batch) else start
+            with profiled("parse.queue_wait"):
+                await batches.put(self._parsed_batch(sku_batch[batch_start:batch_end], checkpoint_offset))
+
+    def _put_from_thread(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        queue: asyncio.Queue[ParsedBatch | None],
+        item: ParsedBatch,
+    ) -> None:
+        # Blocks the parser thread while the queue is full, but gives up once the pipeline is stopped
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        with profiled("parse.queue_wait"):
+            while True:
+                try:
+                    future.result(timeout=0.5)
+                    return
+                except concurrent.futures.TimeoutError:
+                    if self._stop.is_set():
+                        future.cancel()
+                        raise PipelineStopped()
+
+    async def _run_writers(
+        self,
+        batches: asyncio.Queue[ParsedBatch | None],
+        documents: asyncio.Queue[IndexedBatch | None],
+    ) -> None:
+        await asyncio.gather(*(self._write(batches, documents) for _ in range(self.db_writers)))
+        self.stats["write"].finish()
+        await documents.put(None)
+
+    async def _write(
+        self,
+        batches: asyncio.Queue[ParsedBatch | None],
+        documents: asyncio.Queue[IndexedBatch | None],
+    ) -> None:
+        while (item := await batches.get()) is not None:
+            batch, progress, sequence, checkpoint_offset = item
+            with profiled("write.save_skus"):
+                async for session in get_import_db():
+                    async with session.begin():
+                        sku_service = SKUService(session)
+                        stored_uuids = await sku_service.save_skus(batch, incremental=self.incremental)
+                        if self.remove_missing:
+                            await sku_service.record_import_keys(self.job_id, batch)
+            self.stats["write"].add(len(batch))
+            if self.on_skus_changed is not None:
+                await self.on_skus_changed(list(stored_uuids.values()))
+
+            document_batch: DocumentBatch = []
+            for sku_data in batch:
+                stored_uuid = stored_uuids.get(int(sku_data["offer_id"]))
+                if stored_uuid is None:
+                    # Unchanged since the previous import
+                    continue
+                sku_uuid = str(stored_uuid)
+                doc = {
+                    "uuid": sku_uuid,
+                    "name": sku_data["name"],
+                    "description": sku_data["description"],
+                    "vendor": sku_data["vendor"],
+                    "barcode": sku_data["barcode"],
+                    "category_id": sku_data["category_id"],
+                    "category_lvl_1": sku_data["category_lvl_1"],
+                    "category_lvl_2": sku_data["category_lvl_2"],
+                    "category_lvl_3": sku_data["category_lvl_3"],
+                    "price": sku_data["price"],
+                    "params": sku_data["params"],
+                }
+                document_batch.append((sku_uuid, doc))
+            with profiled("write.queue_wait"):
+                await documents.put((document_batch, sequence, checkpoint_offset))
+
+            # With several writers batches commit out of order, progress only moves forward
+            self._progress = max(self._progress, progress)
+            await self.on_progress(self._progress)
+
+    async def _store_categories(self) -> None:
+        tree = self.feed.category_tree
+        with profiled("categories.store"):
+            async for session in get_import_db():
+                async with session.begin():
+                    stored = await CategoryService(session).replace_categories(MARKETPLACE_ID, tree)
+        logger.info(f"Stored {stored} of {len(tree.categories)} categories")
+
+    async def _reset_neighbours(self) -> None:
+        # Neighbours of a changed SKU may no longer be its best matches. The changed SKUs are found by their cleared
+        # `similar_sku`, so the ones written before a restart from a checkpoint are not missed.
+        async for session in get_import_db():
+            async with session.begin():
+                reset_uuids = await SKUService(session).reset_neighbours_of_unmatched()
+        if self.on_skus_changed is not None:
+            await self.on_skus_changed(reset_uuids)
+        logger.info(f"Reset similar SKUs of {len(reset_uuids)} SKUs listing a changed one")
+
+    async def _remove_missing(self) -> None:
+        async for session in get_import_db():
+            async with session.begin():
+                sku_service = SKUService(session)
+                deleted_uuids = await sku_service.delete_missing_skus(self.job_id)
+                reset_uuids = await sku_service.reset_similar_skus(deleted_uuids)
+                await sku_service.clear_import_keys(self.job_id)
+        if self.on_skus_changed is not None:
+            await self.on_skus_changed(deleted_uuids + reset_uuids)
+
+        for deleted_uuid in deleted_uuids:
+            await self.indexer.delete(str(deleted_uuid))
+        await self.indexer.flush()
+        logger.info(f"Removed {len(deleted_uuids)} SKUs missing from the feed")
+
+    async def _index(self, documents: asyncio.Queue[IndexedBatch | None]) -> None:
+        last_checkpoint = time.monotonic()
+        while (item := await documents.get()) is not None:
+            document_batch, sequence, checkpoint_offset = item
+            with profiled("index.enqueue"):
+                for doc_id, doc in document_batch:
+                    await self.indexer.index(doc_id, doc)
+            self.stats["index"].add(len(document_batch))
+            self._indexed_offsets[sequence] = checkpoint_offset
+
+            if self.on_checkpoint is not None and time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                with profiled("index.checkpoint"):
+                    await self._checkpoint()
+                last_checkpoint = time.monotonic()
+        if self.on_checkpoint is not None:
+            await self._checkpoint()
+        else:
+            await self.indexer.flush()
+        self.stats["index"].finish()
+
+    async def _checkpoint(self) -> None:
+        # Documents handed to the indexer are not durable until Elasticsearch acknowledged them
+        await self.indexer.drain()
+        checkpoint_offset: int | None = None
+        # Writers commit out of order, the checkpoint only covers the batches up to the first gap
+        while self._batches_checkpointed + 1 in self._indexed_offsets:
+            self._batches_checkpointed += 1
+            checkpoint_offset = self._indexed_offsets.pop(self._batches_checkpointed)
+        if checkpoint_offset is not None and self.on_checkpoint is not None:
+            await self.on_checkpoint(checkpoint_offset, self._batches_checkpointed)
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogLock:
+    """
+    Readers-writer lock over the SKU catalog: jobs that only read it can share it, an import holds it alone.
+
+    A waiting import keeps new shared jobs from starting, so it cannot be starved by them.
+    """
+
+    def __init__(self) -> None:
+        self._condition = asyncio.Condition()
+        self._shared = 0
+        self._exclusive = False
+        self._exclusive_waiting = 0
+
+    @asynccontextmanager
+    async def acquire(self, exclusive: bool) -> AsyncIterator[None]:
+        async with self._condition:
+            if exclusive:
+                self._exclusive_waiting += 1
+                try:
+                    await self._condition.wait_for(lambda: not self._exclusive and self._shared == 0)
+                finally:
+                    self._exclusive_waiting -= 1
+                    self._condition.notify_all()
+                self._exclusive = True
+            else:
+                await self._condition.wait_for(lambda: not self._exclusive and self._exclusive_waiting == 0)
+                self._shared += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                if exclusive:
+                    self._exclusive = False
+                else:
+                    self._shared -= 1
+                self._condition.notify_all()
+
+
+class JobScheduler:
+    """
+    Runs import jobs in submission order, at most `max_concurrent_jobs` at a time.
+
+    A file is never imported by two jobs at once. An import upserts the feed into the `sku` table in place and then
+    deletes the SKUs the feed does not have, so two imports next to each other would delete each other's SKUs and
+    both write to the live index; imports run alone (`exclusive`).
+    """
+
+    def __init__(self, run_job: Callable[[str], Awaitable[None]], max_concurrent_jobs: int = 1):
+        self._run_job = run_job
+        self._slots = asyncio.Semaphore(max_concurrent_jobs)
+        self._catalog = CatalogLock()
+        self._file_locks: dict[str, asyncio.Lock] = {}
+        self._tasks: dict[str, asyncio.Task[None]] = {}
+        self._running: set[str] = set()
+
+    @property
+    def queued(self) -> int:
+        return len(self._tasks) - len(self._running)
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    def is_scheduled(self, job_id: str) -> bool:
+        return job_id in self._tasks
+
+    def submit(self, job_id: str, filename: str, exclusive: bool) -> None:
+        task = asyncio.create_task(self._run(job_id, filename, exclusive))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def cancel(self, job_id: str) -> bool:
+        """
+        Cancels a queued or running job and waits until it stopped. Returns False if the job was not scheduled.
+        """
+        task = self._tasks.get(job_id)
+        if task is None:
+            return False
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return True
+
+    async def shutdown(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job_id: str, filename: str, exclusive: bool) -> None:
+        file_lock = self._file_locks.setdefault(filename, asyncio.Lock())
+        async with file_lock:
+            async with self._catalog.acquire(exclusive):
+                async with self._slots:
+                    self._running.add(job_id)
+                    try:
+                        await self._run_job(job_id)
+                    finally:
+                        self._running.discard(job_id)
@@ -0,0 +1,61 @@
+from typing import Any
+from uuid import UUID
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.models.src.modules.import_job import ImportJob
+from src.schemas import JobPhase, JobStatus
+
+
+class JobService:
+    """
+    Persists import jobs in the `import_job` table.
+    """
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def create_job(self, job_id: str, filename: str, mode: str, profiling: str | None = None) -> ImportJob:
+        job = ImportJob(
+            job_id=UUID(job_id),
+            filename=filename,
+            mode=mode,
+            status=JobStatus.QUEUED.value,
+            phase=JobPhase.INGEST.value,
+            byte_offset=0,
+            last_batch=0,
+            processing_progress=0.0,
+            update_similar_progress=0.0,
+            rows=0,
+            elapsed_seconds=0.0,
+            profiling=profiling,
+        )
+        self.session.add(job)
+        await self.session.flush()
+        return job
+
+    async def get_job(self, job_id: str) -> ImportJob | None:
+        return await self.session.get(ImportJob, UUID(job_id))
+
+    async def update_job(self, job_id: str, **values: Any) -> None:
+        await self.session.execute(update(ImportJob).where(ImportJob.job_id == UUID(job_id)).values(**values))
+
+    async def mark_interrupted_jobs(self) -> list[UUID]:
+        """
+        Marks the jobs left `running` or `queued` by a previous process as `interrupted` and returns their ids.
+        """
+        result = await self.session.execute(
+            update(ImportJob)
+            .where(ImportJob.status.in_([JobStatus.RUNNING.value, JobStatus.QUEUED.value]))
+            .values(status=JobStatus.INTERRUPTED.value)
+            .returning(ImportJob.job_id)
+        )
+        return list(result.scalars().all())
+
+    async def list_jobs(self, status: str | None = None, limit: int = 100) -> list[ImportJob]:
+        query = select(ImportJob)
+        if status is not None:
+            query = query.where(ImportJob.status == status)
+        result = await self.session.execute(query.order_by(ImportJob.created_at.desc()).limit(limit))
+        return list(result.scalars().all())
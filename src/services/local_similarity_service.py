@@ -0,0 +1,295 @@
+import asyncio
+import logging
+import math
+import re
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Sequence
+from uuid import UUID
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # pragma: no cover - optional dependency
+    HAS_SCIPY = False
+else:
+    HAS_SCIPY = True
+
+from src.database import get_import_db
+from src.models.src.modules.sku import SKU
+from src.services.profiling_service import profiled
+from src.services.similarity_service import Block, SimilarityBlocks
+from src.services.sku_service import SKUService
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"\w+")
+# Tokens are hashed into 2**20 columns, collisions are rare enough not to change the neighbours
+HASH_BITS = 20
+HASH_SIZE = 1 << HASH_BITS
+# The fields `more_like_this` compares, the title weighs the most
+FIELD_WEIGHTS = (("title", 1.0), ("description", 0.4), ("brand", 0.6))
+MAX_DESCRIPTION_TOKENS = 100
+# Tokens in a larger share of a large catalog ("для", units, the biggest brands) match nearly everything
+MAX_DOCUMENT_FREQUENCY = 0.2
+MIN_PRUNED_DOCUMENT_FREQUENCY = 1000
+# SKUs read from Postgres per query while the catalog vectors are built
+CATALOG_CHUNK_SIZE = 10000
+# Query rows multiplied with the catalog at once, the product has a row of scores per catalog SKU sharing a token
+PRODUCT_BATCH_SIZE = 256
+
+# The catalog of a worker process of LocalSimilarityMatcher
+_worker_catalog: "CatalogVectors | None" = None
+
+
+def sku_features(sku: SKU) -> dict[int, float]:
+    """
+    Sublinear term frequencies of the title, description and brand tokens of `sku`, weighted by field and hashed
+    per field, so a word in the title and the same word in the description are different features.
+    """
+    features: dict[int, float] = {}
+    for field, weight in FIELD_WEIGHTS:
+        text = getattr(sku, field)
+        if not text:
+            continue
+        tokens = TOKEN_RE.findall(text.lower())
+        if field == "description":
+            tokens = tokens[:MAX_DESCRIPTION_TOKENS]
+        counts: dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            column = zlib.crc32(f"{field}:{token}".encode()) & (HASH_SIZE - 1)
+            features[column] = features.get(column, 0.0) + weight * (1.0 + math.log(count))
+    return features
+
+
+class CatalogVectors:
+    """
+    L2-normalized TF-IDF vectors of every SKU of the catalog, as a sparse matrix with a row per SKU.
+
+    SKUs are added in chunks, `finish` computes the document frequencies and builds the matrix over the tokens that
+    are kept. The cosine similarity of a query with the catalog, or with the SKUs of one of the `blocks`, is then a
+    sparse matrix product.
+    """
+
+    def __init__(self, blocks: SimilarityBlocks | None = None) -> None:
+        if not HAS_SCIPY:
+            raise ValueError("The local similarity backend requires the 'numpy' and 'scipy' packages")
+        self.blocks = blocks
+        self.uuids: list[str] = []
+        # Hashed columns of the kept tokens, the matrices only have those
+        self.columns: Any = None
+        self.idf: Any = None
+        self.vectors: Any = None
+        # Rows of the SKUs of each block
+        self.block_rows: dict[Block, Any] = {}
+        self._transposed: Any = None
+        self._transposed_blocks: dict[Block, Any] = {}
+        self._indptr = array("q", [0])
+        self._indices = array("i")
+        self._data = array("f")
+        self._block_rows: dict[Block, array[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.uuids)
+
+    def add(self, skus: Sequence[SKU]) -> None:
+        for sku in skus:
+            features = sku_features(sku)
+            if self.blocks is not None:
+                for block in self.blocks.blocks_containing(sku):
+                    self._block_rows.setdefault(block, array("i")).append(len(self.uuids))
+            self.uuids.append(str(sku.uuid))
+            self._indices.extend(features.keys())
+            self._data.extend(features.values())
+            self._indptr.append(len(self._indices))
+
+    def finish(self) -> None:
+        term_frequencies = self._to_matrix(self._indptr, self._indices, self._data)
+        self._indptr, self._indices, self._data = array("q", [0]), array("i"), array("f")
+        self.block_rows = {block: np.frombuffer(rows, dtype=np.int32) for block, rows in self._block_rows.items()}
+        self._block_rows = {}
+
+        document_frequencies = np.bincount(term_frequencies.indices, minlength=HASH_SIZE)
+        too_common = document_frequencies > max(MAX_DOCUMENT_FREQUENCY * len(self), MIN_PRUNED_DOCUMENT_FREQUENCY)
+        if too_common.any():
+            logger.info(
+                f"Ignoring {int(too_common.sum())} tokens found in more than {MAX_DOCUMENT_FREQUENCY:.0%} of SKUs"
+            )
+        # Dropping the columns of ignored and unseen tokens keeps the products free of stored zeros
+        self.columns = np.flatnonzero((document_frequencies > 0) & ~too_common)
+        self.idf = (np.log((1 + len(self)) / (1 + document_frequencies[self.columns])) + 1.0).astype(np.float32)
+        self.vectors = self._weigh(term_frequencies[:, self.columns])
+
+    def vectorize(self, skus: Sequence[SKU]) -> Any:
+        indptr, indices, data = array("q", [0]), array("i"), array("f")
+        for sku in skus:
+            features = sku_features(sku)
+            indices.extend(features.keys())
+            data.extend(features.values())
+            indptr.append(len(indices))
+        return self._weigh(self._to_matrix(indptr, indices, data)[:, self.columns])
+
+    def top_neighbours(
+        self, query: Any, query_uuids: Sequence[str], top_k: int, block: Block | None = None
+    ) -> list[list[tuple[str, float]]]:
+        """
+        The `top_k` SKUs of `block`, or of the whole catalog, most similar to each row of `query` with their cosine
+        similarity, best first, leaving out the query SKU itself.
+        """
+        rows = self.block_rows.get(block) if block is not None else None
+        # A column per candidate, so `query @ candidates` gives a row of scores per query
+        candidates = self.transposed_block(block) if block is not None and rows is not None else self.transposed
+        results: list[list[tuple[str, float]]] = []
+        for start in range(0, query.shape[0], PRODUCT_BATCH_SIZE):
+            scores = (query[start : start + PRODUCT_BATCH_SIZE] @ candidates).tocsr()
+            for row, query_uuid in enumerate(query_uuids[start : start + PRODUCT_BATCH_SIZE]):
+                begin, end = scores.indptr[row], scores.indptr[row + 1]
+                columns, values = scores.indices[begin:end], scores.data[begin:end]
+                # One more than needed, in case the SKU itself is among the best
+                if len(values) > top_k + 1:
+                    best = np.argpartition(values, -(top_k + 1))[-(top_k + 1) :]
+                    columns, values = columns[best], values[best]
+                order = np.argsort(-values, kind="stable")
+                if rows is not None:
+                    columns = rows[columns]
+                hits = [
+                    (self.uuids[column], float(value))
+                    for column, value in zip(columns[order], values[order])
+                    if self.uuids[column] != query_uuid
+                ]
+                results.append(hits[:top_k])
+        return results
+
+    @property
+    def transposed(self) -> Any:
+        # Built on first use, with blocks only SKUs that have no block need the whole catalog
+        if self._transposed is None:
+            self._transposed = self.vectors.T.tocsr()
+        return self._transposed
+
+    def transposed_block(self, block: Block) -> Any:
+        # Built once per block, every chunk matched in the block reuses it
+        if block not in self._transposed_blocks:
+            self._transposed_blocks[block] = self.vectors[self.block_rows[block]].T.tocsr()
+        return self._transposed_blocks[block]
+
+    def _to_matrix(self, indptr: "array[int]", indices: "array[int]", data: "array[float]") -> Any:
+        matrix = sparse.csr_matrix(
+            (
+                np.frombuffer(data, dtype=np.float32),
+                np.frombuffer(indices, dtype=np.int32),
+                np.frombuffer(indptr, dtype=np.int64),
+            ),
+            shape=(len(indptr) - 1, HASH_SIZE),
+        )
+        # Colliding tokens of a SKU land in the same column
+        matrix.sum_duplicates()
+        return matrix
+
+    def _weigh(self, term_frequencies: Any) -> Any:
+        matrix = term_frequencies.astype(np.float32)
+        matrix.data *= self.idf[matrix.indices]
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        matrix.data /= np.repeat(norms, np.diff(matrix.indptr)).astype(np.float32)
+        return matrix
+
+
+# Query rows, their uuids and the block they are matched in
+QueryGroup = tuple[Any, list[str], Block | None]
+
+
+def match_groups(
+    catalog: CatalogVectors, groups: Sequence[QueryGroup], top_k: int
+) -> list[list[list[tuple[str, float]]]]:
+    return [catalog.top_neighbours(query, query_uuids, top_k, block) for query, query_uuids, block in groups]
+
+
+def _init_worker(catalog: CatalogVectors) -> None:
+    global _worker_catalog
+    _worker_catalog = catalog
+
+
+def _match_groups_in_worker(groups: list[QueryGroup], top_k: int) -> list[list[list[tuple[str, float]]]]:
+    assert _worker_catalog is not None
+    return match_groups(_worker_catalog, groups, top_k)
+
+
+class LocalSimilarityMatcher:
+    """
+    Finds similar SKUs in this process instead of Elasticsearch: TF-IDF vectors of title, description and brand
+    over the whole catalog, and top-k cosine neighbours from batched sparse matrix products.
+
+    `prepare` reads the catalog from Postgres and builds its vectors. With `blocks` each SKU is only compared with
+    the SKUs of its block, the SKUs of a chunk are matched in groups by block. With `processes > 1` the products
+    run in a process pool whose workers get a copy of the vectors when they start (inherited on Linux, where
+    processes are forked); the groups of each chunk are shared between them.
+    """
+
+    def __init__(self, processes: int = 1, top_k: int = 5, blocks: SimilarityBlocks | None = None):
+        self.processes = processes
+        self.top_k = top_k
+        self.blocks = blocks
+        self.catalog = CatalogVectors(blocks)
+        self._pool: ProcessPoolExecutor | None = None
+
+    async def prepare(self) -> None:
+        if self.blocks is not None:
+            await self.blocks.load()
+        with profiled("similarity.prepare"):
+            after_uuid: UUID | None = None
+            while True:
+                async for session in get_import_db():
+                    chunk = await SKUService(session).get_sku_chunk(after_uuid, CATALOG_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await asyncio.to_thread(self.catalog.add, chunk)
+                after_uuid = UUID(str(chunk[-1].uuid))
+            await asyncio.to_thread(self.catalog.finish)
+        logger.info(f"Built the vectors of {len(self.catalog)} SKUs")
+
+        if self.processes > 1:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.processes, initializer=_init_worker, initargs=(self.catalog,)
+            )
+
+    async def match(self, skus: Sequence[SKU]) -> list[list[tuple[str, float]] | None]:
+        query = await asyncio.to_thread(self.catalog.vectorize, skus)
+        positions_by_block: dict[Block | None, list[int]] = {}
+        for position, sku in enumerate(skus):
+            block = self.blocks.block_of(sku) if self.blocks is not None else None
+            positions_by_block.setdefault(block, []).append(position)
+        groups: list[QueryGroup] = [
+            (query[positions], [str(skus[position].uuid) for position in positions], block)
+            for block, positions in positions_by_block.items()
+        ]
+
+        if self._pool is None:
+            group_results = await asyncio.to_thread(match_groups, self.catalog, groups, self.top_k)
+        else:
+            loop = asyncio.get_running_loop()
+            # Every worker takes every n-th group
+            workers = min(self.processes, len(groups))
+            worker_results = await asyncio.gather(
+                *(
+                    loop.run_in_executor(self._pool, _match_groups_in_worker, groups[worker::workers], self.top_k)
+                    for worker in range(workers)
+                )
+            )
+            group_results = [[] for _ in groups]
+            for worker, results in enumerate(worker_results):
+                group_results[worker::workers] = results
+
+        matches: list[list[tuple[str, float]] | None] = [None] * len(skus)
+        for positions, hits_per_sku in zip(positions_by_block.values(), group_results):
+            for position, hits in zip(positions, hits_per_sku):
+                matches[position] = hits
+        return matches
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,186 @@
+import time
+from typing import Callable, Iterable, Sequence
+
+# Statuses after which a job does not change anymore
+FINISHED_STATUSES = frozenset({"completed", "failed", "cancelled"})
+
+
+class StageStats:
+    """
+    Item counter of one stage of a job.
+
+    Each stage has a single writer, so plain attribute updates are enough and readers never wait on a lock.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+
+    def add(self, count: int) -> None:
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+        self.items += count
+
+    def finish(self) -> None:
+        self.finished_at = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def items_per_second(self) -> float:
+        return self.items / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class PhaseProgress:
+    """
+    Progress of one phase in percent, with an ETA extrapolated from the rate since the phase started in this
+    process (a resumed phase starts above zero).
+    """
+
+    def __init__(self, value: float = 0.0):
+        self.value = value
+        self._start_value: float | None = None
+        self._started_at = 0.0
+
+    def set(self, value: float) -> None:
+        if self._start_value is None:
+            self._start_value, self._started_at = self.value, time.monotonic()
+        self.value = value
+
+    @property
+    def eta_seconds(self) -> float | None:
+        if self._start_value is None or self.value >= 100.0 or self.value < 0.0:
+            return None
+        done = self.value - self._start_value
+        if done <= 0:
+            return None
+        return (time.monotonic() - self._started_at) * (100.0 - self.value) / done
+
+
+class JobMetrics:
+    """
+    Live state of a job run by this process, read by the progress endpoints and `/metrics`.
+
+    Values that belong to a running pipeline (queue depths, bulk rejections) are read through callables set while
+    the pipeline exists.
+    """
+
+    def __init__(
+        self, job_id: str, status: str, processing_progress: float = 0.0, update_similar_progress: float = 0.0
+    ):
+        self.job_id = job_id
+        self.finished_at: float | None = None
+        self.status = status
+        self.processing = PhaseProgress(processing_progress)
+        self.similarity = PhaseProgress(update_similar_progress)
+        self.stages: dict[str, StageStats] = {}
+        self.queue_depths: Callable[[], dict[str, int]] | None = None
+        self.bulk_rejections: Callable[[], int] | None = None
+
+    @property
+    def status(self) -> str:
+        return self._status
+
+    @status.setter
+    def status(self, status: str) -> None:
+        self._status = status
+        self.finished_at = time.monotonic() if status in FINISHED_STATUSES else None
+
+    @property
+    def eta_seconds(self) -> float | None:
+        if self.status != "running":
+            return None
+        if self.processing.value < 100.0:
+            return self.processing.eta_seconds
+        return self.similarity.eta_seconds
+
+
+# name, type, help text and (labels, value) samples of a metric
+Metric = tuple[str, str, str, Sequence[tuple[str, float]]]
+
+
+def prune_finished_jobs(jobs: dict[str, JobMetrics], retention: float, max_finished: int) -> None:
+    """
+    Drops the jobs that finished more than `retention` seconds ago, and the oldest finished ones beyond
+    `max_finished`, so `/metrics` does not export a series for every job the process ever ran.
+    """
+    now = time.monotonic()
+    finished = sorted(
+        ((job.finished_at, job_id) for job_id, job in jobs.items() if job.finished_at is not None), reverse=True
+    )
+    for position, (finished_at, job_id) in enumerate(finished):
+        if position >= max_finished or now - finished_at > retention:
+            del jobs[job_id]
+
+
+def render_metrics(jobs: Iterable[JobMetrics], extra_metrics: Iterable[Metric] = ()) -> str:
+    """
+    Renders job metrics, followed by `extra_metrics`, in the Prometheus text exposition format.
+    """
+    jobs = list(jobs)
+    lines: list[str] = []
+
+    def metric(name: str, metric_type: str, help_text: str, samples: Sequence[tuple[str, float]]) -> None:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}" for labels, value in samples)
+
+    metric(
+        "goodsale_job_progress_percent",
+        "gauge",
+        "Progress of a job phase in percent.",
+        [(f'job_id="{job.job_id}",phase="ingest"', job.processing.value) for job in jobs]
+        + [(f'job_id="{job.job_id}",phase="similarity"', job.similarity.value) for job in jobs],
+    )
+    metric(
+        "goodsale_job_eta_seconds",
+        "gauge",
+        "Estimated seconds until the current phase of a job finishes.",
+        [(f'job_id="{job.job_id}"', eta) for job in jobs if (eta := job.eta_seconds) is not None],
+    )
+    metric(
+        "goodsale_stage_items_total",
+        "counter",
+        "Items processed by a job stage: offers parsed, rows written, documents indexed, similarity queries.",
+        [
+            (f'job_id="{job.job_id}",stage="{stage.name}"', stage.items)
+            for job in jobs
+            for stage in job.stages.values()
+        ],
+    )
+    metric(
+        "goodsale_stage_items_per_second",
+        "gauge",
+        "Average throughput of a job stage.",
+        [
+            (f'job_id="{job.job_id}",stage="{stage.name}"', round(stage.items_per_second, 3))
+            for job in jobs
+            for stage in job.stages.values()
+        ],
+    )
+    metric(
+        "goodsale_queue_depth",
+        "gauge",
+        "Batches waiting in a pipeline queue.",
+        [
+            (f'job_id="{job.job_id}",queue="{queue}"', depth)
+            for job in jobs
+            if job.queue_depths is not None
+            for queue, depth in job.queue_depths().items()
+        ],
+    )
+    metric(
+        "goodsale_es_bulk_rejections_total",
+        "counter",
+        "Bulk items Elasticsearch rejected with 429 and that were retried.",
+        [(f'job_id="{job.job_id}"', job.bulk_rejections()) for job in jobs if job.bulk_rejections is not None],
+    )
+    for name, metric_type, help_text, samples in extra_metrics:
+        metric(name, metric_type, help_text, samples)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,180 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from contextvars import ContextVar
+from types import FrameType, TracebackType
+from typing import Any, ContextManager
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# Profiler of the job the current task belongs to; tasks, `asyncio.to_thread` workers and the greenlets SQLAlchemy
+# runs its events in inherit it
+current_profiler: ContextVar["JobProfiler | None"] = ContextVar("current_profiler", default=None)
+
+NO_SPAN: ContextManager[None] = nullcontext()
+# Innermost frames of threads parked waiting for work, left out of the samples
+IDLE_FRAMES = frozenset(
+    {
+        ("threading.py", "wait"),
+        ("threading.py", "_wait_for_tstate_lock"),
+        ("queue.py", "get"),
+        ("thread.py", "_worker"),
+    }
+)
+MAX_STACK_DEPTH = 128
+
+
+class SpanStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+
+class Span:
+    def __init__(self, profiler: "JobProfiler", name: str):
+        self.profiler = profiler
+        self.name = name
+        self.started_at = 0.0
+
+    def __enter__(self) -> None:
+        self.started_at = time.perf_counter()
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.profiler.record(self.name, time.perf_counter() - self.started_at)
+
+
+class JobProfiler:
+    """
+    Timing spans of one run of an import job and, with `sample_interval`, the stacks of the process sampled while
+    it runs.
+
+    Span times are summed over every task that entered the span, so spans of stages running side by side add up
+    to more than the wall time. The sampler sees every thread of this process, including requests served and
+    other jobs run at the same time, but not the processes parsing shards of a sharded feed.
+    """
+
+    def __init__(self, sample_interval: float | None = None):
+        self.sample_interval = sample_interval
+        self.spans: dict[str, SpanStats] = {}
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+        self.started_at = time.perf_counter()
+        self.finished_at: float | None = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self.sample_interval is not None:
+            self._sampler = threading.Thread(target=self._sample, name="job-profiler", daemon=True)
+            self._sampler.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.finished_at = time.perf_counter()
+
+    def span(self, name: str) -> Span:
+        return Span(self, name)
+
+    def record(self, name: str, seconds: float) -> None:
+        # Spans are recorded from the event loop and from worker threads
+        with self._lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats(name)
+            stats.count += 1
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+
+    def breakdown(self) -> dict[str, Any]:
+        """
+        Span totals by name, with the wall time of the run and the number of samples taken.
+        """
+        wall_seconds = (self.finished_at or time.perf_counter()) - self.started_at
+        return {
+            "wall_seconds": wall_seconds,
+            "sample_interval": self.sample_interval,
+            "samples": self.samples,
+            "spans": [
+                {
+                    "name": stats.name,
+                    "count": stats.count,
+                    "seconds": stats.seconds,
+                    "max_seconds": stats.max_seconds,
+                    "share": stats.seconds / wall_seconds if wall_seconds > 0 else 0.0,
+                }
+                for stats in sorted(self.spans.values(), key=lambda stats: stats.seconds, reverse=True)
+            ],
+        }
+
+    def folded_stacks(self) -> str:
+        """
+        The samples in the folded format of flamegraph.pl, speedscope and inferno: one `frame;frame;... count`
+        line per distinct stack, outermost frame first.
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def _sample(self) -> None:
+        assert self.sample_interval is not None
+        own_thread_id = threading.get_ident()
+        while not self._stop.wait(self.sample_interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks: list[str] = []
+            for thread_id, frame in sys._current_frames().items():
+                code = frame.f_code
+                if thread_id == own_thread_id or (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                stacks.append(f"{thread_names.get(thread_id, thread_id)};{fold_stack(frame)}")
+            self.samples += 1
+            self.stacks.update(stacks)
+
+
+def fold_stack(frame: FrameType | None) -> str:
+    frames: list[str] = []
+    while frame is not None and len(frames) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+def profiled(name: str) -> ContextManager[None]:
+    """
+    A span of the current job's profiler, or a no-op when the job is not profiled.
+    """
+    profiler = current_profiler.get()
+    return profiler.span(name) if profiler is not None else NO_SPAN
+
+
+def profile_statements(engine: AsyncEngine) -> None:
+    """
+    Records the time `engine` spends executing statements in the driver (asyncpg and the round trip to Postgres) as
+    the `db.execute` span of the current job, apart from the time spent building them in SQLAlchemy.
+    """
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(
+        conn: Any, cursor: Any, statement: Any, parameters: Any, context: Any, many: Any
+    ) -> None:
+        if current_profiler.get() is not None:
+            conn.info.setdefault("profile_started_at", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn: Any, cursor: Any, statement: Any, parameters: Any, context: Any, many: Any) -> None:
+        profiler = current_profiler.get()
+        started_at = conn.info.get("profile_started_at")
+        if profiler is not None and started_at:
+            profiler.record("db.execute", time.perf_counter() - started_at.pop())
@@ -0,0 +1,318 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Iterator, Protocol, Sequence
+from uuid import UUID
+
+from src.database import get_import_db
+from src.models.src.modules.sku import SKU
+from src.services.elasticsearch_service import ElasticsearchService
+from src.services.metrics_service import StageStats
+from src.services.profiling_service import profiled
+from src.services.sku_service import SKUService
+
+logger = logging.getLogger(__name__)
+
+# Fields SKUs can be blocked on, with the keyword field of the Elasticsearch document holding the same value
+BLOCK_FIELDS = {
+    "category_id": "category_id",
+    "category_lvl_1": "category_lvl_1",
+    "category_lvl_2": "category_lvl_2",
+    "category_lvl_3": "category_lvl_3",
+    "brand": "vendor.keyword",
+}
+# The index of a level of SimilarityBlocks and the values of its fields
+Block = tuple[int, tuple[Any, ...]]
+
+
+class SimilarityBlocks:
+    """
+    Candidate blocks: a SKU is only matched against the SKUs that share its category or brand, so a phone case is
+    not compared with telescopes and every query searches a small part of the catalog.
+
+    `levels` go from the narrowest to the widest, each a comma-separated list of `BLOCK_FIELDS`, e.g.
+    `["category_id,brand", "category_id", "category_lvl_2"]`. A SKU is matched within its block of the first
+    level that holds at least `min_size` SKUs. When all its blocks are smaller it is matched within the widest one
+    that holds another SKU, and against the whole catalog when there is none (no category, or alone everywhere).
+    """
+
+    def __init__(self, levels: Sequence[str], min_size: int = 50):
+        self.levels = [tuple(field.strip() for field in level.split(",")) for level in levels]
+        unknown_fields = {field for level in self.levels for field in level if field not in BLOCK_FIELDS}
+        if unknown_fields:
+            raise ValueError(f"Unknown similarity block fields: {', '.join(sorted(unknown_fields))}")
+        self.min_size = min_size
+        # SKUs per block, by level
+        self.sizes: list[dict[tuple[Any, ...], int]] = []
+
+    async def load(self) -> None:
+        """
+        Counts the SKUs of every block.
+        """
+        sizes: list[dict[tuple[Any, ...], int]] = []
+        with profiled("similarity.blocks"):
+            async for session in get_import_db():
+                sku_service = SKUService(session)
+                for level in self.levels:
+                    sizes.append(await sku_service.count_blocks(level))
+        self.sizes = sizes
+        for level, level_sizes in zip(self.levels, sizes):
+            large_blocks = sum(1 for size in level_sizes.values() if size >= self.min_size)
+            logger.info(f"Similarity blocks by {','.join(level)}: {len(level_sizes)}, {large_blocks} large enough")
+
+    def block_of(self, sku: SKU) -> Block | None:
+        widest: Block | None = None
+        for level_index, level_sizes in enumerate(self.sizes):
+            values = self._values(sku, level_index)
+            if values is None:
+                continue
+            size = level_sizes.get(values, 0)
+            if size >= self.min_size:
+                return level_index, values
+            if size > 1:
+                widest = level_index, values
+        return widest
+
+    def blocks_containing(self, sku: SKU) -> Iterator[Block]:
+        """
+        Every block `sku` is a candidate in, that is every block it belongs to that another SKU can be matched in.
+        """
+        for level_index, level_sizes in enumerate(self.sizes):
+            values = self._values(sku, level_index)
+            if values is not None and level_sizes.get(values, 0) > 1:
+                yield level_index, values
+
+    def term_filters(self, block: Block) -> list[dict[str, Any]]:
+        level_index, values = block
+        return [{"term": {BLOCK_FIELDS[field]: str(value)}} for field, value in zip(self.levels[level_index], values)]
+
+    def _values(self, sku: SKU, level_index: int) -> tuple[Any, ...] | None:
+        values = tuple(getattr(sku, field) for field in self.levels[level_index])
+        return None if any(value is None for value in values) else values
+
+
+class DuplicateGroups:
+    """
+    Exact duplicates: SKUs sharing a barcode, or a brand and title, are linked to each other as similar SKUs
+    without being matched, so only the other SKUs cost a query.
+
+    Groups of more than `max_group_size` SKUs (placeholder barcodes, generic titles) are left to the matcher. A SKU
+    links to at most `max_links` of its duplicates, the ones sharing its barcode first.
+    """
+
+    def __init__(self, max_links: int = 5, max_group_size: int = 100):
+        self.max_links = max_links
+        self.max_group_size = max_group_size
+        self.duplicates: dict[UUID, list[UUID]] = {}
+
+    async def load(self) -> None:
+        with profiled("similarity.duplicates"):
+            async for session in get_import_db():
+                groups = await SKUService(session).get_duplicate_groups(self.max_group_size)
+        duplicates: dict[UUID, list[UUID]] = {}
+        for group in groups:
+            for sku_uuid in group:
+                linked = duplicates.setdefault(sku_uuid, [])
+                for duplicate_uuid in group:
+                    if len(linked) >= self.max_links:
+                        break
+                    if duplicate_uuid != sku_uuid and duplicate_uuid not in linked:
+                        linked.append(duplicate_uuid)
+        self.duplicates = duplicates
+        logger.info(f"Found {len(groups)} groups of duplicate SKUs, {len(duplicates)} SKUs in them")
+
+    def of(self, sku_uuid: UUID) -> list[UUID]:
+        return self.duplicates.get(sku_uuid, [])
+
+
+class SimilarityMatcher(Protocol):
+    """
+    Finds the SKUs most similar to each SKU of a chunk, for `SimilarityService`.
+    """
+
+    async def prepare(self) -> None:
+        """
+        Called once before the first chunk.
+        """
+
+    async def match(self, skus: Sequence[SKU]) -> list[list[tuple[str, float]] | None]:
+        """
+        The `(uuid, score)` pairs of similar SKUs per SKU in input order, or None for a SKU that could not be matched.
+        """
+
+    async def close(self) -> None:
+        """
+        Called once after the last chunk, also when matching failed.
+        """
+
+
+class ElasticsearchMatcher:
+    """
+    Matches SKUs with `more_like_this` queries against the `products` index for their `top_k` most similar SKUs,
+    sent in `_msearch` batches of `msearch_batch_size` with at most `max_concurrency` of them in flight.
+    """
+
+    def __init__(
+        self,
+        es_service: ElasticsearchService,
+        index_name: str,
+        msearch_batch_size: int = 100,
+        max_concurrency: int = 4,
+        blocks: SimilarityBlocks | None = None,
+        top_k: int = 5,
+    ):
+        self.es_service = es_service
+        self.index_name = index_name
+        self.msearch_batch_size = msearch_batch_size
+        self.blocks = blocks
+        self.top_k = top_k
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    async def prepare(self) -> None:
+        if self.blocks is None:
+            return
+        fields = {BLOCK_FIELDS[field] for level in self.blocks.levels for field in level}
+        if not await self.es_service.has_keyword_fields(self.index_name, sorted(fields)):
+            # Indices created before the fields were mapped, until the next full import
+            logger.warning(f"'{self.index_name}' has no keyword fields {sorted(fields)}, matching without blocks")
+            self.blocks = None
+            return
+        await self.blocks.load()
+
+    async def match(self, skus: Sequence[SKU]) -> list[list[tuple[str, float]] | None]:
+        batches = [skus[i : i + self.msearch_batch_size] for i in range(0, len(skus), self.msearch_batch_size)]
+        results = await asyncio.gather(*(self._match_batch(batch) for batch in batches))
+        return [hits for batch_results in results for hits in batch_results]
+
+    async def close(self) -> None:
+        pass
+
+    async def _match_batch(self, batch: Sequence[SKU]) -> list[list[tuple[str, float]] | None]:
+        filters: list[list[dict[str, Any]]] | None = None
+        if self.blocks is not None:
+            blocks = [self.blocks.block_of(sku) for sku in batch]
+            filters = [self.blocks.term_filters(block) if block is not None else [] for block in blocks]
+        async with self._slots:
+            return await self.es_service.msearch_similar(self.index_name, batch, filters, self.top_k)
+
+
+class SimilarityService:
+    """
+    Fills `similar_sku` for the whole catalog.
+
+    SKUs are streamed from Postgres in keyset-paginated chunks so memory stays flat regardless of catalog size.
+    Each chunk is matched by `matcher` (Elasticsearch or the local vectors) and written back with one bulk update
+    committed per chunk, together with the `similar_sku_snapshot` of the matches. With `duplicates` SKUs that have
+    exact duplicates get those as similar SKUs, with no score, and skip the matcher. When only unmatched SKUs are
+    read, the already matched duplicates of a SKU are written again with it, so they link back to it.
+    """
+
+    def __init__(
+        self,
+        matcher: SimilarityMatcher,
+        duplicates: DuplicateGroups | None = None,
+        chunk_size: int = 2000,
+        on_skus_changed: Callable[[list[UUID]], Awaitable[None]] | None = None,
+        on_checkpoint: Callable[[UUID], Awaitable[None]] | None = None,
+    ):
+        self.matcher = matcher
+        self.duplicates = duplicates
+        self.chunk_size = chunk_size
+        self.on_skus_changed = on_skus_changed
+        self.on_checkpoint = on_checkpoint
+        self.stats = StageStats("similarity")
+        # SKUs linked to their exact duplicates instead of matched
+        self.exact_matches = 0
+
+    async def update_all(
+        self,
+        on_progress: Callable[[float], Awaitable[None]],
+        only_unmatched: bool = False,
+        after_uuid: UUID | None = None,
+    ) -> int:
+        """
+        Matches every SKU, or with `only_unmatched` just the SKUs whose `similar_sku` is not computed yet.
+
+        `after_uuid` resumes an interrupted run after the last SKU it committed. `on_checkpoint` receives that uuid
+        after each committed chunk.
+        """
+        async for session in get_import_db():
+            sku_service = SKUService(session)
+            total_skus = await sku_service.count_skus(only_unmatched)
+            remaining_skus = await sku_service.count_skus(only_unmatched, after_uuid) if after_uuid else total_skus
+
+        processed_skus = total_skus - remaining_skus
+        if remaining_skus:
+            if self.duplicates is not None:
+                await self.duplicates.load()
+            await self.matcher.prepare()
+            try:
+                processed_skus = await self._update_chunks(
+                    on_progress, only_unmatched, after_uuid, processed_skus, total_skus
+                )
+            finally:
+                await self.matcher.close()
+
+        self.stats.finish()
+        logger.info(
+            f"Updated similar SKUs for {processed_skus} SKUs, {self.exact_matches} of them linked to exact duplicates"
+        )
+        return processed_skus
+
+    async def _update_chunks(
+        self,
+        on_progress: Callable[[float], Awaitable[None]],
+        only_unmatched: bool,
+        after_uuid: UUID | None,
+        processed_skus: int,
+        total_skus: int,
+    ) -> int:
+        while True:
+            with profiled("similarity.read"):
+                async for session in get_import_db():
+                    chunk = await SKUService(session).get_sku_chunk(after_uuid, self.chunk_size, only_unmatched)
+            if not chunk:
+                return processed_skus
+
+            with profiled("similarity.match"):
+                similar = await self._match_chunk(chunk, link_back=only_unmatched)
+            with profiled("similarity.write"):
+                async for session in get_import_db():
+                    async with session.begin():
+                        await SKUService(session).update_similar_skus(similar)
+            if self.on_skus_changed is not None:
+                await self.on_skus_changed(list(similar))
+
+            after_uuid = UUID(str(chunk[-1].uuid))
+            processed_skus += len(chunk)
+            await on_progress(min(processed_skus / total_skus, 1.0) if total_skus else 1.0)
+            if self.on_checkpoint is not None:
+                await self.on_checkpoint(after_uuid)
+
+    async def _match_chunk(
+        self, chunk: list[SKU], link_back: bool = False
+    ) -> dict[UUID, list[tuple[UUID, float | None]]]:
+        similar: dict[UUID, list[tuple[UUID, float | None]]] = {}
+        unmatched: list[SKU] = []
+        for sku in chunk:
+            duplicates = self.duplicates.of(UUID(str(sku.uuid))) if self.duplicates is not None else []
+            if duplicates:
+                similar[UUID(str(sku.uuid))] = [(duplicate_uuid, None) for duplicate_uuid in duplicates]
+            else:
+                unmatched.append(sku)
+        self.exact_matches += len(similar)
+
+        if link_back and self.duplicates is not None:
+            # Duplicates that are already matched are not read again, they get their links to this chunk here
+            chunk_uuids = {UUID(str(sku.uuid)) for sku in chunk}
+            for duplicate_uuid in {duplicate_uuid for hits in similar.values() for duplicate_uuid, _ in hits}:
+                if duplicate_uuid not in chunk_uuids:
+                    similar[duplicate_uuid] = [
+                        (linked_uuid, None) for linked_uuid in self.duplicates.of(duplicate_uuid)
+                    ]
+
+        results = await self.matcher.match(unmatched) if unmatched else []
+        self.stats.add(len(chunk))
+        for sku, hits in zip(unmatched, results):
+            if hits is not None:
+                similar[UUID(str(sku.uuid))] = [(UUID(similar_uuid), score) for similar_uuid, score in hits]
+        return similar
@@ -1,9 +1,34 @@
-from typing import Any, Optional
+import hashlib
+import json
+from typing import Any, Sequence
+from uuid import UUID
 
-from sqlalchemy import func, select
+from sqlalchemy import cast, column, delete, exists, func, null, or_, select, update, values
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from sqlalchemy.dialects.postgresql import UUID as PGUUID
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
 
 from src.models.src.modules.sku import SKU
+from src.models.src.modules.sku_import_key import SKUImportKey
+from src.models.src.modules.sku_similarity import SKUSimilarity
+
+# asyncpg refuses statements with more bind parameters than this
+MAX_BIND_PARAMS = 32767
+# Columns identifying a stored SKU, never overwritten by an upsert
+KEY_COLUMNS = ("uuid", "marketplace_id", "product_id")
+# Matches kept in `similar_sku` and its snapshot, `sku_similarity` has all of them
+SIMILAR_SKU_COUNT = 5
+
+
+def content_hash(row: dict[str, Any]) -> str:
+    content = {column: value for column, value in row.items() if column not in KEY_COLUMNS}
+    if content.get("features"):
+        # A `<param>` without a name is keyed None, which `sort_keys` cannot order among the names
+        content["features"] = {str(name): value for name, value in content["features"].items()}
+    serialized = json.dumps(content, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(serialized.encode(), digest_size=16).hexdigest()
 
 
 class SKUService:
@@ -15,33 +40,334 @@ class SKUService:
         sku: SKU | None = result.scalars().first()
         return sku
 
-    async def save_sku(self, sku_data: dict[str, Any]) -> None:
-        result = await self.session.execute(select(SKU).where(SKU.product_id == int(sku_data["offer_id"])))
-        existing_sku: Optional[SKU] = result.scalar_one_or_none()
-
-        if existing_sku is None:
-            sku = SKU(
-                uuid=sku_data["uuid"],
-                marketplace_id=sku_data["marketplace_id"],
-                product_id=int(sku_data["offer_id"]),
-                title=sku_data["name"],
-                description=sku_data["description"],
-                brand=sku_data["vendor"],
-                barcode=(int(sku_data["barcode"]) if sku_data["barcode"] and sku_data["barcode"].isdigit() else None),
-                category_id=(
-                    int(sku_data["category_id"])
-                    if sku_data["category_id"] and sku_data["category_id"].isdigit()
-                    else None
-                ),
-                category_lvl_1=sku_data["category_lvl_1"],
-                category_lvl_2=sku_data["category_lvl_2"],
-                category_lvl_3=sku_data["category_lvl_3"],
-                category_remaining=sku_data["category_remaining"],
-                features=sku_data["params"],
-                price_after_discounts=(float(sku_data["price"]) if sku_data["price"] else None),
-                first_image_url=sku_data["picture"],
-                currency=sku_data["currency_id"],
-                inserted_at=func.now(),
-                updated_at=func.now(),
-            )
-            self.session.add(sku)
+    async def get_skus_by_uuids(self, uuids: list[UUID], fields: Sequence[str] | None = None) -> list[SKU]:
+        """
+        Fetches many SKUs in one query, uuids that do not exist are skipped. With `fields` only those columns are
+        loaded.
+        """
+        if not uuids:
+            return []
+        query = select(SKU).where(SKU.uuid.in_(uuids))
+        if fields is not None:
+            query = query.options(load_only(*(getattr(SKU, field) for field in fields)))
+        result = await self.session.execute(query)
+        return list(result.scalars().all())
+
+    async def get_skus_by_product_ids(self, marketplace_id: int, product_ids: list[int]) -> list[SKU]:
+        """
+        Fetches many SKUs of one marketplace by their marketplace product ids in one query.
+        """
+        if not product_ids:
+            return []
+        result = await self.session.execute(
+            select(SKU).where(SKU.marketplace_id == marketplace_id, SKU.product_id.in_(product_ids))
+        )
+        return list(result.scalars().all())
+
+    @staticmethod
+    def build_row(sku_data: dict[str, Any]) -> dict[str, Any]:
+        row = {
+            "uuid": sku_data["uuid"],
+            "marketplace_id": sku_data["marketplace_id"],
+            "product_id": int(sku_data["offer_id"]),
+            "title": sku_data["name"],
+            "description": sku_data["description"],
+            "brand": sku_data["vendor"],
+            "barcode": (int(sku_data["barcode"]) if sku_data["barcode"] and sku_data["barcode"].isdigit() else None),
+            "category_id": (
+                int(sku_data["category_id"]) if sku_data["category_id"] and sku_data["category_id"].isdigit() else None
+            ),
+            "category_lvl_1": sku_data["category_lvl_1"],
+            "category_lvl_2": sku_data["category_lvl_2"],
+            "category_lvl_3": sku_data["category_lvl_3"],
+            "category_remaining": sku_data["category_remaining"],
+            "features": sku_data["params"],
+            "price_after_discounts": (float(sku_data["price"]) if sku_data["price"] else None),
+            "first_image_url": sku_data["picture"],
+            "currency": sku_data["currency_id"],
+        }
+        row["content_hash"] = content_hash(row)
+        return row
+
+    async def save_skus(self, batch: list[dict[str, Any]], incremental: bool = False) -> dict[int, UUID]:
+        """
+        Upserts a batch of parsed offers keyed on `(marketplace_id, product_id)`.
+
+        Rows are written with multi-row `INSERT ... ON CONFLICT DO UPDATE` statements. An existing row keeps its
+        uuid, so the returned `product_id -> uuid` mapping is what the caller must use for anything that refers
+        to the stored SKU (e.g. the Elasticsearch document id).
+
+        In incremental mode a row whose `content_hash` did not change is left untouched and is not returned, and a
+        changed row gets its `similar_sku` reset so the similarity phase picks it up again.
+        """
+        rows: dict[tuple[int, int], dict[str, Any]] = {}
+        for sku_data in batch:
+            row = self.build_row(sku_data)
+            # A single statement cannot update the same row twice, the last occurrence in the feed wins
+            rows[(row["marketplace_id"], row["product_id"])] = row
+        if not rows:
+            return {}
+
+        # Concurrent writers lock conflicting rows in the same order, which rules out deadlocks between them
+        ordered_rows = [rows[key] for key in sorted(rows)]
+        rows_per_statement = max(1, MAX_BIND_PARAMS // len(ordered_rows[0]))
+        stored_uuids: dict[int, UUID] = {}
+        for start in range(0, len(ordered_rows), rows_per_statement):
+            stmt = insert(SKU).values(ordered_rows[start : start + rows_per_statement])
+            update_columns: dict[str, Any] = {
+                column: stmt.excluded[column] for column in ordered_rows[0] if column not in KEY_COLUMNS
+            }
+            update_columns["updated_at"] = func.now()
+            if incremental:
+                update_columns["similar_sku"] = null()
+                update_columns["similar_sku_snapshot"] = null()
+            upsert = stmt.on_conflict_do_update(
+                index_elements=[SKU.marketplace_id, SKU.product_id],
+                set_=update_columns,
+                where=SKU.content_hash.is_distinct_from(stmt.excluded.content_hash) if incremental else None,
+            ).returning(SKU.product_id, SKU.uuid)
+            result = await self.session.execute(upsert)
+            stored_uuids.update({product_id: sku_uuid for product_id, sku_uuid in result.all()})
+        return stored_uuids
+
+    async def record_import_keys(self, job_id: str, batch: list[dict[str, Any]]) -> None:
+        keys = {(sku_data["marketplace_id"], int(sku_data["offer_id"])) for sku_data in batch}
+        rows = [
+            {"job_id": job_id, "marketplace_id": marketplace_id, "product_id": product_id}
+            for marketplace_id, product_id in sorted(keys)
+        ]
+        rows_per_statement = MAX_BIND_PARAMS // 3
+        for start in range(0, len(rows), rows_per_statement):
+            stmt = insert(SKUImportKey).values(rows[start : start + rows_per_statement])
+            await self.session.execute(stmt.on_conflict_do_nothing())
+
+    async def delete_missing_skus(self, job_id: str) -> list[UUID]:
+        """
+        Deletes the SKUs of the imported marketplaces that the import with `job_id` did not see.
+        """
+        seen = select(SKUImportKey.marketplace_id).where(SKUImportKey.job_id == job_id).distinct()
+        result = await self.session.execute(
+            delete(SKU)
+            .where(SKU.marketplace_id.in_(seen))
+            .where(
+                ~exists().where(
+                    SKUImportKey.job_id == job_id,
+                    SKUImportKey.marketplace_id == SKU.marketplace_id,
+                    SKUImportKey.product_id == SKU.product_id,
+                )
+            )
+            .returning(SKU.uuid)
+        )
+        return [UUID(str(sku_uuid)) for sku_uuid in result.scalars()]
+
+    async def has_import_keys(self, job_id: str) -> bool:
+        result = await self.session.execute(select(exists().where(SKUImportKey.job_id == job_id)))
+        return bool(result.scalar())
+
+    async def clear_import_keys(self, job_id: str) -> None:
+        await self.session.execute(delete(SKUImportKey).where(SKUImportKey.job_id == job_id))
+
+    async def reset_similar_skus(self, uuids: list[UUID]) -> list[UUID]:
+        """
+        Clears `similar_sku` of every SKU that lists one of `uuids` as similar, so it gets matched again and its
+        snapshot picks up the new titles.
+
+        Returns the uuids of the SKUs that were reset.
+        """
+        reset_uuids: list[UUID] = []
+        for start in range(0, len(uuids), MAX_BIND_PARAMS):
+            chunk = uuids[start : start + MAX_BIND_PARAMS]
+            reset_uuids += await self._reset_similar_skus_listing(cast(chunk, ARRAY(PGUUID(as_uuid=True))))
+        return reset_uuids
+
+    async def reset_neighbours_of_unmatched(self) -> list[UUID]:
+        """
+        Clears `similar_sku` of every SKU that lists a SKU whose `similar_sku` is not computed, which an incremental
+        import does to the SKUs it changed, so the neighbours of a changed SKU get matched again too.
+
+        Returns the uuids of the SKUs that were reset.
+        """
+        unmatched = select(func.array_agg(SKU.uuid)).where(SKU.similar_sku.is_(None)).scalar_subquery()
+        return await self._reset_similar_skus_listing(unmatched)
+
+    async def _reset_similar_skus_listing(self, uuids: Any) -> list[UUID]:
+        # Rows are locked in primary key order, so concurrent resets cannot deadlock on each other
+        listing = select(SKU.uuid).where(SKU.similar_sku.bool_op("&&")(uuids)).order_by(SKU.uuid).with_for_update()
+        result = await self.session.execute(
+            update(SKU)
+            .where(SKU.uuid.in_(listing))
+            .values(similar_sku=null(), similar_sku_snapshot=null())
+            .returning(SKU.uuid)
+        )
+        return [UUID(str(sku_uuid)) for sku_uuid in result.scalars()]
+
+    async def count_skus(self, only_unmatched: bool = False, after_uuid: UUID | None = None) -> int:
+        query = select(func.count()).select_from(SKU)
+        if only_unmatched:
+            query = query.where(SKU.similar_sku.is_(None))
+        if after_uuid is not None:
+            query = query.where(SKU.uuid > after_uuid)
+        result = await self.session.execute(query)
+        return int(result.scalar_one())
+
+    async def count_blocks(self, fields: Sequence[str]) -> dict[tuple[Any, ...], int]:
+        """
+        Returns the number of SKUs per combination of values of `fields`, without the SKUs where any is null.
+        """
+        columns = [getattr(SKU, field) for field in fields]
+        result = await self.session.execute(
+            select(*columns, func.count())
+            .where(*(sku_column.is_not(None) for sku_column in columns))
+            .group_by(*columns)
+        )
+        return {tuple(row[:-1]): row[-1] for row in result}
+
+    async def get_duplicate_groups(self, max_group_size: int) -> list[list[UUID]]:
+        """
+        Returns the uuids of the SKUs sharing a barcode, then of the SKUs sharing a brand and title (lowercased, with
+        whitespace collapsed), for every group of 2 to `max_group_size` SKUs.
+        """
+        title_key = func.md5(
+            func.concat_ws(
+                "\x1f",
+                func.lower(func.btrim(SKU.brand)),
+                func.lower(func.regexp_replace(func.btrim(SKU.title), r"\s+", " ", "g")),
+            )
+        )
+        keys = (
+            (SKU.barcode, [SKU.barcode.is_not(None)]),
+            (title_key, [SKU.brand.is_not(None), func.btrim(SKU.title) != ""]),
+        )
+        groups: list[list[UUID]] = []
+        for key, conditions in keys:
+            result = await self.session.execute(
+                select(func.array_agg(aggregate_order_by(SKU.uuid, SKU.uuid)))
+                .where(*conditions)
+                .group_by(key)
+                .having(func.count().between(2, max_group_size))
+            )
+            groups.extend(list(group) for group in result.scalars())
+        return groups
+
+    async def get_sku_chunk(self, after_uuid: UUID | None, limit: int, only_unmatched: bool = False) -> list[SKU]:
+        """
+        Returns the next `limit` SKUs ordered by uuid (keyset pagination), with only the fields matching needs.
+
+        With `only_unmatched` only SKUs whose `similar_sku` has not been computed yet are returned.
+        """
+        query = select(SKU).options(
+            load_only(
+                SKU.uuid,
+                SKU.title,
+                SKU.description,
+                SKU.brand,
+                SKU.category_id,
+                SKU.category_lvl_1,
+                SKU.category_lvl_2,
+                SKU.category_lvl_3,
+            )
+        )
+        if only_unmatched:
+            query = query.where(SKU.similar_sku.is_(None))
+        if after_uuid is not None:
+            query = query.where(SKU.uuid > after_uuid)
+        result = await self.session.execute(query.order_by(SKU.uuid).limit(limit))
+        return list(result.scalars().all())
+
+    async def update_similar_skus(self, similar: dict[UUID, list[tuple[UUID, float | None]]]) -> None:
+        """
+        Writes the matches of many SKUs: all of them to `sku_similarity`, replacing the previous ones, and the first
+        `SIMILAR_SKU_COUNT` to `similar_sku` and `similar_sku_snapshot` with `UPDATE ... FROM (VALUES ...)`
+        statements.
+
+        `similar` maps a SKU to its `(uuid, score)` matches, best first. The snapshot stores the title, price and
+        picture of each match as they are now, so reading a SKU with its neighbours needs no second query.
+        """
+        neighbours = await self._get_snapshot_fields(
+            {similar_uuid for hits in similar.values() for similar_uuid, _ in hits}
+        )
+        # Matches deleted since they were found are left out
+        stored_hits = {
+            sku_uuid: [(similar_uuid, score) for similar_uuid, score in hits if similar_uuid in neighbours]
+            for sku_uuid, hits in similar.items()
+        }
+        items = [
+            (
+                sku_uuid,
+                [similar_uuid for similar_uuid, _ in hits[:SIMILAR_SKU_COUNT]],
+                [{**neighbours[similar_uuid], "score": score} for similar_uuid, score in hits[:SIMILAR_SKU_COUNT]],
+            )
+            for sku_uuid, hits in stored_hits.items()
+        ]
+        # Each row binds the uuid, the similar_sku array and the snapshot
+        rows_per_statement = MAX_BIND_PARAMS // 3
+        for start in range(0, len(items), rows_per_statement):
+            rows = values(
+                column("uuid", PGUUID(as_uuid=True)),
+                column("similar_sku", ARRAY(PGUUID(as_uuid=True))),
+                column("similar_sku_snapshot", JSONB),
+                name="similar",
+            ).data(items[start : start + rows_per_statement])
+            await self.session.execute(
+                update(SKU)
+                .where(SKU.uuid == rows.c.uuid)
+                .values(similar_sku=rows.c.similar_sku, similar_sku_snapshot=rows.c.similar_sku_snapshot)
+            )
+        await self._replace_similarity_edges(stored_hits)
+
+    async def get_similar_skus(
+        self, sku_uuid: str, limit: int, min_score: float | None = None
+    ) -> list[dict[str, Any]]:
+        """
+        Returns the first `limit` similar SKUs of a SKU from `sku_similarity`, best first, in the format of
+        `similar_sku_snapshot` but with their current title, price and picture.
+
+        With `min_score` only matches scoring at least that are returned. Exact duplicates have no score and are
+        always returned.
+        """
+        query = (
+            select(
+                SKUSimilarity.similar_uuid,
+                SKUSimilarity.score,
+                SKU.title,
+                SKU.price_after_discounts,
+                SKU.first_image_url,
+            )
+            .join(SKU, SKU.uuid == SKUSimilarity.similar_uuid)
+            .where(SKUSimilarity.sku_uuid == sku_uuid)
+        )
+        if min_score is not None:
+            query = query.where(or_(SKUSimilarity.score.is_(None), SKUSimilarity.score >= min_score))
+        result = await self.session.execute(query.order_by(SKUSimilarity.rank).limit(limit))
+        return [
+            {"uuid": str(similar_uuid), "title": title, "price": price, "picture": picture, "score": score}
+            for similar_uuid, score, title, price, picture in result.all()
+        ]
+
+    async def _replace_similarity_edges(self, similar: dict[UUID, list[tuple[UUID, float | None]]]) -> None:
+        sku_uuids = list(similar)
+        for start in range(0, len(sku_uuids), MAX_BIND_PARAMS):
+            await self.session.execute(
+                delete(SKUSimilarity).where(SKUSimilarity.sku_uuid.in_(sku_uuids[start : start + MAX_BIND_PARAMS]))
+            )
+        edges = [
+            {"sku_uuid": sku_uuid, "rank": rank, "similar_uuid": similar_uuid, "score": score}
+            for sku_uuid, hits in similar.items()
+            for rank, (similar_uuid, score) in enumerate(hits, start=1)
+        ]
+        rows_per_statement = MAX_BIND_PARAMS // 4
+        for start in range(0, len(edges), rows_per_statement):
+            await self.session.execute(insert(SKUSimilarity).values(edges[start : start + rows_per_statement]))
+
+    async def _get_snapshot_fields(self, uuids: set[UUID]) -> dict[UUID, dict[str, Any]]:
+        snapshot_fields: dict[UUID, dict[str, Any]] = {}
+        uuid_list = list(uuids)
+        for start in range(0, len(uuid_list), MAX_BIND_PARAMS):
+            result = await self.session.execute(
+                select(SKU.uuid, SKU.title, SKU.price_after_discounts, SKU.first_image_url).where(
+                    SKU.uuid.in_(uuid_list[start : start + MAX_BIND_PARAMS])
+                )
+            )
+            for sku_uuid, title, price, picture in result.all():
+                snapshot_fields[sku_uuid] = {"uuid": str(sku_uuid), "title": title, "price": price, "picture": picture}
+        return snapshot_fields
@@ -0,0 +1,172 @@
+import asyncio
+import os
+import re
+import time
+from typing import AsyncIterator, BinaryIO
+
+from src.parsers.sources import Decompressor, GrowingFile, compression_of, make_decompressor
+
+# Bytes buffered before a write to disk
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class UploadOffsetMismatch(Exception):
+    def __init__(self, received: int):
+        super().__init__(f"The upload continues at byte {received}")
+        self.received = received
+
+
+def parse_content_range(header: str) -> tuple[int, int, int | None]:
+    """
+    Parses a `Content-Range: bytes <start>-<end>/<total or *>` request header into `(start, end, total)`.
+    """
+    match = CONTENT_RANGE_RE.fullmatch(header.strip())
+    if match is None:
+        raise ValueError(f"Invalid Content-Range: {header}")
+    start, end = int(match.group(1)), int(match.group(2))
+    total = None if match.group(3) == "*" else int(match.group(3))
+    if end < start or (total is not None and end >= total):
+        raise ValueError(f"Invalid Content-Range: {header}")
+    return start, end, total
+
+
+def split_compressed_name(filename: str) -> tuple[str, str | None]:
+    """
+    Returns the name of the decompressed file and the compression for `feed.xml.gz`-style names, or the name
+    unchanged and None.
+    """
+    compression = compression_of(filename)
+    return (os.path.splitext(filename)[0], compression) if compression else (filename, None)
+
+
+class FeedUpload:
+    """
+    A feed written to `<path>.part` and renamed to `path` once complete, so a partly written file is never taken
+    for a feed.
+
+    The body can arrive in several requests: `received` counts the bytes accepted so far as sent, i.e. before
+    decompression, and the next chunk has to start there. Only an uncompressed upload can be continued after a
+    restart of the app, as the state of the decompressor is lost with the process.
+
+    Jobs can read the feed while it is written through `source`. Compressed bodies are decompressed in the thread
+    that writes them to disk.
+    """
+
+    def __init__(
+        self, path: str, encoding: str | None = None, expected_size: int | None = None, idle_timeout: float = 600.0
+    ):
+        self.path = path
+        self.part_path = f"{path}.part"
+        self.encoding = encoding
+        self.received = 0
+        # Sizes sent by the client are of the compressed body and say nothing about the size of the feed
+        self.source = GrowingFile(self.part_path, expected_size if encoding is None else None, idle_timeout)
+        self._decompressor: Decompressor | None = make_decompressor(encoding) if encoding else None
+        self._file: BinaryIO | None = None
+        # Bytes as sent, decompressed when they are flushed
+        self._buffer = bytearray()
+        self._lock = asyncio.Lock()
+        self._last_active = time.monotonic()
+
+    @property
+    def complete(self) -> bool:
+        return self.source.finished and self.source.error is None
+
+    @property
+    def idle_seconds(self) -> float:
+        return 0.0 if self._lock.locked() else time.monotonic() - self._last_active
+
+    @property
+    def resumable(self) -> bool:
+        return self.encoding is None
+
+    async def start(self, resume: bool = False) -> None:
+        """
+        Opens the part file, with `resume` continuing an uncompressed one left by an earlier process.
+        """
+        resume = resume and self.encoding is None and os.path.isfile(self.part_path)
+        self._file = await asyncio.to_thread(self._open_file, resume)
+        self.received = self.source.written = os.path.getsize(self.part_path) if resume else 0
+
+    async def write(self, chunk: bytes) -> None:
+        self.received += len(chunk)
+        self._last_active = time.monotonic()
+        self._buffer += chunk
+        if len(self._buffer) >= WRITE_BUFFER_SIZE:
+            await self.flush()
+
+    async def write_from(self, offset: int, chunks: AsyncIterator[bytes]) -> None:
+        """
+        Writes a request body that continues the upload at `offset`. What arrived of a body that broke off is kept,
+        so the client can continue after it.
+        """
+        async with self._lock:
+            if offset != self.received:
+                raise UploadOffsetMismatch(self.received)
+            try:
+                async for chunk in chunks:
+                    await self.write(chunk)
+            finally:
+                self._last_active = time.monotonic()
+                await self.flush()
+
+    async def flush(self, final: bool = False) -> None:
+        """
+        Writes out the buffered bytes, with `final` also what the decompressor still holds.
+        """
+        if self._file is None or not (self._buffer or final):
+            return
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        self.source.written += await asyncio.to_thread(self._write_file, data, final)
+
+    async def finish(self) -> None:
+        """
+        Writes out the rest, syncs the part file and renames it into place.
+        """
+        await self.flush(final=True)
+        if self._file is not None:
+            await asyncio.to_thread(self._close_file, True)
+        os.replace(self.part_path, self.path)
+        self.source.finish()
+
+    async def abort(self, error: str) -> None:
+        """
+        Discards the upload, failing the readers of `source`.
+        """
+        if self._file is not None:
+            await asyncio.to_thread(self._close_file, False)
+        if os.path.isfile(self.part_path):
+            os.remove(self.part_path)
+        self.source.finish(error)
+
+    async def suspend(self, error: str) -> None:
+        """
+        Closes the part file and fails the readers of `source`, keeping the file so the upload can be resumed by a
+        later request.
+        """
+        await self.flush()
+        if self._file is not None:
+            await asyncio.to_thread(self._close_file, False)
+        self.source.finish(error)
+
+    def _open_file(self, append: bool) -> BinaryIO:
+        return open(self.part_path, "ab" if append else "wb")
+
+    def _write_file(self, data: bytes, final: bool = False) -> int:
+        assert self._file is not None
+        if self._decompressor is not None:
+            data = self._decompressor.decompress(data) + (self._decompressor.flush() if final else b"")
+        self._file.write(data)
+        # Readers of the growing file open it separately and only see what reached the OS
+        self._file.flush()
+        return len(data)
+
+    def _close_file(self, sync: bool) -> None:
+        assert self._file is not None
+        if sync:
+            os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None